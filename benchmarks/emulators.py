@@ -0,0 +1,201 @@
+"""
+Micro-benchmark suite for the emulation layer.
+
+Measures, for every Emulator backend, compressor:mode, shape (1D to 4D) and data type:
+    - compression and decompression throughput (MB/s)
+    - per-call overhead (time to process a tiny array)
+    - peak memory allocated through Python/NumPy during a compress-decompress cycle (tracemalloc)
+    - compression ratio and agreement with the reference backend (hdf5 filters)
+
+It runs offline with synthetic data. The results are saved to a JSON file that can be compared with
+the results of a previous run to detect regressions:
+
+    python benchmarks/emulators.py -o results.json
+    python benchmarks/emulators.py -o new_results.json --compare results.json
+
+"""
+import argparse
+import json
+import platform
+import socket
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Union
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+from enstools.encoding.api import VariableEncoding, lossy_compressors_and_modes
+from enstools.compression.emulators.filters_emulator import FilterEmulator
+from enstools.compression.emulators.registry import BENCHMARK_PARAMETERS, EMULATOR_BACKENDS, REFERENCE_BACKEND, \
+    supported_backends
+
+# Shapes with roughly one million elements
+SHAPES = {
+    1: (1048576,),
+    2: (1024, 1024),
+    3: (64, 128, 128),
+    4: (8, 32, 64, 64),
+}
+DTYPES = (np.float32, np.float64)
+
+# Shape used to measure the per-call overhead
+TINY_SHAPE = 4
+
+
+def synthetic_data(shape: tuple, dtype) -> np.ndarray:
+    """
+    Smooth synthetic field, similar to the one used in the tests.
+    """
+    random_generator = np.random.default_rng(seed=1)
+    data = gaussian_filter(15 + 8 * random_generator.standard_normal(shape), sigma=5)
+    return data.astype(dtype)
+
+
+def best_time(function: Callable, repetitions: int) -> float:
+    """
+    Return the best wall time of several calls to a function.
+    """
+    times = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def peak_memory(function: Callable) -> int:
+    """
+    Return the peak memory in bytes allocated through Python during a call to a function.
+    """
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def benchmark_case(backend: str, specification, data: np.ndarray, reference: np.ndarray,
+                   reference_ratio: float, repetitions: int) -> dict:
+    """
+    Benchmark a single backend with a given specification and data.
+    """
+    emulator_class = EMULATOR_BACKENDS[backend]
+    emulator = emulator_class(specification, data)
+    size_mb = data.nbytes / 1024 ** 2
+
+    if emulator_class is FilterEmulator:
+        # The filters can't decompress without compressing, so the decompression time is estimated as the
+        # difference between a full cycle and a compression.
+        compression_time = best_time(lambda: emulator.compressed_size(data), repetitions)
+        cycle_time = best_time(lambda: emulator.compress_and_decompress(data), repetitions)
+        decompression_time = max(cycle_time - compression_time, 1e-9)
+    else:
+        compressed = emulator.compress(data)
+        compression_time = best_time(lambda: emulator.compress(data), repetitions)
+        decompression_time = best_time(lambda: emulator.decompress(compressed), repetitions)
+
+    tiny = data.ravel()[:TINY_SHAPE ** data.ndim].reshape((TINY_SHAPE,) * data.ndim)
+    tiny_emulator = emulator_class(specification, tiny)
+    overhead = best_time(lambda: tiny_emulator.compress_and_decompress(tiny), repetitions)
+
+    decompressed = emulator.compress_and_decompress(data)
+    compression_ratio = emulator.compression_ratio()
+    return {
+        "compression_throughput": size_mb / compression_time,
+        "decompression_throughput": size_mb / decompression_time,
+        "overhead": overhead,
+        "peak_memory": peak_memory(lambda: emulator.compress_and_decompress(data)),
+        "compression_ratio": compression_ratio,
+        "compression_ratio_difference": abs(compression_ratio - reference_ratio) / reference_ratio,
+        "equivalent": bool(np.array_equal(decompressed, reference, equal_nan=True)),
+    }
+
+
+def run_benchmarks(repetitions: int = 3, dimensions=tuple(SHAPES)) -> dict:
+    """
+    Run the benchmarks for every backend, compressor:mode, shape and data type.
+    """
+    results = {}
+    for compressor, modes in lossy_compressors_and_modes.items():
+        for mode in modes:
+            specification = VariableEncoding(compressor=compressor, mode=mode, parameter=BENCHMARK_PARAMETERS[mode])
+            for dimension in dimensions:
+                for dtype in DTYPES:
+                    data = synthetic_data(SHAPES[dimension], dtype)
+                    reference_emulator = EMULATOR_BACKENDS[REFERENCE_BACKEND](specification, data)
+                    reference = reference_emulator.compress_and_decompress(data)
+                    reference_ratio = reference_emulator.compression_ratio()
+                    for backend in supported_backends(specification):
+                        key = f"{backend}|{compressor}:{mode}|{dimension}D|{np.dtype(dtype).name}"
+                        print(f"\r{key:50}", end="", file=sys.stderr)
+                        try:
+                            results[key] = benchmark_case(backend, specification, data, reference,
+                                                          reference_ratio, repetitions)
+                        except Exception as err:  # pylint: disable=broad-except
+                            results[key] = {"error": str(err)}
+    print(file=sys.stderr)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> int:
+    """
+    Print the cases in which the throughput decreased more than the tolerance with respect to a baseline.
+    Returns the number of regressions.
+    """
+    regressions = 0
+    for key, case in results.items():
+        previous = baseline.get(key)
+        if previous is None or "error" in case or "error" in previous:
+            continue
+        for metric in ["compression_throughput", "decompression_throughput"]:
+            change = case[metric] / previous[metric] - 1
+            if change < -tolerance:
+                regressions += 1
+                print(f"REGRESSION {key} {metric}: {previous[metric]:.1f} -> {case[metric]:.1f} MB/s "
+                      f"({change:+.0%})")
+    print(f"{regressions} regressions found.")
+    return regressions
+
+
+def main(arguments: Union[list, None] = None) -> int:
+    """
+    Entry point of the benchmark suite.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output", default="emulator_benchmark.json", help="Path of the output JSON file.")
+    parser.add_argument("--compare", default=None, help="Path to a previous JSON file to compare with.")
+    parser.add_argument("--tolerance", default=0.2, type=float,
+                        help="Relative throughput decrease considered a regression. Default=%(default)s")
+    parser.add_argument("--repetitions", default=3, type=int, help="Repetitions per measure. Default=%(default)s")
+    parser.add_argument("--dimensions", default=",".join(str(d) for d in SHAPES),
+                        help="Comma separated list of dimensions to benchmark. Default=%(default)s")
+    args = parser.parse_args(arguments)
+
+    dimensions = tuple(int(d) for d in args.dimensions.split(","))
+    output = {
+        "metadata": {
+            "host": socket.gethostname(),
+            "date": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+        },
+        "results": run_benchmarks(repetitions=args.repetitions, dimensions=dimensions),
+    }
+    with open(args.output, "w", encoding="utf-8") as stream:
+        json.dump(output, stream, indent=4, sort_keys=True)
+    print(f"Results saved in {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as stream:
+            baseline = json.load(stream)
+        return 1 if compare(output["results"], baseline["results"], args.tolerance) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,395 @@
+"""
+Mergeable accumulators to compute error metrics between a reference and a target in a single pass.
+
+The accumulators are updated chunk by chunk and can be merged with each other, which allows processing arrays
+that do not fit in memory and combining partial results computed by different workers.
+Moments are combined using the parallel algorithm from Chan et al. (1979), which is numerically stable
+(equivalent to Welford's algorithm when updating one element at a time).
+The histograms can either use fixed bin edges or adapt to the data (see MergeableHistogram), in which case the value
+range doesn't need to be known in advance and everything can be computed in a single reading pass.
+"""
+import copy
+from typing import Tuple, Union
+
+import numpy as np
+from scipy.stats import kstwo
+
+
+class ErrorAccumulator:
+    """
+    Accumulates the statistics needed to compute error metrics between a reference and a target.
+
+    The Kolmogorov-Smirnov metrics are computed from histograms, so they are only available when bin edges or a
+    number of adaptive bins are provided, and they are an approximation of the exact two-sample test.
+    """
+
+    def __init__(self, bin_edges: Union[np.ndarray, None] = None, bins: Union[int, None] = None):
+        """
+        Initialize an empty accumulator.
+
+        Parameters
+        ----------
+        bin_edges: numpy.ndarray, optional
+            Edges of the histogram bins used for the Kolmogorov-Smirnov metrics.
+            All the accumulators that will be merged need to share the same edges.
+        bins: int, optional
+            Number of bins of adaptive histograms (see MergeableHistogram), used when no bin edges are provided.
+            The accumulators that will be merged need to use the same number of bins.
+        """
+        self.count = 0
+        self.reference_mean = 0.
+        self.target_mean = 0.
+        self.reference_m2 = 0.
+        self.target_m2 = 0.
+        self.comoment = 0.
+        self.sum_squared_error = 0.
+        self.max_abs_error = 0.
+        self.max_error = -np.inf
+        self.min_error = np.inf
+        self.reference_min = np.inf
+        self.reference_max = -np.inf
+
+        self.bin_edges = bin_edges
+        self.bins = bins
+        if bin_edges is not None:
+            self.reference_histogram = np.zeros(len(bin_edges) - 1, dtype=np.int64)
+            self.target_histogram = np.zeros(len(bin_edges) - 1, dtype=np.int64)
+        elif bins is not None:
+            self.reference_histogram = MergeableHistogram(bins=bins)
+            self.target_histogram = MergeableHistogram(bins=bins)
+
+    @property
+    def has_histograms(self) -> bool:
+        """Whether the accumulator keeps the histograms needed by the Kolmogorov-Smirnov metrics."""
+        return self.bin_edges is not None or self.bins is not None
+
+    def update(self, reference: np.ndarray, target: np.ndarray) -> "ErrorAccumulator":
+        """
+        Add a chunk of data to the accumulator.
+
+        Parameters
+        ----------
+        reference: numpy.ndarray
+        target: numpy.ndarray
+
+        Returns
+        -------
+        ErrorAccumulator
+            The accumulator itself, to allow chaining.
+        """
+        chunk = ErrorAccumulator(bin_edges=self.bin_edges, bins=self.bins)
+        chunk.set_from_chunk(reference, target)
+        return self.merge(chunk)
+
+    def set_from_chunk(self, reference: np.ndarray, target: np.ndarray) -> None:
+        """
+        Initialize the accumulator statistics from a single chunk of data.
+        """
+        reference = np.asarray(reference, dtype=np.float64).ravel()
+        target = np.asarray(target, dtype=np.float64).ravel()
+        self.count = reference.size
+        if not self.count:
+            return
+
+        self.reference_mean = reference.mean()
+        self.target_mean = target.mean()
+        reference_anomaly = reference - self.reference_mean
+        target_anomaly = target - self.target_mean
+        self.reference_m2 = np.dot(reference_anomaly, reference_anomaly)
+        self.target_m2 = np.dot(target_anomaly, target_anomaly)
+        self.comoment = np.dot(reference_anomaly, target_anomaly)
+
+        difference = target - reference
+        self.sum_squared_error = np.dot(difference, difference)
+        self.max_error = difference.max()
+        self.min_error = difference.min()
+        self.max_abs_error = max(self.max_error, -self.min_error)
+        self.reference_min = reference.min()
+        self.reference_max = reference.max()
+
+        if self.bin_edges is not None:
+            # Values out of the bin range are counted in the outermost bins
+            edges_range = (self.bin_edges[0], self.bin_edges[-1])
+            self.reference_histogram = np.histogram(np.clip(reference, *edges_range), bins=self.bin_edges)[0]
+            self.target_histogram = np.histogram(np.clip(target, *edges_range), bins=self.bin_edges)[0]
+        elif self.bins is not None:
+            self.reference_histogram = MergeableHistogram(bins=self.bins).update(reference)
+            self.target_histogram = MergeableHistogram(bins=self.bins).update(target)
+
+    def merge(self, other: "ErrorAccumulator") -> "ErrorAccumulator":
+        """
+        Merge the statistics of another accumulator into this one.
+
+        Parameters
+        ----------
+        other: ErrorAccumulator
+
+        Returns
+        -------
+        ErrorAccumulator
+            The accumulator itself, to allow chaining.
+        """
+        if not other.count:
+            return self
+        if not self.count:
+            self.__dict__.update(copy.deepcopy(other.__dict__))
+            return self
+
+        count = self.count + other.count
+        reference_delta = other.reference_mean - self.reference_mean
+        target_delta = other.target_mean - self.target_mean
+        weight = self.count * other.count / count
+
+        self.reference_m2 += other.reference_m2 + reference_delta ** 2 * weight
+        self.target_m2 += other.target_m2 + target_delta ** 2 * weight
+        self.comoment += other.comoment + reference_delta * target_delta * weight
+        self.reference_mean += reference_delta * other.count / count
+        self.target_mean += target_delta * other.count / count
+        self.count = count
+
+        self.sum_squared_error += other.sum_squared_error
+        self.max_abs_error = max(self.max_abs_error, other.max_abs_error)
+        self.max_error = max(self.max_error, other.max_error)
+        self.min_error = min(self.min_error, other.min_error)
+        self.reference_min = min(self.reference_min, other.reference_min)
+        self.reference_max = max(self.reference_max, other.reference_max)
+
+        if self.bin_edges is not None:
+            self.reference_histogram += other.reference_histogram
+            self.target_histogram += other.target_histogram
+        elif self.bins is not None:
+            self.reference_histogram.merge(other.reference_histogram)
+            self.target_histogram.merge(other.target_histogram)
+        return self
+
+    @property
+    def mean_square_error(self) -> float:
+        """Mean square error between reference and target."""
+        return self.sum_squared_error / self.count
+
+    @property
+    def pearson_correlation(self) -> float:
+        """Pearson correlation between reference and target. NaN if one of them is constant, as scipy.stats.pearsonr."""
+        denominator = np.sqrt(self.reference_m2 * self.target_m2)
+        if denominator == 0.:
+            return np.nan
+        return float(np.clip(self.comoment / denominator, -1., 1.))
+
+    def kolmogorov_smirnov(self) -> Tuple[float, float]:
+        """
+        Approximation of the two-sample Kolmogorov-Smirnov test using the accumulated histograms.
+
+        Returns
+        -------
+        statistic, pvalue: float, float
+        """
+        if not self.has_histograms:
+            raise AssertionError("The accumulator needs histograms to compute the Kolmogorov-Smirnov test.")
+        if self.bin_edges is not None:
+            reference_counts, target_counts = self.reference_histogram, self.target_histogram
+        else:
+            reference_counts, target_counts = self.reference_histogram.aligned_counts(self.target_histogram)
+        reference_cdf = np.cumsum(reference_counts) / self.count
+        target_cdf = np.cumsum(target_counts) / self.count
+        statistic = float(np.max(np.abs(reference_cdf - target_cdf)))
+        # Same asymptotic distribution used by scipy.stats.ks_2samp, with two samples of equal size.
+        effective_size = round(self.count / 2)
+        pvalue = float(np.clip(kstwo.sf(statistic, max(effective_size, 1)), 0., 1.))
+        return statistic, pvalue
+
+    def results(self) -> dict:
+        """
+        Compute the metrics from the accumulated statistics.
+        The names of the metrics follow the ones of enstools.scores.
+
+        Returns
+        -------
+        dict
+            A dictionary with the metric names as keys and floats as values.
+        """
+        mse = self.mean_square_error
+        value_range = self.reference_max - self.reference_min
+        correlation = self.pearson_correlation
+        # As enstools.scores.pearson_correlation_index, an undefined correlation gives an index of 0
+        correlation_index = 0. if np.isnan(correlation) else correlation
+        with np.errstate(divide="ignore"):
+            metrics = {
+                "mean_square_error": mse,
+                "root_mean_square_error": np.sqrt(mse),
+                "max_abs_error": float(self.max_abs_error),
+                "max_error": float(self.max_error),
+                "min_error": float(self.min_error),
+                "pearson_correlation": correlation,
+                "correlation_I": np.inf if correlation_index == 1.0 else float(-np.log10(1 - correlation_index)),
+                "peak_signal_to_noise_ratio": float(20 * np.log10(value_range) - 10 * np.log10(mse)),
+            }
+        if self.has_histograms:
+            statistic, pvalue = self.kolmogorov_smirnov()
+            metrics["ks_statistic"] = statistic
+            metrics["kolmogorov_smirnov"] = pvalue
+            metrics["ks_I"] = float(-np.log10(1 - pvalue)) if pvalue < 1.0 else np.inf
+        return metrics
+
+
+class MergeableHistogram:
+    """
+    Histogram with a fixed number of bins whose edges adapt to the data, so the value range doesn't need to be known
+    in advance.
+
+    The bins have a width of 2**exponent and their edges are multiples of the width. The grids of different exponents
+    are nested, so a histogram can be coarsened exactly by adding up groups of neighbouring bins, which allows merging
+    histograms built from data with different value ranges. The width is the smallest one that fits the value range
+    in the number of bins, which is less than 4 * (maximum - minimum) / bins for data that is not constant.
+    """
+
+    def __init__(self, bins: int = 1000):
+        """
+        Initialize an empty histogram.
+
+        Parameters
+        ----------
+        bins: int, optional, default=1000
+            Number of bins.
+        """
+        self.bins = bins
+        # The left edge of the bin i is (offset + i) * 2**exponent. The exponent is None while the histogram is empty.
+        self.exponent = None
+        self.offset = 0
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.minimum = np.inf
+        self.maximum = -np.inf
+
+    @property
+    def count(self) -> int:
+        """Number of values in the histogram."""
+        return int(self.counts.sum())
+
+    @property
+    def bin_edges(self) -> np.ndarray:
+        """Edges of the bins."""
+        if self.exponent is None:
+            return np.arange(self.bins + 1, dtype=np.float64)
+        return np.ldexp(np.arange(self.offset, self.offset + self.bins + 1, dtype=np.float64), self.exponent)
+
+    def update(self, values: np.ndarray) -> "MergeableHistogram":
+        """
+        Add values to the histogram. Non-finite values are ignored.
+
+        Returns
+        -------
+        MergeableHistogram
+            The histogram itself, to allow chaining.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[np.isfinite(values)]
+        if not values.size:
+            return self
+        minimum, maximum = values.min(), values.max()
+
+        # Bins narrower than the spacing of the floating point numbers would be useless, and they would require
+        # huge bin indices.
+        scale = max(abs(minimum), abs(maximum))
+        exponent = np.frexp(scale)[1] - 53 if scale > 0 else 0
+        if maximum > minimum:
+            exponent = max(exponent, int(np.ceil(np.log2((maximum - minimum) / self.bins))))
+        while _bin_index(maximum, exponent) - _bin_index(minimum, exponent) >= self.bins:
+            exponent += 1
+
+        chunk = MergeableHistogram(bins=self.bins)
+        chunk.exponent = exponent
+        chunk.offset = _bin_index(minimum, exponent)
+        indices = (np.floor(np.ldexp(values, -exponent)) - chunk.offset).astype(np.int64)
+        chunk.counts = np.bincount(indices, minlength=self.bins)
+        chunk.minimum, chunk.maximum = minimum, maximum
+        return self.merge(chunk)
+
+    def merge(self, other: "MergeableHistogram") -> "MergeableHistogram":
+        """
+        Merge another histogram with the same number of bins into this one.
+
+        Returns
+        -------
+        MergeableHistogram
+            The histogram itself, to allow chaining.
+        """
+        if other.exponent is None:
+            return self
+        if self.exponent is None:
+            self.exponent, self.offset, self.counts = other.exponent, other.offset, other.counts.copy()
+        else:
+            exponent, offset = self._common_grid(other)
+            self.counts = self._counts_on(exponent, offset) + other._counts_on(exponent, offset)
+            self.exponent, self.offset = exponent, offset
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        return self
+
+    def aligned_counts(self, other: "MergeableHistogram") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the counts of both histograms on a common set of bins.
+        """
+        if self.exponent is None or other.exponent is None:
+            return self.counts, other.counts
+        exponent, offset = self._common_grid(other)
+        return self._counts_on(exponent, offset), other._counts_on(exponent, offset)
+
+    def quantile(self, quantile: float) -> float:
+        """
+        Approximate a quantile of the values, assuming that they are evenly distributed inside each bin.
+        The result is bounded by the minimum and maximum values.
+        """
+        if self.exponent is None:
+            return np.nan
+        cumulative = np.cumsum(self.counts)
+        rank = quantile * cumulative[-1]
+        index = min(int(np.searchsorted(cumulative, rank)), self.bins - 1)
+        previous = cumulative[index - 1] if index else 0
+        fraction = (rank - previous) / self.counts[index] if self.counts[index] else 0.
+        value = np.ldexp(self.offset + index + fraction, self.exponent)
+        return float(np.clip(value, self.minimum, self.maximum))
+
+    def _occupied(self, exponent: int) -> Tuple[int, int]:
+        """
+        Indices of the first and last non-empty bins on the grid of a (greater or equal) exponent.
+        """
+        occupied = np.flatnonzero(self.counts)
+        shift = exponent - self.exponent
+        return (self.offset + int(occupied[0])) >> shift, (self.offset + int(occupied[-1])) >> shift
+
+    def _common_grid(self, other: "MergeableHistogram") -> Tuple[int, int]:
+        """
+        Find the finest grid that fits the values of both histograms, as an exponent and an offset.
+        """
+        exponent = max(self.exponent, other.exponent)
+        while True:
+            (first, last), (other_first, other_last) = self._occupied(exponent), other._occupied(exponent)
+            offset = min(first, other_first)
+            if max(last, other_last) - offset < self.bins:
+                return exponent, offset
+            exponent += 1
+
+    def _counts_on(self, exponent: int, offset: int) -> np.ndarray:
+        """
+        Counts of the histogram coarsened to the grid of a (greater or equal) exponent starting at a given offset.
+        """
+        occupied = np.flatnonzero(self.counts)
+        indices = ((self.offset + occupied) >> (exponent - self.exponent)) - offset
+        counts = np.zeros(self.bins, dtype=np.int64)
+        np.add.at(counts, indices, self.counts[occupied])
+        return counts
+
+
+def _bin_index(value: float, exponent: int) -> int:
+    """
+    Index of the bin of width 2**exponent that contains a value.
+    """
+    return int(np.floor(np.ldexp(value, -exponent)))
+
+
+def histogram_bin_edges(minimum: float, maximum: float, bins: int = 1000) -> np.ndarray:
+    """
+    Return evenly spaced bin edges covering the given value range.
+    """
+    if minimum == maximum:
+        maximum = minimum + 1.
+    return np.linspace(minimum, maximum, bins + 1)
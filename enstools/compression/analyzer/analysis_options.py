@@ -7,23 +7,33 @@ from typing import Union
 from enstools.core.errors import EnstoolsError
 from enstools.encoding.api import lossy_compressors_and_modes
 
+# Throughput constraints, in MB/s. They are measured after finding the parameters that fulfill the other constraints.
+THROUGHPUT_LABELS = ("compression_speed", "decompression_speed")
+
 
 @dataclass
 class AnalysisOptions:
     """
     A class representing analysis options, including compressor, mode,
     constraints, and thresholds.
+
+    The thresholds can include throughput constraints (compression_speed and decompression_speed, in MB/s).
+    The objective is an optional dictionary of weights used to select between the encodings that fulfill the
+    constraints, i.e. {"compression_ratio": 1, "decompression_speed": 0.5}. The selected encoding is the one that
+    maximises the weighted sum of the logarithms of these metrics.
     """
     compressor: str
     mode: str
     constrains: str
     thresholds: dict
+    objective: Union[dict, None]
 
     def __init__(self,
                  compressor: Union[str, None],
                  mode: Union[str, None],
                  constrains: Union[None, str] = None,
                  thresholds: Union[None, dict] = None,
+                 objective: Union[None, str, dict] = None,
                  ):
         self.compressor = str(compressor)
 
@@ -38,6 +48,33 @@ class AnalysisOptions:
         else:
             raise AssertionError("Only one of the two arguments should be provided.")
 
+        if not self.quality_thresholds:
+            raise AssertionError("At least one quality or compression ratio constrain should be provided.")
+
+        self.objective = from_csv_to_dict(objective) if isinstance(objective, str) else objective
+
+    @property
+    def quality_thresholds(self) -> dict:
+        """
+        Thresholds of the quality metrics and the compression ratio, which are used to find the compression parameter.
+        """
+        return {key: value for key, value in self.thresholds.items() if key not in THROUGHPUT_LABELS}
+
+    @property
+    def throughput_thresholds(self) -> dict:
+        """
+        Thresholds of the compression and decompression speeds, in MB/s.
+        """
+        return {key: value for key, value in self.thresholds.items() if key in THROUGHPUT_LABELS}
+
+    @property
+    def needs_throughput(self) -> bool:
+        """
+        Whether the compression and decompression speeds need to be measured.
+        """
+        metrics = [*self.thresholds, *(self.objective or {})]
+        return any(metric in THROUGHPUT_LABELS for metric in metrics)
+
 
 @dataclass
 class AnalysisParameters:
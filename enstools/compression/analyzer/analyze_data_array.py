@@ -18,20 +18,22 @@ import numpy as np
 import xarray
 
 import enstools.encoding.chunk_size
-from enstools.compression.emulators import DefaultEmulator
+from enstools.compression.emulators import DefaultEmulator, get_emulator
 from enstools.compression.errors import ConditionsNotFulfilledError, ConstantValues
+from enstools.compression.chunking import write_chunk_sizes
 from enstools.compression.slicing import MultiDimensionalSliceCollection
 from enstools.encoding.api import VariableEncoding
-from enstools.encoding.dataset_encoding import find_chunk_sizes, convert_to_bytes
 from enstools.encoding.rules import COMPRESSION_SPECIFICATION_SEPARATOR
 from .analysis_options import AnalysisOptions
 from .analyzer_utils import get_metrics, get_parameter_range, bisection_method
-from enstools.compression.emulation import emulate_compression_on_data_array
 
 # These metrics will be used to select within the different encodings when aiming at a certain compression ratio.
 ANALYSIS_DIAGNOSTIC_METRICS = ["correlation_I", "ssim_I"]
 COMPRESSION_RATIO_LABEL = "compression_ratio"
 
+# Number of times the compression is repeated to measure the throughput, the fastest one is kept.
+THROUGHPUT_REPETITIONS = 3
+
 COUNTER = 0
 
 
@@ -47,9 +49,8 @@ def find_direct_relation(parameter_range, function_to_nullify):
 
 
 def get_one_slice(data_array: xarray.DataArray, chunk_size: str = "100KB"):
-    chunk_memory_size = convert_to_bytes(chunk_size)
-    chunk_sizes = find_chunk_sizes(data_array, chunk_memory_size)
-    chunk_sizes = [chunk_sizes[dim] for dim in data_array.dims]
+    # The slices follow the same chunk layout logic as the writer.
+    chunk_sizes = write_chunk_sizes(data_array, chunk_size=chunk_size)
     multi_dimensional_slice = MultiDimensionalSliceCollection(shape=data_array.shape, chunk_sizes=chunk_sizes)
     big_chunk_size = max(set([s.size for s in multi_dimensional_slice.objects.ravel()]))
     big_chunks = [s for s in multi_dimensional_slice.objects.ravel() if s.size == big_chunk_size]
@@ -81,12 +82,11 @@ def analyze_data_array(data_array: xarray.DataArray, options: AnalysisOptions) -
         warnings.warn(warning_message)
 
         # In case all values are constant, return lossless.
-        # First let's find out the compression ratio
-        _, metrics = emulate_compression_on_data_array(data_array,
-                                                       compression_specification=VariableEncoding("lossless"),
-                                                       in_place=False)
+        # First let's find out the compression ratio, there is no need to decompress the data for that.
+        emulator = DefaultEmulator(VariableEncoding("lossless"), data_array.values)
+        compressed_size = emulator.compressed_size(data_array.values)
 
-        return "lossless", metrics
+        return "lossless", {COMPRESSION_RATIO_LABEL: data_array.values.nbytes / compressed_size}
 
     # Compute the range of the data values in the slice
     data_range = np.ptp(data_array.values)  # ptp (peak-to-peak) calculates the range
@@ -135,6 +135,14 @@ def analyze_data_array(data_array: xarray.DataArray, options: AnalysisOptions) -
             get_metric_from_parameter, _, _ = define_functions_to_optimize(data_array, new_options)
             metrics = get_metric_from_parameter(parameter)
 
+    # The throughput is only measured for the selected parameter
+    if options.needs_throughput:
+        metrics.update(measure_throughput(data_array.values, options, parameter))
+        for metric, threshold in options.throughput_thresholds.items():
+            if metrics[metric] < threshold:
+                raise ConditionsNotFulfilledError(
+                    f"{metric}={metrics[metric]:.1f}MB/s is below the threshold of {threshold}MB/s.")
+
     # Define compression specification
     separator = COMPRESSION_SPECIFICATION_SEPARATOR
     compression_spec = f"{separator}".join(["lossy",
@@ -147,15 +155,37 @@ def analyze_data_array(data_array: xarray.DataArray, options: AnalysisOptions) -
     return compression_spec, metrics
 
 
+def measure_throughput(data: np.ndarray, options: AnalysisOptions, parameter: float) -> dict:
+    """
+    Measure the compression and decompression speeds in MB/s achieved with a given compression parameter.
+    """
+    encoding = VariableEncoding(compressor=options.compressor, mode=options.mode, parameter=parameter)
+    emulator = get_emulator(encoding, data.dtype)(encoding, data)
+    buffer = np.empty_like(data)
+    compression_time = decompression_time = np.inf
+    for _ in range(THROUGHPUT_REPETITIONS):
+        emulator.compress_and_decompress(data, out=buffer)
+        compression_time = min(compression_time, emulator.compression_time)
+        decompression_time = min(decompression_time, emulator.decompression_time)
+    size_in_megabytes = data.nbytes / 1024 ** 2
+    return {
+        "compression_speed": size_in_megabytes / compression_time,
+        "decompression_speed": size_in_megabytes / decompression_time,
+    }
+
+
 def define_functions_to_optimize(data_array: xarray.DataArray, options: AnalysisOptions) -> \
         Tuple[Callable, Callable, Callable]:
     """
     Function to get methods that will be used to perform a bisection method and find proper compression parameters.
     """
-    thresholds = options.thresholds
+    thresholds = options.quality_thresholds
     global COUNTER
     COUNTER = 0
 
+    # The same buffer is reused to store the decompressed data in all the evaluations.
+    decompressed_buffer = np.empty_like(data_array.values)
+
     # Using a cache allows us to avoid recomputing when using the same parameters.
     # @functools.lru_cache
     def get_metrics_from_parameter(parameter: float) -> dict:
@@ -166,19 +196,23 @@ def define_functions_to_optimize(data_array: xarray.DataArray, options: Analysis
         global COUNTER
         COUNTER += 1
 
-        target = data_array.copy(deep=True)
-
         # Set buffers
         uncompressed_data = data_array.values
 
         # Get encoding from options:
         encoding = VariableEncoding(compressor=options.compressor, mode=options.mode, parameter=parameter)
         # Create compressor for case
-        analysis_compressor = DefaultEmulator(encoding, uncompressed_data)
+        analysis_compressor = get_emulator(encoding, uncompressed_data.dtype)(encoding, uncompressed_data)
+
+        # If the compression ratio is the only constrain, we can skip the decompression and the quality metrics.
+        if [*thresholds] == [COMPRESSION_RATIO_LABEL]:
+            compressed_size = analysis_compressor.compressed_size(uncompressed_data)
+            return {COMPRESSION_RATIO_LABEL: uncompressed_data.nbytes / compressed_size}
+
         # Compress and decompress data
-        decompressed = analysis_compressor.compress_and_decompress(uncompressed_data)
+        decompressed = analysis_compressor.compress_and_decompress(uncompressed_data, out=decompressed_buffer)
         # Assign values to target data_array (need to use enstools metrics)
-        target.values = decompressed
+        target = data_array.copy(data=decompressed)
 
         # Get compression ratio
         compression_ratio = analysis_compressor.compression_ratio()
@@ -193,7 +227,7 @@ def define_functions_to_optimize(data_array: xarray.DataArray, options: Analysis
 
         """
         metrics = get_metrics_from_parameter(parameter)
-        return min(metrics[metric] - options.thresholds[metric] for metric in thresholds.keys())
+        return min(metrics[metric] - thresholds[metric] for metric in thresholds.keys())
 
     def constrain(parameter):
         """
@@ -50,6 +50,9 @@ def select_optimal_encoding(encodings: dict, metrics: dict, options: AnalysisOpt
     with the highest compression ratio.
     """
 
+    if options.objective:
+        return select_optimal_encoding_based_on_objective(encodings, metrics, options.objective)
+
     if COMPRESSION_RATIO_LABEL in options.thresholds:
         return select_optimal_encoding_based_on_quality_metrics(encodings, metrics)
 
@@ -106,6 +109,38 @@ def select_optimal_encoding_based_on_quality_metrics(encodings: dict, metrics: d
     return selected_encodings, selected_metrics
 
 
+def select_optimal_encoding_based_on_objective(encodings: dict, metrics: dict, objective: dict) -> Tuple[Dict, Dict]:
+    """
+    Within the encodings provided, the one that maximises the weighted sum of the logarithms of the metrics
+    in the objective is selected, i.e. {"decompression_speed": 1} selects the encoding with the fastest
+    decompression and {"compression_ratio": 1, "decompression_speed": 1} the one with the highest product of
+    compression ratio and decompression speed.
+    """
+
+    def score(variable_metrics: dict) -> float:
+        return sum(weight * np.log(variable_metrics[metric]) for metric, weight in objective.items()
+                   if metric in variable_metrics)
+
+    # Unpack keys
+    combinations = [*encodings]
+    variables = [*encodings[combinations[0]]]
+
+    best_combination = {}
+    for variable in variables:
+        best_score = -np.inf
+        for combination in combinations:
+            if variable in metrics[combination] and \
+                    (variable not in best_combination or score(metrics[combination][variable]) > best_score):
+                best_score = score(metrics[combination][variable])
+                best_combination[variable] = combination
+
+    selected_encodings = {variable: encodings[combination][variable] for variable, combination in
+                          best_combination.items()}
+    selected_metrics = {variable: metrics[combination][variable] for variable, combination in
+                        best_combination.items()}
+    return selected_encodings, selected_metrics
+
+
 def find_encodings_for_all_combinations(dataset: xarray.Dataset, options: AnalysisOptions):
     """
     Given a dataset and certain analysis options, find the compression parameters that fulfill the requirements for each
@@ -150,7 +185,8 @@ def find_encodings_for_all_combinations(dataset: xarray.Dataset, options: Analys
             try:
                 variable_encoding, variable_metrics = analyze_data_array(
                     data_array=dataset[var],
-                    options=AnalysisOptions(compressor, mode, thresholds=options.thresholds)
+                    options=AnalysisOptions(compressor, mode, thresholds=options.thresholds,
+                                            objective=options.objective)
                 )
                 combination_encoding[var] = variable_encoding
                 combination_metrics[var] = variable_metrics
@@ -177,6 +213,7 @@ def analyze_files(file_paths: Union[Path, List[Path]],
                   grid: str = None,
                   fill_na: Union[float, bool] = False,
                   variables: List = None,
+                  objective: Union[str, dict, None] = None,
                   ):
     """
     Finds optimal compression parameters for a list of files to fulfill certain thresholds.
@@ -191,6 +228,8 @@ def analyze_files(file_paths: Union[Path, List[Path]],
     :param grid:
     :param fill_na:
     :param variables:
+    :param objective: weights of the metrics used to select between the encodings that fulfill the constrains,
+                      i.e. "compression_ratio:1,decompression_speed:1".
     :return:
     """
 
@@ -213,6 +252,7 @@ def analyze_files(file_paths: Union[Path, List[Path]],
                                         mode=mode,
                                         fill_na=fill_na,
                                         variables=variables,
+                                        objective=objective,
                                         )
 
     save_encoding(encoding, output_file, file_format)
@@ -226,6 +266,7 @@ def analyze_dataset(dataset: xarray.Dataset,
                     mode: str = None,
                     fill_na: Union[float, bool] = False,
                     variables: List = None,
+                    objective: Union[str, dict, None] = None,
                     ):
     """
     Finds optimal compression parameters for a dataset to fulfill certain thresholds.
@@ -236,6 +277,8 @@ def analyze_dataset(dataset: xarray.Dataset,
     :param mode:
     :param fill_na:
     :param variables:
+    :param objective: weights of the metrics used to select between the encodings that fulfill the constrains.
+                      Throughput constrains and objectives (compression_speed, decompression_speed) are in MB/s.
     :return:
     """
     if variables is not None:
@@ -244,7 +287,7 @@ def analyze_dataset(dataset: xarray.Dataset,
     if fill_na is not False:
         dataset = dataset.fillna(fill_na)
 
-    options = AnalysisOptions(compressor=compressor, mode=mode, constrains=constrains)
+    options = AnalysisOptions(compressor=compressor, mode=mode, constrains=constrains, objective=objective)
     encodings, metrics = find_optimal_encoding(dataset, options)
     if not encodings:
         raise ConditionsNotFulfilledError(
@@ -10,6 +10,9 @@ from .pruner import pruner
 from .compressor import compress
 from .analyzer.analyzer import analyze_files, analyze_dataset
 from .significant_bits import analyze_file_significant_bits
-from .evaluator import evaluate
+from .evaluator import evaluate, evaluate_batch, evaluate_sweep
+from .streaming_metrics import stream_metrics
+from .estimator import estimate
 from .emulation import emulate_compression_on_dataset, emulate_compression_on_data_array,\
-    emulate_compression_on_numpy_array
+    emulate_compression_on_numpy_array, emulate_compression_on_numpy_array_by_chunks, emulate_compression_with_metrics,\
+    estimate_compressed_size, predicted_file_size
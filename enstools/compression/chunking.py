@@ -0,0 +1,87 @@
+"""
+Chunk layout shared by the emulation, the analysis and the writer.
+
+The files are written with the chunk sizes that enstools.encoding.DatasetEncoding assigns to each data variable,
+and the hdf5 filters compress each chunk independently. To predict what compress produces, the emulation needs
+to use exactly the same layout and compress each chunk on its own. The edge chunks, which are smaller than the
+chunk size, are padded by hdf5 to the full chunk size with the fill value of the variable before compressing them,
+so they are padded here too.
+"""
+import copy
+from typing import Tuple, Union
+
+import numpy as np
+import xarray
+
+import enstools.encoding.chunk_size
+from enstools.encoding.api import Encoding
+from enstools.encoding.dataset_encoding import convert_to_bytes, find_chunk_sizes
+
+
+def write_chunk_sizes(data_array: Union[xarray.DataArray, np.ndarray],
+                      chunk_size: Union[str, None] = None) -> Tuple[int, ...]:
+    """
+    Get the chunk sizes that the writer uses for a variable, following the same logic as DatasetEncoding.
+
+    Parameters
+    ----------
+    data_array : xarray.DataArray or array-like
+        The variable. Other arrays (i.e. numpy.ndarray, h5py.Dataset) are treated as variables without a time
+        dimension, only their shape and type are used.
+    chunk_size : str, optional
+        Desired size of the chunks in memory (i.e. "10MB").
+        Defaults to the enstools.encoding.chunk_size.chunk_size module variable.
+
+    Returns
+    -------
+    tuple of int
+        The chunk size in each dimension.
+    """
+    if chunk_size is None:
+        chunk_size = enstools.encoding.chunk_size.chunk_size
+    if not isinstance(data_array, xarray.DataArray):
+        # Only the sizes of the dimensions are needed, there is no need to read the data.
+        data_array = xarray.DataArray(np.broadcast_to(np.zeros((), dtype=data_array.dtype), data_array.shape))
+
+    optimal_chunk_size = convert_to_bytes(chunk_size) / data_array.dtype.itemsize
+    chunk_sizes = find_chunk_sizes(data_array=data_array, chunk_size=optimal_chunk_size)
+    return tuple(chunk_sizes[d] for d in data_array.dims)
+
+
+def with_write_chunk_sizes(compression_specification: Encoding, data_array,
+                           chunk_size: Union[str, None] = None) -> Encoding:
+    """
+    Return the encoding with the chunk sizes of the writer. If the encoding already defines them, it is returned
+    as it is, otherwise a copy with the chunk sizes set is returned.
+    """
+    if "chunksizes" in compression_specification or not data_array.shape:
+        return compression_specification
+    compression_specification = copy.deepcopy(compression_specification)
+    compression_specification.set_chunk_sizes(write_chunk_sizes(data_array, chunk_size=chunk_size))
+    return compression_specification
+
+
+def write_fill_value(data_array: xarray.DataArray) -> float:
+    """
+    Get the value that the writer uses to pad the edge chunks of a variable: its _FillValue, which xarray sets to NaN
+    by default for floating point variables, or 0 (the hdf5 default) if it doesn't have any.
+    """
+    if "_FillValue" in data_array.encoding:
+        fill_value = data_array.encoding["_FillValue"]
+    elif np.issubdtype(data_array.dtype, np.floating):
+        fill_value = np.nan
+    else:
+        fill_value = None
+    return 0 if fill_value is None else fill_value
+
+
+def pad_to_chunk(block: np.ndarray, chunk_shape: Tuple[int, ...], fill_value: float = 0) -> np.ndarray:
+    """
+    Pad an edge block up to the full chunk shape, as hdf5 does before applying the filters.
+    Blocks that already have the chunk shape are returned without copying them.
+    """
+    if block.shape == tuple(chunk_shape):
+        return block
+    padded = np.full(chunk_shape, fill_value, dtype=block.dtype)
+    padded[tuple(slice(0, size) for size in block.shape)] = block
+    return padded
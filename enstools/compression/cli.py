@@ -130,6 +130,9 @@ def add_subparser_compressor(subparsers):
     subparser.add_argument("--emulate", dest="emulate", default=False, action='store_true',
                            help="Instead of saving compressed files, it compresses and decompresses the data to see"
                                 "compression effects without requiring the plugins to open the files.")
+    subparser.add_argument("--emulation-workers", dest="emulation_workers", default=None, type=int,
+                           help="Number of variables emulated concurrently when using --emulate."
+                                "Default=number of available cores")
     subparser.add_argument("--fill-na", dest="fill_na", default=False,
                            help="Fill the missing values with a float.")
 
@@ -171,7 +174,8 @@ def call_compressor(args):
     emulate = args.emulate
     # Import and launch compress function
     from enstools.compression.api import compress
-    compress(file_paths, output, compression, nodes, variables_to_keep=variables, emulate=emulate, fill_na=fill_na)
+    compress(file_paths, output, compression, nodes, variables_to_keep=variables, emulate=emulate, fill_na=fill_na,
+             emulation_workers=args.emulation_workers)
 
 
 ###############################
@@ -212,6 +216,16 @@ Constrains
 The constrain specification must be provided in the following format:
     >>> "metric1:value1,metric2:value2,metric3:value3"
 
+Besides quality metrics and compression_ratio, the throughput can be constrained (in MB/s):
+    >>> enstools-compression analyze "input_file.nc" --constrains "correlation_I:5,decompression_speed:500"
+
+Objective
+---------
+
+By default the encoding with the highest compression ratio is selected. An objective with the weights of
+different metrics can be used instead, i.e. to select the encoding with the fastest decompression:
+    >>> enstools-compression analyze "input_file.nc" --constrains "correlation_I:5" --objective "decompression_speed:1"
+
 
 """
 
@@ -228,6 +242,10 @@ def add_subparser_analyzer(subparsers):
                            default="correlation_I:5,ssim_I:2", type=str,
                            help="Quality constrains that need to be fulfilled.")
 
+    subparser.add_argument("--objective", dest="objective", default=None, type=str,
+                           help="Weights of the metrics used to select the best encoding, "
+                                "i.e. compression_ratio:1,decompression_speed:1. Default=%(default)s")
+
     subparser.add_argument("--output", "-o", dest="output", default=None, type=str,
                            help="Path to the file where the configuration will be saved."
                                 "If not provided will be print in the stdout.",
@@ -290,8 +308,10 @@ def call_analyzer(args):
     plugins = args.plugins
     if plugins:
         import enstools.scores
+        from enstools.compression.metrics import metric_registry
         for plugin in plugins:
             enstools.scores.add_score_from_file(plugin)
+        metric_registry.invalidate()
 
     from enstools.compression.api import analyze_files
     analyze_files(
@@ -303,6 +323,7 @@ def call_analyzer(args):
         grid=grid,
         fill_na=fill_na,
         variables=variables,
+        objective=args.objective,
     )
 
 
@@ -356,6 +377,10 @@ EVALUATE_HELP = """
 evaluate:
 
 Tool to quickly compare two datasets, mainly though to compare a compressed dataset with its reference.
+Several pairs of files can be evaluated at once giving several references and the same number of targets.
+With a single reference and several targets (i.e. evaluate -r ref.nc -t candidate*.nc), all the targets are
+compared with that reference, which is read only once.
+The exit code is 1 if any metric is below its threshold.
 
 """
 
@@ -367,14 +392,27 @@ def add_subparser_evaluator(subparsers):
 
     subparser = subparsers.add_parser('evaluate', help=EVALUATE_HELP,
                                       formatter_class=argparse.RawDescriptionHelpFormatter)
-    subparser.add_argument("--reference", "-r", dest="reference_file", default=None, type=str,
-                           help="Path to reference file. Default=%(default)s", required=True)
-    subparser.add_argument("--target", "-t", dest="target_file", default=None, type=str,
-                           help="Path to target file", required=True)
+    subparser.add_argument("--reference", "-r", dest="reference_files", default=None, type=str, nargs="+",
+                           help="Path to reference file(s). Default=%(default)s", required=True)
+    subparser.add_argument("--target", "-t", dest="target_files", default=None, type=str, nargs="+",
+                           help="Path to target file(s), one for each reference or several for a single reference",
+                           required=True)
+    subparser.add_argument("--output", "-o", dest="output", default=None, type=str,
+                           help="Path where the table of metrics is written, the format is selected by the "
+                                "extension: .csv, .parquet or .nc. Default=%(default)s")
     subparser.add_argument("--plot", dest="plot", default=False, action='store_true',
                            help="Produce evaluation plots. Default=%(default)s")
+    subparser.add_argument("--plot-folder", dest="plot_folder", default="report", type=str,
+                           help="Folder where the plots are saved. Default=%(default)s")
     subparser.add_argument("-g", "--gradients", dest="gradients", default=False, action='store_true',
-                           help="Compute gradients. Default=%(default)s")
+                           help="Compute gradients. With --streaming they are computed one time step at a time. "
+                                "Default=%(default)s")
+    subparser.add_argument("--streaming", dest="streaming", default=False, action='store_true',
+                           help="Compute the metrics reading the files chunk by chunk only once, with bounded memory. "
+                                "The SSIM is not computed in this mode. Default=%(default)s")
+    subparser.add_argument("--workers", dest="workers", default=None, type=int,
+                           help="Number of workers used to compute the metrics and to render the plots. "
+                                "Default: number of cores.")
     subparser.set_defaults(which='evaluator')
 
 
@@ -384,13 +422,37 @@ def call_evaluator(args):
     """
     # pylint: disable=import-outside-toplevel
 
-    reference_file_path = args.reference_file
-    target_file_path = args.target_file
+    reference_file_paths = args.reference_files
+    target_file_paths = args.target_files
     plot = args.plot
     gradients = args.gradients
 
-    from enstools.compression.api import evaluate
-    evaluate(reference_file_path, target_file_path, plot=plot, create_gradients=gradients)
+    # With a single reference the targets are evaluated as a sweep, except in streaming mode, where the reference
+    # is not kept in memory and it is read again for each target.
+    sweep = len(reference_file_paths) == 1 and len(target_file_paths) > 1 and not args.streaming
+    if len(reference_file_paths) == 1:
+        reference_file_paths = reference_file_paths * len(target_file_paths)
+    elif len(reference_file_paths) != len(target_file_paths):
+        raise AssertionError("The number of references and targets needs to be the same, or a single reference.")
+
+    from enstools.compression.api import evaluate, evaluate_batch, evaluate_sweep
+    if len(target_file_paths) > 1 and plot:
+        raise AssertionError("The plots can only be produced when evaluating a single pair of files.")
+
+    if len(target_file_paths) == 1:
+        table = evaluate(reference_file_paths[0], target_file_paths[0], plot=plot, create_gradients=gradients,
+                         streaming=args.streaming, workers=args.workers, output=args.output,
+                         output_folder=args.plot_folder)
+    elif sweep:
+        table = evaluate_sweep(reference_file_paths[0], target_file_paths, create_gradients=gradients,
+                               workers=args.workers, output=args.output)
+    else:
+        table = evaluate_batch(list(zip(reference_file_paths, target_file_paths)), create_gradients=gradients,
+                               streaming=args.streaming, workers=args.workers, output=args.output)
+
+    # A non-zero exit code allows to use the evaluation in scripts and pipelines
+    if not table["passed"].all():
+        sys.exit(1)
 
 
 ###############################
@@ -428,6 +490,100 @@ def call_pruner(args):
     pruner(file_paths, output)
 
 
+###############################
+# Estimator
+ESTIMATE_HELP = """
+estimate:
+
+Estimate the size of the files that would be produced by the compress command, without compressing them.
+Only a stratified random sample of the chunks of each variable is read and compressed, and the total size and
+compression ratio are extrapolated with confidence intervals.
+
+Examples
+--------
+
+>>> enstools-compression estimate input_files*.nc --compression "lossy,sz,rel,1e-4" --quota 10TB
+
+"""
+
+
+def add_subparser_estimator(subparsers):
+    """
+    Function to add the estimator subparser
+    """
+    subparser = subparsers.add_parser('estimate', help=ESTIMATE_HELP,
+                                      formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparser.add_argument("files", type=expand_paths, nargs='*',
+                           help="Path to file/files that would be compressed."
+                                "Multiple files and regex patterns are allowed.")
+    subparser.add_argument('--compression', type=str, dest="compression", nargs="+", default="lossless",
+                           help="Specifications about the compression options. Default is: %(default)s")
+    subparser.add_argument("--fraction", dest="fraction", default=0.01, type=float,
+                           help="Fraction of the chunks of each variable that is read. Default=%(default)s")
+    subparser.add_argument("--min-chunks", dest="min_chunks", default=4, type=int,
+                           help="Minimum number of chunks read from each variable. Default=%(default)s")
+    subparser.add_argument("--confidence", dest="confidence", default=0.95, type=float,
+                           help="Confidence level of the intervals. Default=%(default)s")
+    subparser.add_argument("--quota", dest="quota", default=None, type=str,
+                           help="Storage quota (i.e. 10TB). If the upper bound of the estimated size exceeds it, "
+                                "the command exits with an error code.")
+    subparser.set_defaults(which='estimator')
+
+
+def call_estimator(args):
+    """
+    Function to be called with the estimator subparser
+    """
+    # pylint: disable=import-outside-toplevel
+    from enstools.compression.estimator import estimate, print_estimate
+
+    file_paths = sum(args.files, [])
+    compression = args.compression
+    if isinstance(compression, list):
+        compression = " ".join(compression)
+    if compression in ["None", "none"]:
+        compression = None
+
+    result = estimate(file_paths, compression, fraction=args.fraction, min_chunks=args.min_chunks,
+                      confidence=args.confidence, verbose=True)
+    if not print_estimate(result, quota=args.quota):
+        sys.exit(1)
+
+
+###############################
+# Emulators
+EMULATORS_HELP = """
+emulators:
+
+Show which emulator backend is selected for each compressor, mode and data type, with the time per call
+measured in a short micro-benchmark. The results are cached per host.
+
+"""
+
+
+def add_subparser_emulators(subparsers):
+    """
+    Function to add the emulators subparser
+    """
+
+    subparser = subparsers.add_parser('emulators', help=EMULATORS_HELP,
+                                      formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparser.add_argument("--clear", dest="clear", default=False, action='store_true',
+                           help="Remove the cached results and run the benchmarks again. Default=%(default)s")
+    subparser.set_defaults(which='emulators')
+
+
+def call_emulators(args):
+    """
+    Function to be called with the emulators subparser
+    """
+    # pylint: disable=import-outside-toplevel
+    from enstools.compression.emulators.registry import clear_selection, print_selection_table
+    if args.clear:
+        clear_selection()
+    print_selection_table()
+
+
 def add_subparser_load_plugins(subparsers):
     """
     Function to add the load_plugins subparser
@@ -479,6 +635,10 @@ def add_subparsers(parser):
     add_subparser_evaluator(subparsers)
     # Create the parser for the "pruner" command
     add_subparser_pruner(subparsers)
+    # Create the parser for the "estimate" command
+    add_subparser_estimator(subparsers)
+    # Create the parser for the "emulators" command
+    add_subparser_emulators(subparsers)
     # To add an additional subparser, just create a function like the ones above and add the call here.
     add_subparser_load_plugins(subparsers)
 
@@ -537,6 +697,10 @@ def main():
         call_evaluator(args)
     elif args.which == "pruner":
         call_pruner(args)
+    elif args.which == "estimator":
+        call_estimator(args)
+    elif args.which == "emulators":
+        call_emulators(args)
     elif args.which == "load-plugins":
         call_load_plugins()
     elif args.which == "unload-plugins":
@@ -59,6 +59,7 @@ def transfer(file_paths: Union[List[str], str, Path, List[Path]],
              variables_to_keep: List[str] = None,
              emulate: bool = False,
              fill_na: Union[float, bool] = False,
+             emulation_workers: Union[int, None] = None,
              ) -> None:
     """
     This function loops through a list of files creating delayed dask tasks to copy each one of the files while
@@ -76,6 +77,8 @@ def transfer(file_paths: Union[List[str], str, Path, List[Path]],
                 Compression specification or path to json configuration file.
     variables_to_keep: list of strings
                 In case of only wanting to keep certain variables, pass the variables to keep as a list of strings.
+    emulation_workers: int
+                Number of variables emulated concurrently when emulate is True. Defaults to the number of cores.
     """
     file_paths = clean_paths(file_paths)
     # Just make sure that output is a Path object
@@ -90,7 +93,7 @@ def transfer(file_paths: Union[List[str], str, Path, List[Path]],
         file_path = file_paths[0]
         new_file_path = destination_path(file_path, output) if isdir(output) else output
         transfer_file(file_path, new_file_path, compression,
-                      variables_to_keep, emulate=emulate, fill_na=fill_na)
+                      variables_to_keep, emulate=emulate, fill_na=fill_na, emulation_workers=emulation_workers)
     elif len(file_paths) > 1:
         # In case of having more than one file, check that output corresponds to a directory
         assert output.is_dir(), "For multiple files, the output parameter should be a directory"
@@ -104,6 +107,7 @@ def transfer(file_paths: Union[List[str], str, Path, List[Path]],
             variables_to_keep=variables_to_keep,
             emulate=emulate,
             fill_na=fill_na,
+            emulation_workers=emulation_workers,
         )
 
 
@@ -113,7 +117,8 @@ def transfer_multiple_files(
         compression: str = "lossless",
         variables_to_keep: List[str] = None,
         emulate: bool = False,
-        fill_na: Union[float, bool] = False
+        fill_na: Union[float, bool] = False,
+        emulation_workers: Union[int, None] = None,
 ) -> None:
     """
         This function will copy multiple files while optionally applying compression.
@@ -126,6 +131,7 @@ def transfer_multiple_files(
     variables_to_keep
     emulate
     fill_na
+    emulation_workers
 
     Returns
     -------
@@ -160,6 +166,7 @@ def transfer_multiple_files(
                              compute=False,
                              emulate=emulate,
                              fill_na=fill_na,
+                             emulation_workers=emulation_workers,
                              )
         # Add task to the list
         tasks.append(task)
@@ -173,7 +180,8 @@ def transfer_multiple_files(
 
 
 def transfer_file(origin: Path, destination: Path, compression: str, variables_to_keep: List[str] = None,
-                  compute: bool = True, emulate=False, fill_na: Union[float, bool] = False):
+                  compute: bool = True, emulate=False, fill_na: Union[float, bool] = False,
+                  emulation_workers: Union[int, None] = None):
     """
     This function will copy a dataset while optionally applying compression.
 
@@ -187,6 +195,9 @@ def transfer_file(origin: Path, destination: Path, compression: str, variables_t
 
     compression: string
             compression specification or path to json configuration file
+
+    emulation_workers: int
+            number of variables emulated concurrently when emulate is True. Defaults to the number of cores.
     """
 
     dataset = read(origin, decode_times=False)
@@ -200,7 +211,7 @@ def transfer_file(origin: Path, destination: Path, compression: str, variables_t
     # In case we are using emulate, we compress and decompress the dataset using LibPressio and output
     # the file without compression only to measure the impact compression would have.
     if emulate:
-        dataset, _ = emulate_compression_on_dataset(dataset, compression)
+        dataset, _ = emulate_compression_on_dataset(dataset, compression, workers=emulation_workers, processes=True)
         return write(dataset, destination, file_format="NC", compute=compute, compression=None,
                      format="NETCDF4_CLASSIC", engine="netcdf4")
 
@@ -242,6 +253,7 @@ def compress(
         show_compression_ratios=False,
         emulate=False,
         fill_na: Union[float, bool] = False,
+        emulation_workers: Union[int, None] = None,
 ) -> None:
     """
     Copies a list of files to the destination applying compression.
@@ -265,6 +277,8 @@ def compress(
     are not actually compressed. Useful for testing with software that is not hdf5 capable.
     fill_na: float or False
     Fill the NaN values with a float value
+    emulation_workers: int or None
+    Number of variables emulated concurrently when emulate is True. Defaults to the number of available cores.
 
     Returns
     -------
@@ -286,13 +300,15 @@ def compress(
                          variables_to_keep=variables_to_keep,
                          emulate=emulate,
                          fill_na=fill_na,
+                         emulation_workers=emulation_workers,
                          )
 
     else:
         # Transfer will copy the files from its origin path to the output folder,
         # using read and write functions from enstools
         transfer(file_paths, output, compression,
-                 variables_to_keep=variables_to_keep, emulate=emulate, fill_na=fill_na)
+                 variables_to_keep=variables_to_keep, emulate=emulate, fill_na=fill_na,
+                 emulation_workers=emulation_workers)
 
     if show_compression_ratios:
         check_compression_ratios(file_paths, output)
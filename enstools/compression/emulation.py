@@ -4,17 +4,31 @@
 #
 
 """
+import copy
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from typing import Union, Tuple
 
+import dask
+import dask.array
 import numpy
 import xarray
 
 from enstools.core import cache
 from enstools.encoding.api import DatasetEncoding, NullEncoding, LosslessEncoding, LossyEncoding, Encoding
-from .emulators import DefaultEmulator
+from . import emulation_cache
+from .chunking import pad_to_chunk, with_write_chunk_sizes, write_chunk_sizes, write_fill_value
+from .accumulators import ErrorAccumulator, histogram_bin_edges
+from .emulators import get_emulator
+from .sampling import SizeEstimate, ratio_estimate, sample_chunk_slices
+from .slicing import MultiDimensionalSliceCollection
 
 
-def emulate_compression_on_dataset(dataset: xarray.Dataset, compression: Union[str, dict], in_place: bool = True):
+def emulate_compression_on_dataset(dataset: xarray.Dataset, compression: Union[str, dict], in_place: bool = True,
+                                   lazy: bool = False, workers: Union[int, None] = 1, processes: bool = False,
+                                   estimate_lossless: bool = False, max_sample_chunks: int = 16):
     """
     Emulate the compression on an xarray dataset using the specified compression settings. This function applies
     the given compression settings to each variable in the dataset that is not a coordinate. The compression
@@ -28,34 +42,178 @@ def emulate_compression_on_dataset(dataset: xarray.Dataset, compression: Union[s
     :param in_place: A boolean value indicating whether to apply the compression in-place or to a deep copy
                      of the dataset. If True, the function returns the same dataset with compression applied.
                      If False, the function returns a compressed deep copy of the dataset.
+    :param lazy: If True, dask-backed variables are emulated lazily (see emulate_compression_on_data_array).
+    :param workers: Number of threads used to emulate different variables concurrently.
+                    If None, the number of available cores is used. The default (1) emulates the variables one by one.
+    :param processes: If True, the variables are emulated in a pool of processes instead of threads.
+                      The hdf5 filters can't run concurrently in threads of the same process (h5py serializes all
+                      the calls to the library), so processes are needed to scale with the number of cores, at the
+                      cost of sending the data to the workers. Only one variable per worker is loaded and sent at a
+                      time. Ignored for lazy emulations.
+    :param estimate_lossless: If True, the compressed size of the variables with lossless compression is estimated
+                              too (their values are not modified), which is needed to predict the size of the file.
+                              Variables with more than max_sample_chunks chunks are estimated from a random sample
+                              of chunks. By default only the lossy variables are emulated and have metrics.
+    :param max_sample_chunks: Maximum number of chunks compressed to estimate the size of a lossless variable.
     :return: A tuple containing the compressed dataset and a dictionary with compression metrics for each variable.
+             Besides the compression ratio, the metrics include the compressed size in bytes and its standard error
+             (0 when the size is exact). Use predicted_file_size with estimate_lossless=True to get the total with
+             a confidence interval.
+             The variables are emulated chunk by chunk with the same chunk layout used to write the files, and the
+             metrics of the lossy variables include the compressed size of each chunk (chunk_compressed_sizes).
     """
+    if workers is None:
+        workers = os.cpu_count() or 1
 
-    try:
-        cache.unregister()
-        cache_was_on = True
-    except KeyError:
-        cache_was_on = False
-    if not in_place:
-        dataset = dataset.copy(deep=True)
-    # List variables that aren't coordinates
-    variables = [v for v in dataset.variables if v not in dataset.coords]
-
-    #
-    dataset_encoding = DatasetEncoding(dataset, compression)
-    dataset_metrics = {}
-    for variable in variables:
-        var_compression = dataset_encoding.encoding()[variable]
-        if var_compression and isinstance(var_compression, LossyEncoding):
-            dataset[variable], dataset_metrics[variable] = emulate_compression_on_data_array(dataset[variable],
-                                                                                             var_compression)
-    if cache_was_on:
-        cache.register()
+    with _enstools_cache_disabled():
+        if not in_place:
+            dataset = dataset.copy(deep=True)
+        # List variables that aren't coordinates
+        variables = [v for v in dataset.variables if v not in dataset.coords]
+
+        #
+        dataset_encoding = DatasetEncoding(dataset, compression)
+        encodings = dataset_encoding.encoding()
+        lossless_variables = [v for v in variables if isinstance(encodings[v], LosslessEncoding)]
+        variables = [v for v in variables if encodings[v] and isinstance(encodings[v], LossyEncoding)]
+
+        def emulate_variable(variable):
+            return emulate_compression_on_data_array(dataset[variable], encodings[variable], in_place=False,
+                                                     lazy=lazy)
+
+        # The variables are independent, but the dataset is only modified from this thread.
+        max_workers = min(workers, max(len(variables), 1))
+        if processes and not lazy and max_workers > 1:
+            results = _emulate_variables_in_processes(dataset, variables, encodings, max_workers)
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(emulate_variable, variables))
+
+        dataset_metrics = {}
+        for variable, (data_array, metrics) in zip(variables, results):
+            metrics["compressed_size"] = data_array.nbytes / metrics["compression_ratio"]
+            metrics["compressed_size_error"] = 0.
+            dataset[variable], dataset_metrics[variable] = data_array, metrics
+
+        if estimate_lossless:
+            for variable in lossless_variables:
+                estimate = estimate_compressed_size(dataset[variable], encodings[variable],
+                                                    max_chunks=max_sample_chunks,
+                                                    fill_value=write_fill_value(dataset[variable]))
+                dataset_metrics[variable] = {
+                    "compression_ratio": dataset[variable].nbytes / estimate.size,
+                    "compressed_size": estimate.size,
+                    "compressed_size_error": estimate.standard_error,
+                }
     return dataset, dataset_metrics
 
 
+def estimate_compressed_size(data, compression_specification: Encoding, chunk_sizes: Tuple[int, ...] = None,
+                             max_chunks: int = 16, seed: int = 0, fill_value: float = 0) -> SizeEstimate:
+    """
+    Estimate the compressed size of an array compressing a random sample of its chunks.
+    Only the sampled chunks are read, so it can be used with arrays that are not loaded in memory.
+
+    Parameters
+    ----------
+    data : array-like
+        The input data. Any object with shape and dtype that can be sliced to get NumPy arrays can be used
+        (i.e. numpy.ndarray, xarray.DataArray, h5py.Dataset, netCDF4.Variable).
+    compression_specification : Encoding
+        The encoding specification to apply for the compression.
+    chunk_sizes : tuple of int, optional
+        The size of the chunks in each dimension. If not provided, the chunk sizes from the encoding are used and,
+        if the encoding doesn't have them, the full array is used as a single chunk.
+    max_chunks : int, optional, default=16
+        Maximum number of chunks that are compressed. If the array has fewer chunks the size is exact.
+    seed : int, optional, default=0
+        Seed used to select the chunks.
+    fill_value : float, optional, default=0
+        Value used to pad the edge chunks (see enstools.compression.chunking.write_fill_value).
+
+    Returns
+    -------
+    SizeEstimate
+        The estimated compressed size in bytes and its standard error.
+    """
+    if chunk_sizes is None:
+        chunk_sizes = compression_specification.get("chunksizes", data.shape)
+    itemsize = numpy.dtype(data.dtype).itemsize
+    uncompressed_size = int(numpy.prod(data.shape)) * itemsize
+
+    # Scalars are not chunked, they are stored as they are.
+    if isinstance(compression_specification, NullEncoding) or not data.shape:
+        return SizeEstimate(size=uncompressed_size)
+
+    chunk_shape = _chunk_shape(chunk_sizes, data.shape)
+    chunk_slices, population_size = sample_chunk_slices(data.shape, chunk_sizes, max_chunks=max_chunks, seed=seed)
+    compressed_sizes = []
+    uncompressed_sizes = []
+    for chunk_slice in chunk_slices:
+        chunk = numpy.asarray(data[chunk_slice.slices])
+        compressed_sizes.append(_compressed_block_size(chunk, compression_specification, chunk_shape=chunk_shape,
+                                                       fill_value=fill_value))
+        uncompressed_sizes.append(chunk.nbytes)
+    return ratio_estimate(compressed_sizes, uncompressed_sizes, uncompressed_size, population_size)
+
+
+def predicted_file_size(dataset_metrics: dict, confidence: float = 0.95) -> Tuple[float, Tuple[float, float]]:
+    """
+    Predict the total compressed size of the variables of a dataset from the metrics obtained with
+    emulate_compression_on_dataset(..., estimate_lossless=True). The coordinates and the file metadata are not
+    included.
+
+    Parameters
+    ----------
+    dataset_metrics : dict
+        The metrics of each variable.
+    confidence : float, optional, default=0.95
+        Confidence level of the interval.
+
+    Returns
+    -------
+    size : float
+        The predicted size in bytes.
+    interval : tuple of float
+        The lower and upper bounds of the confidence interval.
+    """
+    total = sum((SizeEstimate(size=metrics["compressed_size"], standard_error=metrics["compressed_size_error"])
+                for metrics in dataset_metrics.values()), SizeEstimate(size=0.))
+    return total.size, total.interval(confidence)
+
+
+# Number of active emulations that have disabled the enstools cache and whether it was on before the first one.
+_cache_lock = threading.Lock()
+_cache_users = 0
+_cache_was_on = False
+
+
+@contextmanager
+def _enstools_cache_disabled():
+    """
+    Context manager that disables the enstools cache, re-enabling it when the last concurrent user exits.
+    """
+    global _cache_users, _cache_was_on  # pylint: disable=global-statement
+    with _cache_lock:
+        if _cache_users == 0:
+            try:
+                cache.unregister()
+                _cache_was_on = True
+            except KeyError:
+                _cache_was_on = False
+        _cache_users += 1
+    try:
+        yield
+    finally:
+        with _cache_lock:
+            _cache_users -= 1
+            if _cache_users == 0 and _cache_was_on:
+                cache.register()
+
+
 def emulate_compression_on_data_array(data_array: xarray.DataArray, compression_specification: Encoding,
-                                      in_place=True) -> Tuple[xarray.DataArray, dict]:
+                                      in_place=True, parallel=False, workers: int = None, lazy=False) \
+        -> Tuple[xarray.DataArray, dict]:
     """
     Emulates compression on a given DataArray using the specified encoding.
 
@@ -66,7 +224,16 @@ def emulate_compression_on_data_array(data_array: xarray.DataArray, compression_
     compression_specification : Encoding
         The encoding specification to apply for the compression.
     in_place : bool, optional, default=True
-        If True, modifies the input data array in place, otherwise creates a new copy.
+        If True, modifies the input data array in place, otherwise returns a new data array.
+        In both cases the values are replaced by a new array, the input values are neither copied nor modified.
+    parallel : bool, optional, default=False
+        If True, the chunks are compressed and decompressed concurrently.
+    workers : int, optional
+        Number of threads used when parallel is True. Defaults to the number of available cores.
+    lazy : bool, optional, default=False
+        If True and the data array is backed by dask, the result is a dask-backed data array whose blocks are
+        compressed and decompressed when computed, and the compression ratio in the metrics is a dask Delayed object.
+        Compute both together (i.e. dask.compute(data_array, metrics)) to avoid emulating the blocks twice.
 
     Returns
     -------
@@ -75,9 +242,14 @@ def emulate_compression_on_data_array(data_array: xarray.DataArray, compression_
     compression_metrics : dict
         A dictionary containing compression metrics.
 
+    The array is emulated chunk by chunk, using the chunk sizes of the encoding or, if it doesn't have them, the
+    chunk sizes that the writer would use, and the edge chunks are padded with the fill value of the variable, so
+    the decompressed values and the compression ratio are the ones obtained when writing the file.
     """
+    compression_specification = with_write_chunk_sizes(compression_specification, data_array)
     if not in_place:
-        data_array = data_array.copy()
+        # The values are replaced, not modified, so there is no need to copy them.
+        data_array = data_array.copy(deep=False)
     # For now we want to apply compression chunk by chunk ( or at least for the moment avoid using multiple time-steps)
     # if "time" not in data_array.dims:
     #     data_array.values, compression_metrics = emulate_compression_on_numpy_array(data_array.values,
@@ -87,14 +259,88 @@ def emulate_compression_on_data_array(data_array: xarray.DataArray, compression_
     #         data_array.loc[{"time": time}], compression_metrics = emulate_compression_on_numpy_array(
     #             data_array.sel(time=time).values, compression_specification)
 
-    # FIXME: I don't separate the time-steps at that point anymore because of performance penalty.
-    data_array.values, compression_metrics = emulate_compression_on_numpy_array(data_array.values,
-                                                                                compression_specification)
+    # The emulation follows the chunks of the file, the parallel mode processes them concurrently.
+    if lazy and data_array.chunks is not None:
+        emulated, compression_metrics = emulate_compression_on_dask_array(data_array.data, compression_specification,
+                                                                          fill_value=write_fill_value(data_array))
+        data_array.data = emulated
+    else:
+        data_array.values, compression_metrics = _cached_emulation(data_array.values, compression_specification,
+                                                                   workers=workers if parallel else 1,
+                                                                   fill_value=write_fill_value(data_array))
 
     return data_array, compression_metrics
 
 
-def emulate_compression_on_numpy_array(data: numpy.ndarray, compression_specification: Encoding) -> \
+def _emulate_variables_in_processes(dataset: xarray.Dataset, variables: list, encodings: dict,
+                                    max_workers: int) -> list:
+    """
+    Emulate the compression of some variables of a dataset in a pool of processes.
+
+    The values of each variable are loaded just before sending them to a worker and at most max_workers variables
+    are in flight, so the memory needed doesn't grow with the size of the dataset. As in _cached_emulation, the
+    emulation cache is used if it is enabled.
+    """
+    cache_instance = emulation_cache.emulation_cache
+    results = {}
+    pending_variables = iter(variables)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+
+        def submit_next_variable():
+            for variable in pending_variables:
+                data = dataset[variable].values
+                fill_value = write_fill_value(dataset[variable])
+                key = None
+                if cache_instance is not None:
+                    key = cache_instance.key(data, encodings[variable], fill_value=fill_value)
+                    cached = cache_instance.get(key)
+                    if cached is not None:
+                        results[variable] = cached
+                        continue
+                future = executor.submit(emulate_compression_on_numpy_array_by_chunks, data, encodings[variable],
+                                         workers=1, fill_value=fill_value)
+                running[future] = variable, key
+                return
+
+        for _ in range(max_workers):
+            submit_next_variable()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                variable, key = running.pop(future)
+                decompressed, metrics = future.result()
+                if cache_instance is not None:
+                    cache_instance.put(key, decompressed, metrics)
+                results[variable] = decompressed, metrics
+                submit_next_variable()
+
+    return [(dataset[variable].copy(data=results[variable][0]), results[variable][1]) for variable in variables]
+
+
+def _cached_emulation(data: numpy.ndarray, compression_specification: Encoding,
+                      workers: Union[int, None], fill_value: float) -> Tuple[numpy.ndarray, dict]:
+    """
+    Emulate compression on a NumPy array, reusing the results from the emulation cache if it is enabled.
+    """
+    cache_instance = emulation_cache.emulation_cache
+    if cache_instance is not None:
+        key = cache_instance.key(data, compression_specification, fill_value=fill_value)
+        cached = cache_instance.get(key)
+        if cached is not None:
+            return cached
+
+    decompressed, metrics = emulate_compression_on_numpy_array_by_chunks(data, compression_specification,
+                                                                         workers=workers, fill_value=fill_value)
+
+    if cache_instance is not None:
+        cache_instance.put(key, decompressed, metrics)
+    return decompressed, metrics
+
+
+def emulate_compression_on_numpy_array(data: numpy.ndarray, compression_specification: Encoding,
+                                       out: numpy.ndarray = None, copy_input: bool = False) -> \
         Tuple[numpy.ndarray, dict]:
     """
         Emulates compression on a given NumPy array using the specified encoding.
@@ -102,9 +348,14 @@ def emulate_compression_on_numpy_array(data: numpy.ndarray, compression_specific
     Parameters
     ----------
     data : numpy.ndarray
-        The input NumPy array to be compressed.
+        The input NumPy array to be compressed. It is only read, so it can be read-only.
     compression_specification : Encoding
         The encoding specification to apply for the compression.
+    out : numpy.ndarray, optional
+        Preallocated array with the same shape and type as the input where the decompressed data is written.
+    copy_input : bool, optional, default=False
+        If True, the emulator works on a copy of the input.
+        Only needed if the input can be modified by another thread during the emulation.
 
     Returns
     -------
@@ -116,15 +367,282 @@ def emulate_compression_on_numpy_array(data: numpy.ndarray, compression_specific
     """
 
     if isinstance(compression_specification, NullEncoding):
-        return data, {"compression_ratio": 1}
+        if out is None:
+            return data, {"compression_ratio": 1}
+        numpy.copyto(out, data)
+        return out, {"compression_ratio": 1}
 
-    emulator_backend = DefaultEmulator
+    emulator_backend = get_emulator(compression_specification, data.dtype)
 
-    uncompressed_data = data
-    decompressed_data = uncompressed_data.copy()
+    uncompressed_data = data.copy() if copy_input else data
 
-    compressor = emulator_backend(compression_specification, uncompressed_data=decompressed_data)
+    compressor = emulator_backend(compression_specification, uncompressed_data=uncompressed_data)
 
-    decompressed = compressor.compress_and_decompress(decompressed_data)
+    decompressed = compressor.compress_and_decompress(uncompressed_data, out=out)
     metrics = {"compression_ratio": compressor.compression_ratio()}
     return decompressed, metrics
+
+
+def emulate_compression_on_numpy_array_by_chunks(data: numpy.ndarray, compression_specification: Encoding,
+                                                 chunk_sizes: Tuple[int, ...] = None, workers: int = None,
+                                                 fill_value: float = 0) -> \
+        Tuple[numpy.ndarray, dict]:
+    """
+    Emulates compression on a given NumPy array chunk by chunk, using a pool of threads.
+
+    The array is split in chunks using a MultiDimensionalSliceCollection, each chunk is compressed and decompressed
+    independently and the results are written into a single preallocated output array. As in the hdf5 files, the
+    edge chunks are padded to the full chunk size with the fill value before compressing them.
+    The compression ratio is obtained from the sum of the compressed sizes of all the chunks, without the overhead
+    of the file format.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        The input NumPy array to be compressed.
+    compression_specification : Encoding
+        The encoding specification to apply for the compression.
+    chunk_sizes : tuple of int, optional
+        The size of the chunks in each dimension. If not provided, the chunk sizes from the encoding are used and,
+        if the encoding doesn't have them, the chunk sizes that the writer would use.
+    workers : int, optional
+        Number of threads. Defaults to the number of available cores.
+    fill_value : float, optional, default=0
+        Value used to pad the edge chunks (see enstools.compression.chunking.write_fill_value).
+
+    Returns
+    -------
+    decompressed : numpy.ndarray
+        The decompressed NumPy array after compression.
+    metrics : dict
+        A dictionary containing the compression ratio and the compressed size of each chunk (chunk_compressed_sizes),
+        an array with one element per chunk.
+
+    """
+    if isinstance(compression_specification, NullEncoding):
+        return data, {"compression_ratio": 1}
+
+    # Scalars are not chunked
+    if not data.shape:
+        return emulate_compression_on_numpy_array(data, compression_specification)
+
+    if chunk_sizes is None:
+        chunk_sizes = compression_specification.get("chunksizes") or write_chunk_sizes(data)
+    chunk_shape = _chunk_shape(chunk_sizes, data.shape)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    collection = MultiDimensionalSliceCollection(shape=data.shape, chunk_sizes=chunk_shape)
+    decompressed = numpy.empty_like(data)
+
+    def emulate_chunk(chunk_slice) -> int:
+        # Each chunk is decompressed directly into its place in the output array
+        _, compressed_size = _emulate_block(data[chunk_slice.slices], compression_specification,
+                                            out=decompressed[chunk_slice.slices], chunk_shape=chunk_shape,
+                                            fill_value=fill_value)
+        return compressed_size
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        compressed_sizes = numpy.array(list(executor.map(emulate_chunk, collection.objects.ravel())))
+
+    metrics = {
+        "compression_ratio": data.nbytes / compressed_sizes.sum(),
+        "chunk_compressed_sizes": compressed_sizes.reshape(collection.objects.shape),
+    }
+    return decompressed, metrics
+
+
+def emulate_compression_on_dask_array(data: dask.array.Array, compression_specification: Encoding,
+                                      fill_value: float = 0) -> \
+        Tuple[dask.array.Array, dict]:
+    """
+    Lazily emulates compression on a dask array, block by block.
+
+    The array is rechunked to the chunk sizes of the encoding (if it has them) and each block is compressed and
+    decompressed in its own task when the result is computed, so the memory footprint is bounded by the block size.
+    The compressed sizes of the blocks are collected with a delayed reduction to get the compression ratio.
+
+    Parameters
+    ----------
+    data : dask.array.Array
+        The input dask array to be compressed.
+    compression_specification : Encoding
+        The encoding specification to apply for the compression.
+    fill_value : float, optional, default=0
+        Value used to pad the edge chunks (see enstools.compression.chunking.write_fill_value).
+
+    Returns
+    -------
+    decompressed : dask.array.Array
+        The lazy decompressed array.
+    metrics : dict
+        A dictionary containing compression metrics. The compression ratio and the compressed sizes of the
+        chunks are dask Delayed objects.
+
+    """
+    if isinstance(compression_specification, NullEncoding):
+        return data, {"compression_ratio": 1}
+
+    chunk_shape = None
+    if "chunksizes" in compression_specification:
+        chunk_shape = _chunk_shape(compression_specification["chunksizes"], data.shape)
+        data = data.rechunk(chunk_shape)
+
+    blocks = numpy.empty(data.numblocks, dtype=object)
+    compressed_sizes = []
+    for index in numpy.ndindex(*data.numblocks):
+        block = data.blocks[index]
+        emulated_block = dask.delayed(_emulate_block, nout=2)(block, compression_specification,
+                                                              chunk_shape=chunk_shape, fill_value=fill_value)
+        blocks[index] = dask.array.from_delayed(emulated_block[0], shape=block.shape, dtype=data.dtype)
+        compressed_sizes.append(emulated_block[1])
+
+    decompressed = dask.array.block(blocks.tolist())
+    chunk_compressed_sizes = dask.delayed(numpy.reshape)(dask.delayed(numpy.array)(compressed_sizes), data.numblocks)
+    compression_ratio = dask.delayed(numpy.divide)(data.nbytes, dask.delayed(numpy.sum)(chunk_compressed_sizes))
+    return decompressed, {"compression_ratio": compression_ratio, "chunk_compressed_sizes": chunk_compressed_sizes}
+
+
+def _emulate_block(block: numpy.ndarray, compression_specification: Encoding, out: numpy.ndarray = None,
+                   chunk_shape: Tuple[int, ...] = None, fill_value: float = 0) -> Tuple[numpy.ndarray, int]:
+    """
+    Emulate compression on a single block, returning the decompressed block and its compressed size, without the
+    overhead of the container format. If out is provided, the decompressed block is written into it.
+    If chunk_shape is provided, edge blocks are padded to it with the fill value before compressing them, as hdf5 does.
+    Each block gets its own encoding and emulator, the emulators keep state and can't be shared among threads.
+    """
+    if chunk_shape is not None and block.shape != tuple(chunk_shape):
+        padded = pad_to_chunk(block, chunk_shape, fill_value=fill_value)
+        decompressed, compressed_size = _emulate_block(padded, compression_specification)
+        decompressed = decompressed[tuple(slice(0, size) for size in block.shape)]
+        if out is None:
+            return numpy.ascontiguousarray(decompressed), compressed_size
+        numpy.copyto(out, decompressed)
+        return out, compressed_size
+
+    block_specification = _block_specification(compression_specification, block.shape)
+    emulator = get_emulator(block_specification, block.dtype)(block_specification, uncompressed_data=block)
+    decompressed = emulator.compress_and_decompress(block, out=out)
+    if emulator.stored_size is None:
+        return decompressed, round(block.nbytes / emulator.compression_ratio())
+    return decompressed, emulator.stored_size
+
+
+def _compressed_block_size(block: numpy.ndarray, compression_specification: Encoding,
+                           chunk_shape: Tuple[int, ...] = None, fill_value: float = 0) -> int:
+    """
+    Compress a single block without decompressing it and return the size of the compressed data, without the
+    overhead of the container format, which is only paid once per variable in the real files.
+    If chunk_shape is provided, edge blocks are padded to it with the fill value before compressing them, as hdf5 does.
+    """
+    if chunk_shape is not None:
+        block = pad_to_chunk(block, chunk_shape, fill_value=fill_value)
+    block_specification = _block_specification(compression_specification, block.shape)
+    emulator = get_emulator(block_specification, block.dtype)(block_specification, uncompressed_data=block)
+    return emulator.compressed_data_size(block)
+
+
+def _chunk_shape(chunk_sizes: Tuple[int, ...], shape: Tuple[int, ...]) -> Tuple[int, ...]:
+    """
+    Shape of the chunks of an array, the chunks can't be bigger than the array itself.
+    """
+    return tuple(min(chunk, size) for chunk, size in zip(chunk_sizes, shape))
+
+
+def _block_specification(compression_specification: Encoding, block_shape: Tuple[int, ...]) -> Encoding:
+    """
+    Copy of the encoding with the chunk sizes adapted to a block, the hdf5 chunks can't be bigger than the block itself.
+    """
+    block_specification = copy.deepcopy(compression_specification)
+    chunk_sizes = compression_specification.get("chunksizes", block_shape)
+    block_specification.set_chunk_sizes(tuple(min(c, s) for c, s in zip(chunk_sizes, block_shape)))
+    return block_specification
+
+
+def emulate_compression_with_metrics(data, compression_specification: Encoding,
+                                     chunk_sizes: Tuple[int, ...] = None, workers: int = None,
+                                     keep_decompressed: bool = False, value_range: Tuple[float, float] = None,
+                                     bins: int = 1000, fill_value: float = 0) -> \
+        Tuple[Union[numpy.ndarray, None], dict]:
+    """
+    Emulates compression and computes quality metrics in a single pass over the chunks of the data.
+
+    Each chunk is read, compressed and decompressed and immediately used to update a mergeable ErrorAccumulator,
+    so the decompressed array doesn't need to be materialized. That allows getting the compression ratio and the
+    quality metrics of arrays larger than the available memory. The points where the data or the decompressed data
+    are NaN are left out of the metrics.
+
+    Parameters
+    ----------
+    data : array-like
+        The input data. Any object that can be sliced to get NumPy arrays can be used (i.e. numpy.ndarray,
+        h5py.Dataset, netCDF4.Variable).
+    compression_specification : Encoding
+        The encoding specification to apply for the compression.
+    chunk_sizes : tuple of int, optional
+        The size of the chunks in each dimension. If not provided, the chunk sizes from the encoding are used and,
+        if the encoding doesn't have them, the chunk sizes that the writer would use.
+    workers : int, optional
+        Number of threads. Defaults to the number of available cores.
+    keep_decompressed : bool, optional, default=False
+        If True, the decompressed data is returned, otherwise the decompressed chunks are discarded.
+    value_range : tuple of float, optional
+        Minimum and maximum values of the data, used to define fixed histograms for the Kolmogorov-Smirnov metrics.
+        If not provided, adaptive histograms are used (see enstools.compression.accumulators.MergeableHistogram),
+        so each chunk is still read only once.
+    bins : int, optional, default=1000
+        Number of bins of the histograms.
+    fill_value : float, optional, default=0
+        Value used to pad the edge chunks (see enstools.compression.chunking.write_fill_value).
+
+    Returns
+    -------
+    decompressed : numpy.ndarray or None
+        The decompressed NumPy array if keep_decompressed is True, None otherwise.
+    metrics : dict
+        A dictionary containing the compression ratio and the quality metrics.
+
+    """
+    if chunk_sizes is None:
+        chunk_sizes = compression_specification.get("chunksizes") or write_chunk_sizes(data)
+    chunk_shape = _chunk_shape(chunk_sizes, data.shape)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    collection = MultiDimensionalSliceCollection(shape=data.shape, chunk_sizes=chunk_shape)
+    chunk_slices = collection.objects.ravel()
+    decompressed = numpy.empty(data.shape, dtype=data.dtype) if keep_decompressed else None
+
+    bin_edges = histogram_bin_edges(*value_range, bins=bins) if value_range is not None else None
+
+    def new_accumulator() -> ErrorAccumulator:
+        return ErrorAccumulator(bin_edges=bin_edges) if bin_edges is not None else ErrorAccumulator(bins=bins)
+
+    def emulate_chunk(chunk_slice) -> Tuple[int, ErrorAccumulator]:
+        chunk = numpy.asarray(data[chunk_slice.slices])
+        if isinstance(compression_specification, NullEncoding):
+            decompressed_chunk, compressed_size = chunk, chunk.nbytes
+        else:
+            out = decompressed[chunk_slice.slices] if keep_decompressed else None
+            decompressed_chunk, compressed_size = _emulate_block(chunk, compression_specification, out=out,
+                                                                 chunk_shape=chunk_shape, fill_value=fill_value)
+        if keep_decompressed and decompressed_chunk is chunk:
+            decompressed[chunk_slice.slices] = decompressed_chunk
+        # As in stream_metrics, the points where the data or the decompressed data are NaN are left out.
+        valid = ~(numpy.isnan(chunk) | numpy.isnan(decompressed_chunk))
+        if not valid.all():
+            chunk, decompressed_chunk = chunk[valid], decompressed_chunk[valid]
+        return compressed_size, new_accumulator().update(chunk, decompressed_chunk)
+
+    accumulator = new_accumulator()
+    total_compressed_size = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for compressed_size, chunk_accumulator in executor.map(emulate_chunk, chunk_slices):
+            total_compressed_size += compressed_size
+            accumulator.merge(chunk_accumulator)
+
+    uncompressed_size = numpy.prod(data.shape) * data.dtype.itemsize
+    metrics = {"compression_ratio": uncompressed_size / total_compressed_size, **accumulator.results()}
+    return decompressed, metrics
@@ -0,0 +1,139 @@
+"""
+Opt-in cache for the results of the compression emulation.
+
+When the same array is emulated many times with the same specification (i.e. re-plotting in a notebook or in the
+Streamlit playground), the decompressed data and the compression metrics can be reused instead of compressing again.
+
+The cache is disabled by default. To use it:
+
+    >>> from enstools.compression.emulation_cache import enable_emulation_cache
+    >>> enable_emulation_cache(max_memory="2GB")
+
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Tuple, Union
+
+import numpy as np
+
+from enstools.encoding.api import Encoding
+from enstools.encoding.dataset_encoding import convert_to_bytes
+
+
+class EmulationCache:
+    """
+    Thread-safe LRU cache of emulation results bounded by the memory used by the cached arrays.
+    """
+
+    def __init__(self, max_memory: Union[str, int] = "1GB"):
+        """
+        Initialize an empty cache.
+
+        Parameters
+        ----------
+        max_memory: str or int
+            Maximum memory used by the cached arrays, as a number of bytes or a string like "500MB".
+        """
+        self.max_memory = convert_to_bytes(max_memory) if isinstance(max_memory, str) else int(max_memory)
+        self._entries = OrderedDict()
+        self._memory = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(data: np.ndarray, compression_specification: Encoding, fill_value: float = 0) -> Tuple:
+        """
+        Get the key corresponding to an array, a compression specification and the value used to pad the edge chunks.
+
+        The array is identified by a fingerprint of its content, its shape and its type.
+        """
+        fingerprint = hashlib.blake2b(np.ascontiguousarray(data).data, digest_size=16).hexdigest()
+        return (fingerprint, data.shape, data.dtype.str,
+                compression_specification.to_string(), compression_specification.get("chunksizes"), str(fill_value))
+
+    def get(self, key: Tuple) -> Union[Tuple[np.ndarray, dict], None]:
+        """
+        Return a copy of the cached decompressed array and metrics, or None if the key is not in the cache.
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            decompressed, metrics = self._entries[key]
+        return decompressed.copy(), dict(metrics)
+
+    def put(self, key: Tuple, decompressed: np.ndarray, metrics: dict) -> None:
+        """
+        Store a copy of the decompressed array and its metrics, evicting the least recently used entries if needed.
+        Arrays bigger than the maximum memory are not cached.
+        """
+        if decompressed.nbytes > self.max_memory:
+            return
+        decompressed = decompressed.copy()
+        decompressed.setflags(write=False)
+        with self._lock:
+            if key in self._entries:
+                self._memory -= self._entries.pop(key)[0].nbytes
+            self._entries[key] = (decompressed, dict(metrics))
+            self._memory += decompressed.nbytes
+            while self._memory > self.max_memory:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._memory -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """
+        Remove all the entries and reset the statistics.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._memory = 0
+            self.hits = self.misses = self.evictions = 0
+
+    @property
+    def statistics(self) -> dict:
+        """
+        Hit and miss statistics and memory usage of the cache.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "memory": self._memory,
+                "max_memory": self.max_memory,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.statistics})"
+
+
+# Cache used by the emulation functions, None when disabled.
+emulation_cache: Union[EmulationCache, None] = None
+
+
+def enable_emulation_cache(max_memory: Union[str, int] = "1GB") -> EmulationCache:
+    """
+    Enable the emulation cache with a given memory limit and return it.
+    """
+    global emulation_cache  # pylint: disable=global-statement
+    emulation_cache = EmulationCache(max_memory=max_memory)
+    return emulation_cache
+
+
+def disable_emulation_cache() -> None:
+    """
+    Disable the emulation cache, releasing the cached arrays.
+    """
+    global emulation_cache  # pylint: disable=global-statement
+    emulation_cache = None
@@ -8,3 +8,6 @@ from .libpressio_emulator import LibpressioEmulator
 
 # Define the default emulator
 DefaultEmulator = FilterEmulator
+
+# Selection of the emulator depending on the specification
+from .registry import get_emulator  # noqa: E402
@@ -14,23 +14,65 @@ class Emulator(ABC):
     and has a method to compress_and_decompress the data.
 
     Its is useful to evaluate the errors that are introduced by the compression.
+
+    The implementations record the wall time in seconds of their last compression and decompression in the
+    attributes compression_time and decompression_time, and the size in bytes of the compressed data of the last
+    compression, without the overhead of any container format, in the attribute stored_size.
     """
+    compression_time: float = None
+    decompression_time: float = None
+    stored_size: int = None
+
     @abstractmethod
     def __init__(self, specification: Encoding, uncompressed_data: np.ndarray):
         """Init method requires certain parameters"""
 
     @abstractmethod
-    def compress_and_decompress(self, uncompressed_data: np.array) -> np.array:
+    def compress_and_decompress(self, uncompressed_data: np.array, out: np.array = None) -> np.array:
         """
         Gets a numpy array and returns the same array after compression and deflation .
+        The input array is only read, so it can be a read-only array or a view, and it is never copied.
         Parameters
         ----------
         uncompressed_data: numpy array
+        out: numpy array, optional
+            Preallocated array with the same shape and type as the input, where the decompressed data is written.
+            It allows reusing buffers between calls.
 
         Returns
         -------
         decompressed_data: numpy array
+            The decompressed data, which is the out array if it was provided.
+        """
+
+    @abstractmethod
+    def compressed_size(self, uncompressed_data: np.array) -> int:
+        """
+        Compress the data without decompressing it and return the size of the compressed data in bytes.
+        It is cheaper than compress_and_decompress when only the compression ratio is needed.
+        Parameters
+        ----------
+        uncompressed_data: numpy array
+
+        Returns
+        -------
+        compressed_size: int
+        """
+
+    def compressed_data_size(self, uncompressed_data: np.array) -> int:
+        """
+        Compress the data and return the size in bytes of the compressed data alone, without the overhead of
+        any container format (i.e. the hdf5 file metadata).
+        By default it is the same as compressed_size.
+        Parameters
+        ----------
+        uncompressed_data: numpy array
+
+        Returns
+        -------
+        compressed_data_size: int
         """
+        return self.compressed_size(uncompressed_data)
 
     @abstractmethod
     def compression_ratio(self) -> float:
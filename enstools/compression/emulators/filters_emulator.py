@@ -3,6 +3,7 @@ Definition of the class FilterEmulator: an Emulator that uses the hdf5 filters.
 """
 
 import io
+import time
 
 import numpy as np
 import h5py
@@ -28,6 +29,10 @@ if not hasattr(TempDir, "__enter__"):
     TempDir.__exit__ = __exit__
 
 
+# Name of the variable used inside the temporary files
+DUMMY_VARIABLE = "tmp"
+
+
 class FilterEmulator(Emulator):
     """
     Emulator class that relies on the hdf5 filters to compress the data using a IO file object to do that in memory.
@@ -64,21 +69,71 @@ class FilterEmulator(Emulator):
 
         raise NotImplementedError
 
-    def compress_and_decompress(self, uncompressed_data: np.ndarray) -> np.ndarray:
+    def compress_and_decompress(self, uncompressed_data: np.ndarray, out: np.ndarray = None) -> np.ndarray:
         """
         Compress and decompress the data.
 
         Args:
             uncompressed_data (np.ndarray): The uncompressed data.
+            out (np.ndarray, optional): Preallocated array where the decompressed data is written.
 
         Returns:
             np.ndarray: The decompressed data.
         """
 
-        # Create a temporary directory in the system memory
+        # Initialize file object
+        with io.BytesIO() as bio:
+
+            # Compress data
+            self._write(bio, uncompressed_data)
+
+            # Decompress data
+            with h5py.File(bio, mode="r") as temporary_file:
+                dataset = temporary_file[DUMMY_VARIABLE]
+                # Only the reading is timed, opening the in-memory file is an overhead of the emulation.
+                start = time.perf_counter()
+                if out is None:
+                    out = dataset[()]
+                # read_direct can only write into contiguous arrays
+                elif out.flags.c_contiguous:
+                    dataset.read_direct(out)
+                else:
+                    out[...] = dataset[()]
+                self.decompression_time = time.perf_counter() - start
+                return out
+
+    def compressed_size(self, uncompressed_data: np.ndarray) -> int:
+        """
+        Compress the data and return the size in bytes of the resulting in-memory file, without decompressing it.
+
+        Args:
+            uncompressed_data (np.ndarray): The uncompressed data.
 
-        dummy_var = "tmp"
+        Returns:
+            int: The compressed size in bytes.
+        """
+        with io.BytesIO() as bio:
+            return self._write(bio, uncompressed_data)
+
+    def compressed_data_size(self, uncompressed_data: np.ndarray) -> int:
+        """
+        Compress the data and return the size in bytes of the stored chunks, without the hdf5 file metadata.
 
+        Args:
+            uncompressed_data (np.ndarray): The uncompressed data.
+
+        Returns:
+            int: The size of the compressed chunks in bytes.
+        """
+        with io.BytesIO() as bio:
+            self._write(bio, uncompressed_data)
+        return self.stored_size
+
+    def _write(self, bio: io.BytesIO, uncompressed_data: np.ndarray) -> int:
+        """
+        Write the data into a file object using the hdf5 filters, store the compression ratio and
+        return the compressed size.
+        """
         # Calculate uncompressed size
         uncompressed_size = uncompressed_data.dtype.itemsize * uncompressed_data.size
 
@@ -89,25 +144,19 @@ class FilterEmulator(Emulator):
         else:
             encoding["chunks"] = uncompressed_data.shape
 
-        # Initialize file object
-        with io.BytesIO() as bio:
-
-            # Compress data
-            with h5py.File(bio, mode='w') as temporary_file:
-                temporary_file.create_dataset(dummy_var, data=uncompressed_data, **encoding)
-
-            # Get compressed file
-            compressed_size = bio.getbuffer().nbytes
-
-            # Decompress data
-            with h5py.File(bio, mode="r") as temporary_file:
-                recovered_data = temporary_file[dummy_var][()]
+        # Compress data
+        with h5py.File(bio, mode='w') as temporary_file:
+            start = time.perf_counter()
+            dataset = temporary_file.create_dataset(DUMMY_VARIABLE, data=uncompressed_data, **encoding)
+            self.compression_time = time.perf_counter() - start
+            self.stored_size = dataset.id.get_storage_size()
 
-            # Save compression ratio
-            self._compression_ratio = uncompressed_size / compressed_size
+        # Get compressed file
+        compressed_size = bio.getbuffer().nbytes
 
-            # Return the recovered data
-            return recovered_data
+        # Save compression ratio
+        self._compression_ratio = uncompressed_size / compressed_size
+        return compressed_size
 
     def compression_ratio(self):
         """
@@ -1,7 +1,18 @@
 """
 Definition of the class LibpressioEmulator: an Emulator that uses Libpressio.
+
+Creating a libpressio compressor is expensive compared with compressing a small array, so the compressors are kept
+in a per-thread session keyed by compressor, mode, data type, shape and execution policy. The same compressor can be
+shared by several emulators, so each emulator sets its own error bound before using it.
+
+The zfp compressor can use several cores through OpenMP:
+
+    >>> import enstools.compression.emulators.libpressio_emulator as libpressio_emulator
+    >>> libpressio_emulator.zfp_execution = "omp"
 """
 
+import threading
+import time
 
 import numpy as np
 
@@ -9,6 +20,14 @@ from enstools.compression.emulators.emulator_class import Emulator
 from enstools.core.errors import EnstoolsError
 from enstools.encoding.variable_encoding import Encoding, LossyEncoding
 
+# Execution policy used by zfp: "serial" or "omp". With "omp", zfp_threads sets the number of threads (0 means
+# the OpenMP default).
+zfp_execution = "serial"
+zfp_threads = 0
+
+# Per-thread cache of libpressio compressors, the compressors keep state and can't be shared among threads.
+_session = threading.local()
+
 
 def libpressio_is_available():
     # pylint: disable=import-outside-toplevel, unused-import
@@ -46,19 +65,16 @@ class LibpressioEmulator(Emulator):
         Raises:
             EnstoolsError: If the specification is not an instance of LossyEncoding.
         """
-        # pylint: disable=import-outside-toplevel, import-error
-
-        from libpressio import PressioCompressor
         if not isinstance(specification, LossyEncoding):
             raise EnstoolsError("Our current implementation of Libpressio only covers lossy compressors.")
         compressor_name = specification.compressor
         mode = specification.mode
         parameter = specification.parameter
-        self._config = compressor_configuration(
-            compressor_name, mode, parameter, uncompressed_data)
-        self.compressor = PressioCompressor.from_config(self._config)
+        self.compressor = get_compressor(compressor_name, mode, parameter, uncompressed_data)
+        self._error_bound_options = error_bound_options(compressor_name, mode, parameter)
         self._shape = None
         self._dtype = None
+        self._uncompressed_size = None
 
     def compress(self, uncompressed_data: np.ndarray) -> np.ndarray:
         """
@@ -73,47 +89,138 @@ class LibpressioEmulator(Emulator):
 
         self._shape = uncompressed_data.shape
         self._dtype = uncompressed_data.dtype
-        return self.compressor.encode(uncompressed_data)
-
-    def decompress(self, compressed_data: np.ndarray) -> np.ndarray:
+        self._uncompressed_size = uncompressed_data.nbytes
+        # The compressor can be shared with other emulators of the session, which might have changed the error bound.
+        self.compressor.set_options(self._error_bound_options)
+        start = time.perf_counter()
+        compressed_data = self.compressor.encode(uncompressed_data)
+        self.compression_time = time.perf_counter() - start
+        self.stored_size = memoryview(compressed_data).nbytes
+        return compressed_data
+
+    def decompress(self, compressed_data: np.ndarray, out: np.ndarray = None) -> np.ndarray:
         """
         Decompress the compressed data.
 
         Args:
             compressed_data (np.ndarray): The compressed data.
+            out (np.ndarray, optional): Preallocated array where the decompressed data is written.
 
         Returns:
             np.ndarray: The decompressed data.
         """
 
-        decompressed = np.zeros(shape=self._shape, dtype=self._dtype)
-        decompressed = self.compressor.decode(compressed_data, decompressed)
-        return decompressed
-
-    def compress_and_decompress(self, uncompressed_data: np.ndarray) -> np.ndarray:
+        # The template buffer only provides the shape and type, there is no need to initialize it.
+        template = out if out is not None and out.flags.c_contiguous else np.empty(shape=self._shape,
+                                                                                    dtype=self._dtype)
+        self.compressor.set_options(self._error_bound_options)
+        start = time.perf_counter()
+        decompressed = self.compressor.decode(compressed_data, template)
+        self.decompression_time = time.perf_counter() - start
+        if out is None:
+            return decompressed
+        # The python bindings return a new array instead of writing into the template.
+        if decompressed is not out:
+            np.copyto(out, decompressed)
+        return out
+
+    def compress_and_decompress(self, uncompressed_data: np.ndarray, out: np.ndarray = None) -> np.ndarray:
         """
         Compress and decompress the data.
 
         Args:
             uncompressed_data (np.ndarray): The uncompressed data.
+            out (np.ndarray, optional): Preallocated array where the decompressed data is written.
 
         Returns:
             np.ndarray: The decompressed data.
         """
 
         compressed_data = self.compress(uncompressed_data=uncompressed_data)
-        return self.decompress(compressed_data=compressed_data)
+        return self.decompress(compressed_data=compressed_data, out=out)
+
+    def compressed_size(self, uncompressed_data: np.ndarray) -> int:
+        """
+        Compress the data and return the compressed size in bytes, without decompressing it.
+
+        Args:
+            uncompressed_data (np.ndarray): The uncompressed data.
+
+        Returns:
+            int: The compressed size in bytes.
+        """
+
+        return memoryview(self.compress(uncompressed_data=uncompressed_data)).nbytes
 
     def compression_ratio(self):
         """
-        Get the compression ratio.
+        Get the compression ratio of the last compression done by this emulator.
 
         Returns:
             float: The compression ratio.
         """
 
-        metrics = self.compressor.get_metrics()
-        return metrics['size:compression_ratio']
+        # The metrics of the compressor would be the ones of the last emulator that used it.
+        return self._uncompressed_size / self.stored_size
+
+
+def get_compressor(compressor: str, mode: str, parameter: float, data: np.ndarray):
+    """
+    Get a libpressio compressor, reusing the one of the current thread's session if there is one with the same
+    compressor, mode, data type, shape and execution policy. The error bound of a reused compressor is not set here,
+    the emulators set it before compressing or decompressing.
+
+    Args:
+        compressor (str): The name of the compressor.
+        mode (str): The mode of the compressor.
+        parameter (float): The parameter of the compressor.
+        data (np.ndarray): The data.
+
+    Returns:
+        PressioCompressor: The compressor.
+    """
+    # pylint: disable=import-outside-toplevel, import-error
+    from libpressio import PressioCompressor
+
+    key = (compressor, mode, data.dtype.str, data.shape, zfp_execution, zfp_threads)
+    if not hasattr(_session, "compressors"):
+        _session.compressors = {}
+    pressio_compressor = _session.compressors.get(key)
+    if pressio_compressor is None:
+        config = compressor_configuration(compressor, mode, parameter, data)
+        pressio_compressor = PressioCompressor.from_config(config)
+        _session.compressors[key] = pressio_compressor
+    return pressio_compressor
+
+
+def clear_session() -> None:
+    """
+    Release the libpressio compressors of the current thread.
+    """
+    _session.compressors = {}
+
+
+def error_bound_options(compressor: str, mode: str, parameter: float) -> dict:
+    """
+    Options of the compressor configuration that depend on the compression parameter.
+
+    Args:
+        compressor (str): The name of the compressor.
+        mode (str): The mode of the compressor.
+        parameter (float): The parameter of the compressor.
+
+    Raises:
+        NotImplementedError: If the compressor is not implemented.
+    """
+    if compressor == "sz":
+        return {
+            "sz:abs_err_bound": parameter,
+            "sz:rel_err_bound": parameter,
+            "sz:pw_rel_err_bound": parameter,
+        }
+    if compressor == "zfp":
+        return {f"zfp:{mode}": parameter}
+    raise NotImplementedError(f"{compressor} {mode}")
 
 
 def compressor_configuration(compressor: str, mode: str, parameter: float,
@@ -134,20 +241,20 @@ def compressor_configuration(compressor: str, mode: str, parameter: float,
     if compressor == "sz":
         compressor_config = {
             "sz:error_bound_mode_str": mode,
-            "sz:abs_err_bound": parameter,
-            "sz:rel_err_bound": parameter,
-            "sz:pw_rel_err_bound": parameter,
+            **error_bound_options(compressor, mode, parameter),
             "sz:metric": "size",
         }
     elif compressor == "zfp":
         compressor_config = {
-            f"zfp:{mode}": parameter,
+            **error_bound_options(compressor, mode, parameter),
             "zfp:type": 3 if data.dtype == np.float32 else 4,
             "zfp:dims": len(data.shape),
             "zfp:wra": 0,
-            "zfp:execution_name": "serial",
+            "zfp:execution_name": zfp_execution,
             "zfp:metric": "size",
         }
+        if zfp_execution == "omp" and zfp_threads:
+            compressor_config["zfp:omp_threads"] = zfp_threads
     else:
         raise NotImplementedError(
             f"{compressor} {mode}")
@@ -0,0 +1,226 @@
+"""
+Registry of the available Emulator backends, with automatic selection of the fastest one.
+
+Each backend declares which compressors and modes it supports. The first time a combination of compressor, mode
+and data type is emulated, a short micro-benchmark is run with all the supported backends. The backends that
+produce the same decompressed data as the reference backend (the hdf5 filters) are eligible, and the fastest one is
+selected. The results are cached on disk per host, so the benchmark is only run once.
+
+Auto-selection is disabled by default, in which case DefaultEmulator is always used. To enable it:
+
+    >>> import enstools.compression.emulators.registry
+    >>> enstools.compression.emulators.registry.auto_selection = True
+
+Be aware that the compression ratio reported by the backends other than the hdf5 filters doesn't include the
+overhead of the hdf5 container.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Type, Union
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+from enstools.encoding.api import Encoding, LossyEncoding, VariableEncoding, lossy_compressors_and_modes
+from .emulator_class import Emulator
+from .filters_emulator import FilterEmulator
+from .libpressio_emulator import LibpressioEmulator, libpressio_is_available
+from .zfp_emulator import ZFPEmulator
+
+logger = logging.getLogger("enstools.compression.emulators")
+
+# Set to True to route each emulation to the fastest equivalent backend.
+auto_selection = False
+
+# Backend used as reference to check that the other backends give equivalent results.
+REFERENCE_BACKEND = "filters"
+
+EMULATOR_BACKENDS: Dict[str, Type[Emulator]] = {
+    "filters": FilterEmulator,
+    "zfp": ZFPEmulator,
+    "libpressio": LibpressioEmulator,
+}
+
+# Parameters used to benchmark each compression mode when no specification is provided.
+BENCHMARK_PARAMETERS = {
+    "abs": 0.01,
+    "rel": 0.001,
+    "pw_rel": 0.001,
+    "norm2": 0.001,
+    "psnr": 60.,
+    "rate": 8.,
+    "precision": 16,
+    "accuracy": 0.01,
+}
+
+# Shape of the synthetic data used in the micro-benchmark.
+BENCHMARK_SHAPE = (16, 64, 64)
+BENCHMARK_REPETITIONS = 3
+
+_lock = threading.Lock()
+_selection: Union[Dict[str, dict], None] = None
+
+
+def supported_backends(specification: Encoding) -> List[str]:
+    """
+    Return the names of the backends that can emulate a given specification.
+    """
+    backends = [REFERENCE_BACKEND]
+    if not isinstance(specification, LossyEncoding):
+        return backends
+
+    if specification.compressor == "zfp":
+        backends.append("zfp")
+    if specification.compressor in ["sz", "zfp"] and libpressio_is_available():
+        backends.append("libpressio")
+    return backends
+
+
+def get_emulator(specification: Encoding, dtype: np.dtype = np.float64) -> Type[Emulator]:
+    """
+    Return the Emulator class to use for a given specification and data type.
+
+    If auto_selection is False, FilterEmulator is returned.
+    """
+    if not auto_selection or not isinstance(specification, LossyEncoding):
+        return EMULATOR_BACKENDS[REFERENCE_BACKEND]
+
+    backends = supported_backends(specification)
+    if len(backends) == 1:
+        return EMULATOR_BACKENDS[backends[0]]
+
+    key = selection_key(specification.compressor, specification.mode, dtype)
+    with _lock:
+        selection = _load_selection()
+        if key not in selection:
+            selection[key] = benchmark_backends(specification, dtype)
+            _save_selection(selection)
+    return EMULATOR_BACKENDS[selection[key]["selected"]]
+
+
+def selection_key(compressor: str, mode: str, dtype: np.dtype) -> str:
+    """
+    Key used to identify a combination of compressor, mode and data type in the selection table.
+    """
+    return f"{compressor}:{mode}:{np.dtype(dtype).name}"
+
+
+def benchmark_data(dtype: np.dtype = np.float64, shape: tuple = BENCHMARK_SHAPE) -> np.ndarray:
+    """
+    Smooth synthetic field used for the micro-benchmarks.
+    """
+    random_generator = np.random.default_rng(seed=0)
+    data = gaussian_filter(15 + 8 * random_generator.standard_normal(shape), sigma=3)
+    return data.astype(dtype)
+
+
+def benchmark_backends(specification: LossyEncoding, dtype: np.dtype = np.float64) -> dict:
+    """
+    Run a short micro-benchmark with all the backends that support a specification.
+
+    Returns
+    -------
+    dict
+        Dictionary with the time per call of each backend (None if it doesn't give equivalent results
+        or fails) and the name of the selected backend.
+    """
+    data = benchmark_data(dtype)
+    reference = EMULATOR_BACKENDS[REFERENCE_BACKEND](specification, data).compress_and_decompress(data)
+
+    timings = {}
+    for name in supported_backends(specification):
+        try:
+            emulator = EMULATOR_BACKENDS[name](specification, data)
+            start = time.perf_counter()
+            for _ in range(BENCHMARK_REPETITIONS):
+                decompressed = emulator.compress_and_decompress(data)
+            elapsed = (time.perf_counter() - start) / BENCHMARK_REPETITIONS
+        except Exception as err:  # pylint: disable=broad-except
+            logger.debug("Backend %s failed with %s: %s", name, specification, err)
+            timings[name] = None
+            continue
+        timings[name] = elapsed if np.array_equal(decompressed, reference, equal_nan=True) else None
+
+    eligible = {name: elapsed for name, elapsed in timings.items() if elapsed is not None}
+    selected = min(eligible, key=eligible.get) if eligible else REFERENCE_BACKEND
+    logger.debug("Selected emulator backend %s for %s: %s", selected, specification, timings)
+    return {"timings": timings, "selected": selected}
+
+
+def selection_table(dtypes=(np.float32, np.float64)) -> Dict[str, dict]:
+    """
+    Benchmark (if not done yet) every compressor and mode for the given data types and return the selection table.
+    """
+    with _lock:
+        selection = _load_selection()
+        for compressor, modes in lossy_compressors_and_modes.items():
+            for mode in modes:
+                for dtype in dtypes:
+                    key = selection_key(compressor, mode, dtype)
+                    if key in selection:
+                        continue
+                    specification = VariableEncoding(compressor=compressor, mode=mode,
+                                                     parameter=BENCHMARK_PARAMETERS[mode])
+                    selection[key] = benchmark_backends(specification, dtype)
+        _save_selection(selection)
+        return dict(selection)
+
+
+def print_selection_table() -> None:
+    """
+    Print the selection table showing the time per call of each backend and the selected one.
+    """
+    table = selection_table()
+    backends = list(EMULATOR_BACKENDS)
+    print(f"Emulator selection table for host {socket.gethostname()!r} ({selection_file_path()})\n")
+    print(f"{'compressor:mode:dtype':30}" + "".join(f"{name:>14}" for name in backends) + f"{'selected':>14}")
+    for key, entry in sorted(table.items()):
+        timings = [entry["timings"].get(name) for name in backends]
+        cells = "".join(f"{t * 1000:>12.2f}ms" if t is not None else f"{'-':>14}" for t in timings)
+        print(f"{key:30}{cells}{entry['selected']:>14}")
+
+
+def selection_file_path() -> Path:
+    """
+    Path to the file where the selection table of the current host is cached.
+    """
+    cache_folder = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "enstools-compression"
+    return cache_folder / f"emulator_selection_{socket.gethostname()}.json"
+
+
+def clear_selection() -> None:
+    """
+    Remove the cached selection table, forcing the benchmarks to run again.
+    """
+    global _selection  # pylint: disable=global-statement
+    with _lock:
+        _selection = None
+        selection_file_path().unlink(missing_ok=True)
+
+
+def _load_selection() -> Dict[str, dict]:
+    global _selection  # pylint: disable=global-statement
+    if _selection is None:
+        path = selection_file_path()
+        try:
+            with path.open("r", encoding="utf-8") as stream:
+                _selection = json.load(stream)
+        except (FileNotFoundError, json.JSONDecodeError):
+            _selection = {}
+    return _selection
+
+
+def _save_selection(selection: Dict[str, dict]) -> None:
+    path = selection_file_path()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w", encoding="utf-8") as stream:
+            json.dump(selection, stream, indent=4, sort_keys=True)
+    except OSError as err:
+        logger.warning("Could not save the emulator selection table in %s: %s", path, err)
@@ -2,7 +2,7 @@
 Definition of the class ZFPEmulator: an Emulator that uses ZFP.
 Can only work with the ZFP compressor.
 """
-from sys import getsizeof
+import time
 
 import numpy as np
 import zfpy
@@ -48,10 +48,13 @@ class ZFPEmulator(Emulator):
         """
 
         # Compress the data
+        start = time.perf_counter()
         compressed_data = zfpy.compress_numpy(uncompressed_data, **self.parameters)
+        self.compression_time = time.perf_counter() - start
 
         # Get compression ratio
-        compressed_size = getsizeof(compressed_data)
+        compressed_size = len(compressed_data)
+        self.stored_size = compressed_size
         original_size = uncompressed_data.size * uncompressed_data.itemsize
         compression_ratio = original_size / compressed_size
         # Store compression ratio
@@ -70,21 +73,43 @@ class ZFPEmulator(Emulator):
             np.ndarray: The decompressed data.
         """
 
-        return zfpy.decompress_numpy(compressed_data)
+        start = time.perf_counter()
+        decompressed = zfpy.decompress_numpy(compressed_data)
+        self.decompression_time = time.perf_counter() - start
+        return decompressed
 
-    def compress_and_decompress(self, uncompressed_data: np.ndarray) -> np.ndarray:
+    def compress_and_decompress(self, uncompressed_data: np.ndarray, out: np.ndarray = None) -> np.ndarray:
         """
         Compress and decompress the data.
 
         Args:
             uncompressed_data (np.ndarray): The uncompressed data.
+            out (np.ndarray, optional): Preallocated array where the decompressed data is written.
 
         Returns:
             np.ndarray: The decompressed data.
         """
 
         compressed_data = self.compress(uncompressed_data=uncompressed_data)
-        return self.decompress(compressed_data=compressed_data)
+        decompressed = self.decompress(compressed_data=compressed_data)
+        if out is None:
+            return decompressed
+        # zfpy always allocates the decompressed array
+        np.copyto(out, decompressed)
+        return out
+
+    def compressed_size(self, uncompressed_data: np.ndarray) -> int:
+        """
+        Compress the data and return the compressed size in bytes, without decompressing it.
+
+        Args:
+            uncompressed_data (np.ndarray): The uncompressed data.
+
+        Returns:
+            int: The compressed size in bytes.
+        """
+
+        return len(self.compress(uncompressed_data=uncompressed_data))
 
     def compression_ratio(self):
         """
@@ -0,0 +1,142 @@
+"""
+#
+# Functions to estimate the size of the compressed files without compressing them.
+#
+
+"""
+import math
+from pathlib import Path
+from typing import Dict, List, Union
+
+from enstools.encoding.api import DatasetEncoding
+from enstools.io import read
+from enstools.io.paths import clean_paths
+from .chunking import write_fill_value
+from .emulation import estimate_compressed_size
+from .sampling import SizeEstimate, number_of_chunks
+from .size_metrics import convert_size, file_size
+
+
+def estimate_file_size(file_path: Path, compression: Union[str, dict, None], fraction: float = 0.01,
+                       min_chunks: int = 4) -> Dict[str, SizeEstimate]:
+    """
+    Estimate the compressed size of each variable of a file compressing a stratified random sample of its chunks.
+
+    Parameters
+    ----------
+    file_path: Path
+            path to the file
+    compression: str or dict
+            compression specification or path to yaml configuration file
+    fraction: float
+            fraction of the chunks of each variable that is read and compressed
+    min_chunks: int
+            minimum number of chunks sampled from each variable, if it has that many
+
+    Returns
+    -------
+    dict
+        Estimated compressed size of each variable (including the coordinates).
+    """
+    with read(file_path, decode_times=False) as dataset:
+        encodings = DatasetEncoding(dataset, compression).encoding()
+        estimates = {}
+        for variable in dataset.variables:
+            data_array = dataset[variable]
+            encoding = encodings[variable]
+            chunk_sizes = encoding.get("chunksizes", data_array.shape)
+            population_size = number_of_chunks(data_array.shape, chunk_sizes)
+            max_chunks = max(min_chunks, math.ceil(fraction * population_size))
+            estimates[str(variable)] = estimate_compressed_size(data_array, encoding, chunk_sizes=chunk_sizes,
+                                                                max_chunks=max_chunks,
+                                                                fill_value=write_fill_value(data_array))
+    return estimates
+
+
+def estimate(file_paths: Union[Path, str, List[Path], List[str]],
+             compression: Union[str, dict, None] = "lossless",
+             fraction: float = 0.01,
+             min_chunks: int = 4,
+             confidence: float = 0.95,
+             verbose: bool = False,
+             ) -> dict:
+    """
+    Estimate the total size of the files that would be produced by compress, reading only a small fraction of
+    the chunks of each variable.
+
+    Parameters
+    ----------
+    file_paths: string or list of strings
+            File-path or list of file-paths of the files that would be compressed.
+    compression: string
+            Compression specification or path to yaml configuration file.
+    fraction: float
+            Fraction of the chunks of each variable that is read and compressed.
+    min_chunks: int
+            Minimum number of chunks sampled from each variable.
+    confidence: float
+            Confidence level of the intervals.
+    verbose: bool
+            If True, the number of files that have been processed is printed.
+
+    Returns
+    -------
+    dict
+        Dictionary with the original size of the files, the estimated compressed size with its confidence interval,
+        the corresponding compression ratio interval and the estimates of each variable of each file.
+    """
+    file_paths = clean_paths(file_paths)
+    if len(file_paths) == 0:
+        raise AssertionError("file_paths can't be an empty list")
+
+    files = {}
+    for index, file_path in enumerate(file_paths):
+        if verbose:
+            print(f"\r{index + 1}/{len(file_paths)}", end="")
+        files[str(file_path)] = estimate_file_size(file_path, compression, fraction=fraction, min_chunks=min_chunks)
+    if verbose:
+        print()
+
+    total = sum((e for estimates in files.values() for e in estimates.values()), SizeEstimate(size=0.))
+    original_size = sum(file_size(file_path) for file_path in file_paths)
+    lower, upper = total.interval(confidence)
+    return {
+        "original_size": original_size,
+        "compressed_size": total.size,
+        "compressed_size_interval": (lower, upper),
+        "compression_ratio": original_size / total.size,
+        "compression_ratio_interval": (original_size / upper, original_size / lower if lower > 0 else float("inf")),
+        "confidence": confidence,
+        "files": files,
+    }
+
+
+def print_estimate(result: dict, quota: Union[str, None] = None) -> bool:
+    """
+    Print the summary of an estimate and, if a quota is provided, whether the compressed files would fit in it.
+
+    Returns
+    -------
+    bool
+        False if the upper bound of the estimated size exceeds the quota, True otherwise.
+    """
+    # pylint: disable=import-outside-toplevel
+    from enstools.encoding.dataset_encoding import convert_to_bytes
+
+    lower, upper = result["compressed_size_interval"]
+    ratio_lower, ratio_upper = result["compression_ratio_interval"]
+    confidence = f"{result['confidence']:.0%}"
+    print(f"Original size:   {convert_size(result['original_size'])}")
+    print(f"Compressed size: {convert_size(result['compressed_size'])} "
+          f"({confidence} interval: {convert_size(lower)} - {convert_size(upper)})")
+    print(f"Compression ratio: {result['compression_ratio']:.2f} "
+          f"({confidence} interval: {ratio_lower:.2f} - {ratio_upper:.2f})")
+
+    if quota is None:
+        return True
+    fits = upper <= convert_to_bytes(quota)
+    if fits:
+        print(f"The compressed files fit in the quota of {quota}.")
+    else:
+        print(f"The compressed files might not fit in the quota of {quota}.")
+    return fits
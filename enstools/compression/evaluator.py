@@ -4,9 +4,19 @@
 #
 
 """
+import os
 import warnings as _warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple, Union
 
-from enstools.compression.metrics import DataArrayMetrics, DatasetMetrics
+import numpy as np
+import pandas
+import xarray
+
+from enstools.core.errors import EnstoolsError
+from enstools.compression.metrics import DatasetMetrics, ReferenceStatistics, dataset_with_gradients
+from enstools.io import read
 
 # Some hardcoded ASCII characters to format the output
 HEADER = '\033[95m'
@@ -20,6 +30,29 @@ BOLD = '\033[1m'
 UNDERLINE = '\033[4m'
 V_CHAR = '\u2713'
 
+# As a tentative idea, we can rise some warnings in case some metrics are below certain thresholds:
+# These thresholds could be:
+#   ssim_I < 3
+#   correlation_I < 4
+#   nrmse_I < 2
+THRESHOLDS = {
+    "ssim_I": 3,
+    "correlation_I": 4,
+    "nrmse_I": 2,
+    # "max_rel_diff": 10000000,
+    "ks_I": 2,
+}
+
+# Metrics of the tables returned by evaluate, in addition to the ones with a threshold.
+TABLE_METRICS = [
+    "root_mean_square_error",
+    "peak_signal_to_noise_ratio",
+    "pearson_correlation",
+]
+
+# Columns of the tables returned by evaluate. The table has one row per variable, metric and time step.
+TABLE_COLUMNS = ["variable", "metric", "time", "value", "threshold", "passed"]
+
 
 def print_green(text: str):
     """Prints the given text in green color.
@@ -39,48 +72,48 @@ def print_red(text: str):
     print(f"{FAIL}{text}{ENDC}")
 
 
-def evaluate(reference_path: str, target_path: str, plot: bool = False, create_gradients: bool = False):
+def evaluate(reference_path: str, target_path: str, plot: bool = False, create_gradients: bool = False,
+             streaming: bool = False, workers: Union[int, None] = None, output: Union[str, Path, None] = None,
+             verbose: bool = True, output_folder: Union[str, Path] = "report") -> pandas.DataFrame:
     """
     The purpose of this routine is to obtain some metrics and plots on how similar are two datasets.
-    """
 
+    The files are opened lazily and the variables are evaluated on a pool of workers, the result of each variable
+    is printed as soon as it is ready. The plots are rendered on a pool of processes, workers sets the size of both
+    pools. The plots are saved in output_folder.
+    With streaming=True the metrics are computed reading each chunk of the files only once
+    (see enstools.compression.streaming_metrics), which keeps the memory bounded. The SSIM is not available in that
+    mode, and the gradients are computed on the fly one slice of the leading dimension at a time instead of being
+    added to the datasets.
+
+    The metrics are returned in a tidy table (see metrics_table), which is also written to output if provided
+    (see write_table). With verbose=False nothing is printed.
+    """
     file_comparison = DatasetMetrics(reference_path, target_path)
 
-    if create_gradients:
+    if create_gradients and not streaming:
         # Compute gradients and add it as new variables
         file_comparison.create_gradients()
         # Compute second order gradients and add it as new variables
         file_comparison.create_second_order_gradients()
 
-    # Get list of variables
-    variables = file_comparison.variables
-
-    # As a tentative idea, we can rise some warnings in case some metrics are below certain thresholds:
-    # These thresholds could be:
-    #   ssim_I < 3
-    #   correlation_I < 4
-    #   nrmse_I < 2
-
-    def checks(metrics: DataArrayMetrics):
-
-        thresholds = {
-            "ssim_I": 3,
-            "correlation_I": 4,
-            "nrmse_I": 2,
-            # "max_rel_diff": 10000000,
-            "ks_I": 2,
-        }
-        for key, value in thresholds.items():
+    def checks(metrics: Dict[str, xarray.DataArray]):
+        for key, value in THRESHOLDS.items():
+            if key not in metrics:
+                continue
             with _warnings.catch_warnings():
                 _warnings.simplefilter("ignore")
-                if any(metrics[key] < value):
+                if any(np.atleast_1d(metrics[key] < value)):
                     yield f"{BOLD}{key}{ENDC} index is low: {metrics[key].max().values:.1f}."
 
     warnings = {}
-    for variable in variables:
-        warnings[variable] = list(checks(file_comparison[variable]))
-
-    for variable in variables:
+    results = {}
+    for variable, metrics in file_comparison.compute([*THRESHOLDS, *TABLE_METRICS], workers=workers,
+                                                       streaming=streaming, gradients=create_gradients and streaming):
+        results[variable] = metrics
+        warnings[variable] = list(checks(metrics))
+        if not verbose:
+            continue
         if warnings[variable]:
             print_red(f"{variable} X")
             for warning in warnings[variable]:
@@ -88,13 +121,178 @@ def evaluate(reference_path: str, target_path: str, plot: bool = False, create_g
         else:
             print_green(f"{variable} {V_CHAR}")
 
-    print("\nSUMMARY:")
-    num_variables_with_warnings = sum(1 if len(warnings[v]) > 0 else 0 for v in variables)
-    if not num_variables_with_warnings:
-        print_green("Any variable has warnings!")
-    else:
-        print(f"{num_variables_with_warnings}/{len(variables)}  variables have warnings.\n\n")
+    if verbose:
+        print("\nSUMMARY:")
+        num_variables_with_warnings = sum(1 if len(warnings[v]) > 0 else 0 for v in warnings)
+        if not num_variables_with_warnings:
+            print_green("Any variable has warnings!")
+        else:
+            print(f"{num_variables_with_warnings}/{len(warnings)}  variables have warnings.\n\n")
 
     # Produce visual reports
     if plot:
-        file_comparison.make_plots()
+        file_comparison.make_plots(workers=workers, output_folder=str(output_folder), metric_values=results)
+
+    table = metrics_table(results)
+    if output is not None:
+        write_table(table, output)
+    return table
+
+
+def evaluate_batch(file_pairs: List[Tuple[str, str]], create_gradients: bool = False, streaming: bool = False,
+                   workers: Union[int, None] = None, output: Union[str, Path, None] = None) -> pandas.DataFrame:
+    """
+    Evaluate many pairs of reference and target files, several pairs at a time.
+
+    Parameters
+    ----------
+    file_pairs : list of tuple
+        The paths of the reference and the target of each pair.
+    create_gradients : bool, optional, default=False
+    streaming : bool, optional, default=False
+        See evaluate.
+    workers : int, optional
+        Total number of workers. Defaults to the number of available cores. They are split between the pairs that
+        are evaluated at the same time and the variables of each pair.
+    output : str or Path, optional
+        Path where the table is written (see write_table).
+
+    Returns
+    -------
+    pandas.DataFrame
+        The tables of all the pairs (see metrics_table), with two leading columns with the paths of the reference
+        and the target.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pair_workers = max(1, min(workers, len(file_pairs)))
+    variable_workers = max(1, workers // pair_workers)
+
+    def evaluate_pair(pair: Tuple[str, str]) -> pandas.DataFrame:
+        reference_path, target_path = pair
+        return evaluate(reference_path, target_path, create_gradients=create_gradients, streaming=streaming,
+                        workers=variable_workers, verbose=False)
+
+    table = _evaluate_pairs(evaluate_pair, file_pairs, pair_workers)
+    if output is not None:
+        write_table(table, output)
+    return table
+
+
+def evaluate_sweep(reference_path: str, target_paths: List[str], create_gradients: bool = False,
+                   workers: Union[int, None] = None, output: Union[str, Path, None] = None) -> pandas.DataFrame:
+    """
+    Evaluate many targets against the same reference, i.e. several candidate encodings of a file.
+
+    The reference is read once and kept in memory, and the statistics that only depend on the reference (its range,
+    quantiles and anomalies) are computed once and shared by all the targets, which are evaluated several at a time.
+    The statistics of a variable are released once all the targets have been compared on it.
+
+    Parameters
+    ----------
+    reference_path : str
+    target_paths : list of str
+    create_gradients : bool, optional, default=False
+        Evaluate the first and second order gradients too. The ones of the reference are computed once.
+    workers : int, optional
+        Total number of workers. Defaults to the number of available cores. They are split between the targets that
+        are evaluated at the same time and the variables of each target.
+    output : str or Path, optional
+        Path where the table is written (see write_table).
+
+    Returns
+    -------
+    pandas.DataFrame
+        The tables of all the targets (see metrics_table), with two leading columns with the paths of the reference
+        and the target.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pair_workers = max(1, min(workers, len(target_paths)))
+    variable_workers = max(1, workers // pair_workers)
+
+    reference = read(reference_path).load()
+    if create_gradients:
+        reference = dataset_with_gradients(reference)
+    reference_statistics = {variable: ReferenceStatistics(targets=len(target_paths))
+                            for variable in reference.data_vars}
+
+    def evaluate_pair(pair: Tuple[str, str]) -> pandas.DataFrame:
+        _, target_path = pair
+        target = read(target_path)
+        if create_gradients:
+            target = dataset_with_gradients(target.load())
+        file_comparison = DatasetMetrics(reference, target, reference_statistics=reference_statistics)
+        return metrics_table(dict(file_comparison.compute([*THRESHOLDS, *TABLE_METRICS], workers=variable_workers)))
+
+    table = _evaluate_pairs(evaluate_pair, [(reference_path, target_path) for target_path in target_paths],
+                            pair_workers)
+    if output is not None:
+        write_table(table, output)
+    return table
+
+
+def _evaluate_pairs(evaluate_pair: Callable[[Tuple[str, str]], pandas.DataFrame],
+                    file_pairs: List[Tuple[str, str]], pair_workers: int) -> pandas.DataFrame:
+    """
+    Get the tables of several pairs of files on a thread pool, printing the result of each pair when it is ready,
+    and join them adding the paths of the reference and the target.
+    """
+    tables = {}
+    with ThreadPoolExecutor(max_workers=pair_workers) as executor:
+        futures = {executor.submit(evaluate_pair, pair): index for index, pair in enumerate(file_pairs)}
+        for future in as_completed(futures):
+            reference_path, target_path = file_pairs[futures[future]]
+            table = future.result()
+            table.insert(0, "target", str(target_path))
+            table.insert(0, "reference", str(reference_path))
+            tables[futures[future]] = table
+            failed_variables = table.loc[~table["passed"], "variable"].unique()
+            if len(failed_variables):
+                print_red(f"{target_path} X ({len(failed_variables)} variables have warnings)")
+            else:
+                print_green(f"{target_path} {V_CHAR}")
+    return pandas.concat([tables[index] for index in sorted(tables)], ignore_index=True)
+
+
+def metrics_table(results: Dict[str, Dict[str, xarray.DataArray]]) -> pandas.DataFrame:
+    """
+    Convert the metrics of each variable into a tidy table with the columns of TABLE_COLUMNS: one row per variable,
+    metric and time step, the threshold of the metric (NaN if it has none) and whether the value fulfills it.
+    The time is NaN for the variables without time.
+    """
+    rows = []
+    for variable, metrics in results.items():
+        for metric, values in metrics.items():
+            threshold = THRESHOLDS.get(metric, np.nan)
+            if "time" in values.dims:
+                times, values = values["time"].values, values.values
+            else:
+                times, values = [np.nan], np.atleast_1d(values.values)
+            for time, value in zip(times, values):
+                # As in the checks of evaluate, the NaN values don't count as a violation
+                passed = not value < threshold
+                rows.append((variable, metric, time, float(value), float(threshold), passed))
+    return pandas.DataFrame(rows, columns=TABLE_COLUMNS)
+
+
+def write_table(table: pandas.DataFrame, path: Union[str, Path]) -> None:
+    """
+    Write a table of metrics. The format is selected with the extension of the path:
+    .csv, .parquet (needs pyarrow or fastparquet) or .nc (a NetCDF file with one variable per column).
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".csv":
+        table.to_csv(path, index=False)
+    elif suffix == ".parquet":
+        table.to_parquet(path, index=False)
+    elif suffix == ".nc":
+        dataset = xarray.Dataset.from_dataframe(table.rename_axis("row"))
+        # Plain strings instead of python objects, so the text columns can be written
+        for column in dataset.data_vars:
+            if dataset[column].dtype == object:
+                dataset[column] = dataset[column].astype(str)
+        dataset.to_netcdf(path)
+    else:
+        raise EnstoolsError(f"Unknown format for the table {str(path)!r}, use .csv, .parquet or .nc")
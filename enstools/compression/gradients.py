@@ -0,0 +1,38 @@
+"""
+Magnitude of the gradients of the fields, used to evaluate how the compression affects their spatial structure.
+
+The gradients are computed over all the dimensions except the leading one (typically time), one leading slice at
+a time, so the temporaries only have the size of a slice. Single precision data stays in single precision.
+"""
+import numpy as np
+
+
+def gradient_magnitude(values: np.ndarray) -> np.ndarray:
+    """
+    Euclidean norm of the gradient of an array over all its axes. The axes with less than two points are ignored.
+    """
+    dtype = np.float32 if values.dtype == np.float32 else np.float64
+    values = np.asarray(values, dtype=dtype)
+    magnitude = np.zeros(values.shape, dtype=dtype)
+    for axis, size in enumerate(values.shape):
+        if size < 2:
+            continue
+        derivative = np.gradient(values, axis=axis)
+        np.multiply(derivative, derivative, out=derivative)
+        magnitude += derivative
+    return np.sqrt(magnitude, out=magnitude)
+
+
+def leading_slice_gradient_magnitude(values: np.ndarray, order: int = 1) -> np.ndarray:
+    """
+    Magnitude of the gradient of each slice along the leading axis, computed over the other axes.
+    With order > 1, the magnitude of the gradient is applied again to the result.
+    """
+    dtype = np.float32 if values.dtype == np.float32 else np.float64
+    result = np.empty(values.shape, dtype=dtype)
+    for index in range(values.shape[0]):
+        block = values[index]
+        for _ in range(order):
+            block = gradient_magnitude(block)
+        result[index] = block
+    return result
@@ -3,16 +3,24 @@ This module provides tools to compute metrics on two datasets, typically a refer
 and a target dataset, where both datasets have the same variables and dimensions.
 """
 
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from inspect import getmembers, isfunction, signature
+from multiprocessing import shared_memory
 from os import makedirs
 from os.path import isdir, join
 from os.path import isfile
-from typing import Callable, Union
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Union
 
 import numpy as np
 import xarray
 
 import enstools.scores
+from enstools.compression import ssim
+from enstools.compression.gradients import leading_slice_gradient_magnitude
+from enstools.compression.streaming_metrics import STREAMING_METRICS, stream_metrics
 from enstools.core.errors import EnstoolsError
 from enstools.io import read
 
@@ -37,27 +45,375 @@ def get_matching_scores(arguments: list) -> dict:
     return {name: fun for name, fun in functions_list if check_signature(fun)}
 
 
-# Workaround to update the list of available metrics when the metrics are used,
-# not only when the module is imported.
+# Metrics shown in the radar chart of the summary plots.
+SUMMARY_PLOT_METRICS = ["correlation_I", "ssim_I", "nrmse_I"]
+
+# Known properties of the scores of enstools.scores: (higher_is_better, cost).
+# The cost is "cheap" for element-wise operations and reductions, "moderate" for metrics that need sorting or
+# quantiles and "expensive" for the ones that work with windows or ensembles.
+METRIC_PROPERTIES = {
+    "mean_square_error": (False, "cheap"),
+    "root_mean_square_error": (False, "cheap"),
+    "normalized_root_mean_square_error": (False, "moderate"),
+    "normalized_root_mean_square_error_index": (True, "moderate"),
+    "peak_signal_to_noise_ratio": (True, "cheap"),
+    "pearson_correlation": (True, "cheap"),
+    "pearson_correlation_index": (True, "cheap"),
+    "positivity": (True, "cheap"),
+    "kolmogorov_smirnov": (True, "moderate"),
+    "kolmogorov_smirnov_index": (True, "moderate"),
+    "kolmogorov_smirnov_multicell": (True, "expensive"),
+    "structural_similarity_index": (True, "expensive"),
+    "structural_similarity_log_index": (True, "expensive"),
+    "continuous_ranked_probability_score": (False, "expensive"),
+}
+
+
+@dataclass(frozen=True)
+class MetricInfo:
+    """
+    Metadata of a metric.
+
+    Attributes:
+        name: Name under which the metric is registered in enstools.scores.
+        function: The function that computes the metric.
+        pairwise: True if it compares a reference and a target, False if it only uses the reference.
+        higher_is_better: True if higher values mean better quality, False if lower values do and None if unknown.
+        cost: "cheap", "moderate", "expensive" or "unknown".
+    """
+    name: str
+    function: Callable
+    pairwise: bool
+    higher_is_better: Union[bool, None] = None
+    cost: str = "unknown"
+
+    @property
+    def reference_only(self) -> bool:
+        """
+        Whether the metric only uses the reference.
+        """
+        return not self.pairwise
+
+
+class MetricRegistry:
+    """
+    Registry of the metrics available in enstools.scores.
+
+    The scores are inspected only once and the registry is rebuilt when new scores are registered
+    (i.e. with enstools.scores.add_score_from_file), so the lookups don't need to inspect the module again.
+    New names are detected comparing the number of members of the module, and replaced functions are detected
+    when they are looked up. It can also be rebuilt explicitly with invalidate().
+    """
+
+    def __init__(self, module=enstools.scores):
+        self._module = module
+        self._metrics: Dict[str, MetricInfo] = {}
+        self._fingerprint = None
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def invalidate(self) -> None:
+        """
+        Force the registry to be rebuilt in the next lookup.
+        """
+        self._fingerprint = None
+
+    def __getitem__(self, name: str) -> MetricInfo:
+        info = self._get_metrics().get(name)
+        # The function might have been replaced registering another one with the same name
+        if info is not None and info.function is not getattr(self._module, name, None):
+            self.invalidate()
+            info = self._get_metrics().get(name)
+        if info is None:
+            raise KeyError(name)
+        return info
+
+    def __contains__(self, name: str) -> bool:
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self._get_metrics())
+
+    def __len__(self) -> int:
+        return len(self._get_metrics())
+
+    def pairwise(self) -> Dict[str, Callable]:
+        """
+        Dictionary with the functions of the metrics that compare a reference and a target.
+        """
+        return {name: info.function for name, info in self._get_metrics().items() if info.pairwise}
+
+    def _get_metrics(self) -> Dict[str, MetricInfo]:
+        fingerprint = len(vars(self._module))
+        if fingerprint != self._fingerprint:
+            with self._lock:
+                if fingerprint != self._fingerprint:
+                    self._metrics = self._build()
+                    self._fingerprint = fingerprint
+        return self._metrics
+
+    def _build(self) -> Dict[str, MetricInfo]:
+        self.builds += 1
+        metrics = {}
+        for name, function in getmembers(self._module, isfunction):
+            parameters = signature(function).parameters
+            if "reference" not in parameters:
+                continue
+            # Aliases and plugins that reuse a known function get its properties
+            properties = METRIC_PROPERTIES.get(name, METRIC_PROPERTIES.get(function.__name__, (None, "unknown")))
+            metrics[name] = MetricInfo(name=name, function=function, pairwise="target" in parameters,
+                                       higher_is_better=properties[0], cost=properties[1])
+        return metrics
+
+
+# Registry used to look up the metrics.
+metric_registry = MetricRegistry()
+
 
 def get_available_metrics() -> dict:
     """
     A function to get the list of available metrics and update it when needed.
     """
-    return get_matching_scores(arguments=["reference", "target"])
+    return metric_registry.pairwise()
+
+
+def _non_temporal_dimensions(data_array: xarray.DataArray) -> List[str]:
+    return [d for d in data_array.dims if d != "time"]
+
+
+def _time_samples(data_array: xarray.DataArray) -> np.ndarray:
+    """
+    Values of a DataArray as a 2D array (time, samples), without copying them when possible.
+    """
+    if "time" in data_array.dims:
+        return data_array.transpose("time", ...).values.reshape(data_array.sizes["time"], -1)
+    return data_array.values.reshape(1, -1)
+
+
+def _validity_mask(reference: xarray.DataArray, target: xarray.DataArray) -> Union[np.ndarray, None]:
+    """
+    Points where both the reference and the target are not NaN, as a 2D array (time, samples).
+    None if all the points are valid.
+    """
+    invalid = np.isnan(_time_samples(reference))
+    invalid |= np.isnan(_time_samples(target.transpose(*reference.dims)))
+    if not invalid.any():
+        return None
+    return ~invalid
+
+
+def _mask_data_array(valid: Union[np.ndarray, None], like: xarray.DataArray) -> Union[xarray.DataArray, None]:
+    """
+    Wrap a validity mask with the dimensions of a DataArray (with time first).
+    """
+    if valid is None:
+        return None
+    like = like.transpose("time", ...) if "time" in like.dims else like
+    return xarray.DataArray(valid.reshape(like.shape), dims=like.dims)
+
+
+def _anomaly(data_array: xarray.DataArray, valid: Union[np.ndarray, None] = None) -> np.ndarray:
+    """
+    Deviation from the mean of each time step in double precision, as a 2D array (time, samples).
+    The mean only uses the valid points and the anomaly of the invalid points is set to 0.
+    """
+    values = _time_samples(data_array).astype(np.float64)
+    if valid is None:
+        return values - values.mean(axis=1, keepdims=True)
+    values -= values.sum(axis=1, where=valid, keepdims=True) / valid.sum(axis=1, keepdims=True)
+    values[~valid] = 0.
+    return values
+
+
+def _value_range(data_array: xarray.DataArray, valid: Union[np.ndarray, None] = None) -> xarray.DataArray:
+    """
+    Range of the valid values of each time step.
+    """
+    if valid is None:
+        dimensions = _non_temporal_dimensions(data_array)
+        return data_array.max(dim=dimensions) - data_array.min(dim=dimensions)
+    values = _time_samples(data_array)
+    value_range = np.max(values, axis=1, where=valid, initial=-np.inf) - \
+        np.min(values, axis=1, where=valid, initial=np.inf)
+    return _per_time_step(value_range, data_array)
+
+
+def _inter_quartile_range(data_array: xarray.DataArray, valid: Union[np.ndarray, None] = None) -> \
+        xarray.DataArray:
+    """
+    Inter quartile range of all the valid values.
+    """
+    if valid is None:
+        return data_array.quantile(0.75) - data_array.quantile(0.25)
+    values = _time_samples(data_array)[valid]
+    return xarray.DataArray(np.quantile(values, 0.75) - np.quantile(values, 0.25))
+
+
+def _kolmogorov_smirnov(reference: xarray.DataArray, target: xarray.DataArray,
+                        valid: Union[np.ndarray, None] = None) -> xarray.DataArray:
+    """
+    P-value of the two-sample Kolmogorov-Smirnov test of each time step, using only the valid points.
+    """
+    # pylint: disable=import-outside-toplevel
+    from scipy.stats import ks_2samp
+
+    reference_values = _time_samples(reference)
+    target_values = _time_samples(target.transpose(*reference.dims))
+    pvalues = np.full(reference_values.shape[0], np.nan)
+    for index, (reference_step, target_step) in enumerate(zip(reference_values, target_values)):
+        if valid is not None:
+            reference_step, target_step = reference_step[valid[index]], target_step[valid[index]]
+        if reference_step.size:
+            pvalues[index] = ks_2samp(target_step, reference_step, alternative="two-sided").pvalue
+    return _per_time_step(pvalues, reference)
+
+
+def _per_time_step(values: np.ndarray, like: xarray.DataArray) -> xarray.DataArray:
+    """
+    Wrap an array with a value per time step in a DataArray.
+    """
+    if "time" in like.dims:
+        return xarray.DataArray(values, dims=["time"], coords={"time": like["time"]})
+    return xarray.DataArray(values[0])
+
+
+def _correlation(covariance: np.ndarray, reference_norm: np.ndarray, target_norm: np.ndarray,
+                 like: xarray.DataArray) -> xarray.DataArray:
+    # As scipy.stats.pearsonr, NaN for constant inputs and clipped to [-1, 1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        correlation = np.clip(covariance / (reference_norm * target_norm), -1., 1.)
+    correlation[(reference_norm == 0) | (target_norm == 0)] = np.nan
+    return _per_time_step(correlation, like)
+
+
+# Dependency graph of the intermediate quantities shared by the metrics: name -> (dependencies, function).
+# The function gets the DataArrayMetrics object and the values of the dependencies. The moments used by the
+# correlation are kept as NumPy arrays with the time steps in the first axis.
+# The reductions are done over all the dimensions except time, as in enstools.scores, and the entries named as a
+# score of enstools.scores are used instead of the score itself. The ones built with the same operations give exactly
+# the same values. The correlation is computed in double precision from the shared moments, it differs from the one
+# of scipy in the last digits for double precision data and it is more accurate for single precision data.
+# The SSIM uses the tiled implementation of enstools.compression.ssim, see its tolerance there.
+# The points where the reference or the target are NaN are left out of all the metrics using the shared validity
+# mask ("valid", None when there are no NaNs). The difference is NaN at those points, so the means of the errors,
+# which skip NaNs, are already masked.
+INTERMEDIATES = {
+    "valid": ((), lambda m: _validity_mask(m.reference, m.target)),
+    "difference": ((), lambda m: m.target - m.reference),
+    "squared_error": (("difference",), lambda m, difference: difference ** 2),
+    "reference_range": (("valid",), lambda m, valid: _value_range(m.reference, valid)),
+    "reference_inter_quartile_range": (("valid",), lambda m, valid: _inter_quartile_range(m.reference, valid)),
+    "reference_anomaly": (("valid",), lambda m, valid: _anomaly(m.reference, valid)),
+    "target_anomaly": (("valid",), lambda m, valid: _anomaly(m.target.transpose(*m.reference.dims), valid)),
+    "reference_norm": (("reference_anomaly",), lambda m, anomaly: np.sqrt(np.einsum("ij,ij->i", anomaly, anomaly))),
+    "target_norm": (("target_anomaly",), lambda m, anomaly: np.sqrt(np.einsum("ij,ij->i", anomaly, anomaly))),
+    "covariance": (("reference_anomaly", "target_anomaly"),
+                   lambda m, reference, target: np.einsum("ij,ij->i", reference, target)),
+    "mean_square_error": (("squared_error",),
+                          lambda m, squared_error: squared_error.mean(dim=_non_temporal_dimensions(m.reference))),
+    "root_mean_square_error": (("mean_square_error",), lambda m, mse: mse ** .5),
+    "normalized_root_mean_square_error": (
+        ("root_mean_square_error", "reference_inter_quartile_range"),
+        lambda m, rmse, iqr: rmse / iqr if iqr != 0. else rmse),
+    "normalized_root_mean_square_error_index": (
+        ("normalized_root_mean_square_error",),
+        lambda m, nrmse: xarray.where(nrmse > 0, - np.log10(nrmse), np.inf)),
+    "peak_signal_to_noise_ratio": (("reference_range", "mean_square_error"),
+                                   lambda m, value_range, mse: 20 * np.log10(value_range) - 10 * np.log10(mse)),
+    "pearson_correlation": (("covariance", "reference_norm", "target_norm"),
+                            lambda m, *args: _correlation(*args, like=m.reference)),
+    "structural_similarity_index": (
+        ("valid",),
+        lambda m, valid: ssim.structural_similarity_index(m.reference, m.target,
+                                                          valid=_mask_data_array(valid, m.reference))),
+    "structural_similarity_log_index": (
+        ("structural_similarity_index",),
+        lambda m, value: xarray.where(value >= 1.0, np.inf, - np.log10(1 - value))),
+    "pearson_correlation_index": (
+        ("pearson_correlation",),
+        lambda m, correlation: xarray.where(correlation.fillna(0) == 1.0, np.inf,
+                                            - np.log10(1 - correlation.fillna(0)))),
+    "kolmogorov_smirnov": (("valid",), lambda m, valid: _kolmogorov_smirnov(m.reference, m.target, valid)),
+    "kolmogorov_smirnov_index": (("kolmogorov_smirnov",),
+                                 lambda m, pvalue: xarray.where(pvalue < 1.0, - np.log10(1 - pvalue), np.inf)),
+}
+
+# Intermediates that only depend on the reference (and the validity mask). They can be shared by the DataArrayMetrics
+# of several targets compared to the same reference, see DataArrayMetrics.
+REFERENCE_INTERMEDIATES = (
+    "reference_range",
+    "reference_inter_quartile_range",
+    "reference_anomaly",
+    "reference_norm",
+)
+
+
+class ReferenceStatistics:
+    """
+    Intermediates of a reference variable shared by the DataArrayMetrics of several targets, see DataArrayMetrics.
+
+    It can be used from several threads: each intermediate is computed by the first thread that needs it, and the
+    other ones wait for its result. If the number of targets is given, the intermediates are released once all of
+    them are done (see target_done), so the anomaly of the reference doesn't stay in memory until the end.
+    """
+
+    def __init__(self, targets: Union[int, None] = None) -> None:
+        self.targets = targets
+        self.done = 0
+        self._values: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str, compute: Callable[[], Any]) -> Any:
+        """
+        Return the intermediate with this name, calling compute if no other target has computed it yet.
+        """
+        with self._lock:
+            future = self._values.get(name)
+            owner = future is None
+            if owner:
+                future = self._values[name] = Future()
+        if owner:
+            try:
+                future.set_result(compute())
+            except BaseException as error:
+                future.set_exception(error)
+                raise
+        return future.result()
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return name in self._values
+
+    def target_done(self) -> None:
+        """
+        Mark one of the targets as done, releasing the intermediates after the last one.
+        """
+        with self._lock:
+            self.done += 1
+            if self.targets is not None and self.done >= self.targets:
+                self._values.clear()
 
 
 class DataArrayMetrics:
     """
     First object-oriented approach to avoid redundant computation of metrics
     (i.e., don't compute MSE several times).
+
+    To compare several targets with the same reference, the same ReferenceStatistics object can be passed to
+    all of them, and the intermediates of REFERENCE_INTERMEDIATES are computed only once. They are only shared when
+    the NaNs of the target are at the same points as the ones of the reference, otherwise they are computed with
+    the validity mask of the pair as usual.
     """
 
     difference: np.ndarray
-    available_metrics: list
 
     def __init__(self, reference: Union[xarray.DataArray, np.ndarray],
-                 target: Union[xarray.DataArray, np.ndarray]) -> None:
+                 target: Union[xarray.DataArray, np.ndarray],
+                 reference_statistics: Union[ReferenceStatistics, None] = None) -> None:
         """
         Initialize a new DataArrayMetrics object.
         """
@@ -72,14 +428,19 @@ class DataArrayMetrics:
         else:
             self.target = target
 
-        # If the inputs have NaNs, replace them with a fill value
-        self.fix_nan()
+        # The inputs are never modified, the NaNs are handled with a shared validity mask (see INTERMEDIATES).
 
-        # Initialize an empty dictionary for metrics
+        # Initialize an empty dictionary for metrics and another one for the shared intermediate quantities
         self.metric_values = {}
+        self.intermediate_values = {}
+        self.reference_statistics = reference_statistics
 
-        # Add the list of available metrics from metric_definitions
-        self.available_metrics = list(get_available_metrics().keys())
+    @property
+    def available_metrics(self) -> List[str]:
+        """
+        Names of the metrics that can be computed.
+        """
+        return list(get_available_metrics())
 
     def __getitem__(self, name: str) -> xarray.DataArray:
         """
@@ -91,33 +452,64 @@ class DataArrayMetrics:
             self.metric_values[name] = self.compute_metric(name)
         return self.metric_values[name]
 
-    def fix_nan(self, fill_value: float = -1000):
+    def intermediate(self, name: str) -> Union[xarray.DataArray, np.ndarray]:
+        """
+        Return an intermediate quantity of INTERMEDIATES, computing it and its dependencies only once.
+        """
+        if name not in self.intermediate_values:
+            if name in REFERENCE_INTERMEDIATES and self.shares_reference_statistics():
+                self.intermediate_values[name] = self.reference_statistics.get(
+                    name, lambda: self._compute_intermediate(name))
+            else:
+                self.intermediate_values[name] = self._compute_intermediate(name)
+        return self.intermediate_values[name]
+
+    def _compute_intermediate(self, name: str) -> Union[xarray.DataArray, np.ndarray]:
+        dependencies, function = INTERMEDIATES[name]
+        return function(self, *(self.intermediate(d) for d in dependencies))
+
+    def shares_reference_statistics(self) -> bool:
         """
-        Replace NaNs in the reference and target arrays with a fill value.
+        Whether the intermediates that only depend on the reference can be taken from reference_statistics, which
+        requires the validity mask of the pair to be the one of the reference alone.
         """
-        # Replace NaNs with a fill value.
-        if np.isnan(self.reference.values).any():
-            self.reference.values[np.isnan(self.reference.values)] = fill_value
-        if np.isnan(self.target.values).any():
-            self.target.values[np.isnan(self.target.values)] = fill_value
+        if self.reference_statistics is None:
+            return False
+        reference_valid = self.reference_statistics.get("valid", lambda: _validity_mask(self.reference, self.reference))
+        valid = self.intermediate("valid")
+        if reference_valid is None or valid is None:
+            return reference_valid is valid
+        return np.array_equal(reference_valid, valid)
 
     def compute_metric(self, method: str) -> xarray.DataArray:
         """
         Compute the specified metric for the reference and target arrays.
         """
-        if method not in self.available_metrics:
+        info = metric_registry[method] if method in metric_registry else None
+        if info is None or not info.pairwise:
             raise EnstoolsError(f"Metric {method!r} not available.")
-        return get_available_metrics()[method](self.reference, self.target)
+        # The scores of enstools.scores (and their aliases) that are in the graph reuse the shared intermediates
+        function = info.function
+        if function.__module__.startswith("enstools.scores") and function.__name__ in INTERMEDIATES:
+            return self.intermediate(function.__name__)
+        return function(self.reference, self.target)
 
     def plot_summary(self, output_folder: str = "report"):
-        # pylint: disable=import-outside-toplevel
         """
         Generate a summary plot for the reference, target, and their differences.
         """
-        import matplotlib.pyplot as plt
-        import matplotlib as mpl
+        plot_data = self.summary_plot_data()
+        if plot_data is not None:
+            render_summary_plot(*plot_data, output_folder=output_folder)
 
-        # TODO: This is not the proper place to put this code. Move it somewhere else.
+    def summary_plot_data(self, metric_values: Union[Dict[str, xarray.DataArray], None] = None) -> \
+            Union[Tuple[str, np.ndarray, np.ndarray, np.ndarray], None]:
+        """
+        Get what is needed to render the summary plot: the name of the variable, the 2D slices of the reference and
+        the target that are shown and the values of the metrics of the radar chart.
+        Already computed values of the metrics can be provided to avoid computing them again.
+        None is returned for 1D variables, which are not plotted.
+        """
         # Get dimensions
         shape = self.reference.shape
         # Get variable name from DataArray object
@@ -131,57 +523,15 @@ class DataArrayMetrics:
         elif len(shape) == 2:
             slice_indices = slice(None), slice(None)
         elif len(shape) == 1:
-            return
+            return None
         else:
             raise NotImplementedError
 
-        reference_data = self.reference[slice_indices]
-        target_data = self.target[slice_indices]
-
-        var_range = np.max(reference_data) - np.min(reference_data)
-
-        # Prepare a plot of an intermediate level
-        plt.figure(figsize=(9, 9))
-
-        # Plot reference
-        plt.subplot(int("411"))
-        plt.imshow(reference_data)
-        plt.colorbar()
-        # Plot comparison target
-        plt.subplot(int("412"))
-        plt.imshow(target_data)
-        plt.colorbar()
-
-        # Plot differences
-        plt.subplot(int("413"))
-        color_levels = 7
-        cmap = plt.cm.seismic  # define the colormap
-        # extract all colors from the colormap
-        cmaplist = [cmap(i) for i in range(cmap.N)]
-        # Generate new colormap with only few levels
-        cmap = mpl.colors.LinearSegmentedColormap.from_list('Custom cmap', cmaplist, color_levels)
-        difference = self.target[slice_indices] - self.reference[slice_indices]
-        max_abs_diff = max(abs(np.min(difference)), np.max(difference))
-        factor = var_range / max_abs_diff
-        vmin = -max_abs_diff
-        vmax = max_abs_diff
-        plt.imshow(difference, vmin=vmin, vmax=vmax, cmap=cmap)
-        plt.title(f"The difference range is {factor:.1f} smaller than the InterQuartileRange")
-        cbar = plt.colorbar()
-        cbar.set_ticks(np.linspace(vmin, vmax, color_levels + 1))
-
-        # Put something related with the metrics
-        fig = plt.gcf()
-        axis = fig.add_subplot(414, polar=True)
-
-        selected_metrics = ["correlation_I", "ssim_I", "nrmse_I"]
-        selected_values = np.array([self[m] for m in selected_metrics])
-        make_radar_chart(variable_name, selected_metrics, selected_values, axis)
-        if not isdir(output_folder):
-            makedirs(output_folder)
-        plt.tight_layout()
-        plt.savefig(join(output_folder, f"report_{variable_name}.png"))
-        plt.close("all")
+        metric_values = metric_values or {}
+        selected_values = np.array([metric_values[m] if m in metric_values else self[m]
+                                    for m in SUMMARY_PLOT_METRICS])
+        return variable_name, self.reference[slice_indices].values, self.target[slice_indices].values, \
+            selected_values
 
     def __repr__(self):
         return f"DataArray Metrics (id:{id(self)}) Variable:{self.reference.name}"
@@ -190,11 +540,20 @@ class DataArrayMetrics:
 class DatasetMetrics:
     """
     A class for computing metrics and generating plots for given reference and target datasets.
+
+    The datasets can be backed by dask (the files are opened lazily) and the DataArrayMetrics of each variable are
+    only created when they are accessed. To compare large files, compute yields the metrics of each variable as
+    soon as they are ready, without keeping the data of the variables that are done.
     """
 
-    def __init__(self, reference: Union[str, xarray.Dataset], target: Union[str, xarray.Dataset]) -> None:
+    def __init__(self, reference: Union[str, xarray.Dataset], target: Union[str, xarray.Dataset],
+                 reference_statistics: Union[Dict[str, ReferenceStatistics], None] = None) -> None:
         """
         Initialize a new DatasetMetrics object.
+
+        The reference_statistics dictionary (variable -> ReferenceStatistics) can be shared by the DatasetMetrics of
+        several targets compared to the same reference dataset, see DataArrayMetrics. The variables without an entry
+        don't share their statistics. compute marks this target as done in the statistics of each variable.
         """
         # Check that files exist and save them
 
@@ -227,6 +586,7 @@ class DatasetMetrics:
         self.check_consistency()
 
         # Initialize metrics
+        self.reference_statistics = reference_statistics
         self.metrics = {}
         self.initialize_metrics()
 
@@ -240,24 +600,186 @@ class DatasetMetrics:
 
     def initialize_metrics(self) -> None:
         """
-        Initialize DataArrayMetrics objects for each variable in the datasets.
+        Reset the DataArrayMetrics objects, which are created for each variable when it is accessed.
         """
-        for variable in self.variables:
-            self.metrics[variable] = DataArrayMetrics(self.reference[variable], self.target[variable])
+        self.metrics = {}
 
     def __getitem__(self, name: str) -> DataArrayMetrics:
         assert name in self.variables, f"The provided variable name {name} does not exist in this dataset."
+        if name not in self.metrics:
+            self.metrics[name] = self.variable_metrics(name)
         return self.metrics[name]
 
-    def make_plots(self):
+    def variable_metrics(self, name: str) -> DataArrayMetrics:
+        """
+        Create a new DataArrayMetrics object for a variable, which is not kept.
+        """
+        reference_statistics = None
+        if self.reference_statistics is not None:
+            reference_statistics = self.reference_statistics.get(name)
+        return DataArrayMetrics(self.reference[name], self.target[name], reference_statistics=reference_statistics)
+
+    def compute(self, metric_names: List[str], workers: Union[int, None] = None, streaming: bool = False,
+                gradients: bool = False) -> Iterator[Tuple[str, Dict[str, xarray.DataArray]]]:
+        """
+        Compute some metrics for all the variables on a pool of workers, yielding the results of each variable as
+        soon as they are ready. At most one variable per worker is processed at a time and the intermediate
+        quantities of each variable are released when it is done, so the memory needed is bounded.
+
+        Parameters
+        ----------
+        metric_names : list of str
+        workers : int, optional
+            Number of threads. Defaults to the number of available cores.
+        streaming : bool, optional, default=False
+            If True, the metrics are computed with stream_metrics, which reads the variables chunk by chunk.
+            Then the memory needed only depends on the chunk size, but only the metrics in STREAMING_METRICS
+            are available and the other ones are left out.
+        gradients : bool, optional, default=False
+            Only with streaming. If True, the metrics of the first and second order gradients of the variables with
+            more than one dimension are computed too, streaming one slice of the leading dimension at a time. They
+            are yielded with the same names that create_gradients and create_second_order_gradients use.
+
+        Yields
+        ------
+        variable, metrics : str, dict
+            The name of the variable and a dictionary with the time-series of each metric.
+        """
+        assert streaming or not gradients, "The gradients can only be computed on the fly when streaming."
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if streaming:
+            metric_names = [name for name in metric_names if name in STREAMING_METRICS]
+
+        # Each task is the name of the results, the variable and the order of the gradient (0 for the variable itself)
+        tasks = [(variable, variable, 0) for variable in self.variables]
+        if gradients:
+            for variable in self.variables:
+                if self.reference[variable].ndim > 1:
+                    tasks.append((f"{variable}_gradient", variable, 1))
+                    tasks.append((f"{variable}_gradient_O2", variable, 2))
+        # The workers that are not needed to process different variables at the same time read chunks in parallel
+        chunk_workers = max(1, workers // max(1, min(workers, len(tasks))))
+
+        def compute_variable(task: Tuple[str, str, int]) -> Dict[str, xarray.DataArray]:
+            _, variable, gradient_order = task
+            reference, target = self.reference[variable], self.target[variable]
+            if streaming:
+                metrics = stream_metrics(reference, target, workers=chunk_workers, gradient_order=gradient_order)
+            else:
+                metrics = self.variable_metrics(variable)
+            values = {name: metrics[name].compute() for name in metric_names}
+            if not streaming and metrics.reference_statistics is not None:
+                metrics.reference_statistics.target_done()
+            return values
+
+        pending_tasks = iter(tasks)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            running = {}
+            for task in pending_tasks:
+                running[executor.submit(compute_variable, task)] = task[0]
+                if len(running) == workers:
+                    break
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield running.pop(future), future.result()
+                    next_task = next(pending_tasks, None)
+                    if next_task is not None:
+                        running[executor.submit(compute_variable, next_task)] = next_task[0]
+
+    def make_plots(self, workers: Union[int, None] = None, output_folder: str = "report",
+                   metric_values: Union[Dict[str, Dict[str, xarray.DataArray]], None] = None) -> None:
         """
         Generate plots for all variables in the datasets.
+
+        The figures are rendered on a pool of processes with the Agg backend. The data of each plot (the 2D slices
+        and the metrics of the radar chart, if they are not given in metric_values) is still read and computed
+        serially in this process, only the rendering runs in the workers. The slices are passed to the workers through
+        shared memory, and at most two variables per worker are in flight.
+
+        Parameters
+        ----------
+        workers : int, optional
+            Number of processes. Defaults to the number of available cores. With 1 the plots are rendered in this
+            process.
+        output_folder : str, optional, default="report"
+        metric_values : dict, optional
+            Already computed metrics of each variable (i.e. the results of compute), which are reused for the
+            radar charts.
         """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        metric_values = metric_values or {}
+        total = len(self.variables)
+
+        def plot_data(variable: str):
+            # A new DataArrayMetrics is used, so the intermediates are released after getting the data.
+            variable_metrics = DataArrayMetrics(self.reference[variable], self.target[variable])
+            return variable_metrics.summary_plot_data(metric_values.get(variable))
+
         print("Producing plots:")
-        for index, variable in enumerate(self.variables):
-            print(f"\r{index + 1}/{len(self.variables)} {variable:30} ", end="")
-            self[variable].plot_summary()
-        print("\rPlots done!" + 30 * " ")
+        if workers == 1:
+            for index, variable in enumerate(self.variables):
+                data = plot_data(variable)
+                if data is not None:
+                    render_summary_plot(*data, output_folder=output_folder)
+                _print_progress(index + 1, total, variable)
+            print("\rPlots done!" + 70 * " ")
+            return
+
+        done = 0
+
+        def collect(running: dict) -> None:
+            nonlocal done
+            for finished_variable in self._collect_plots(running):
+                done += 1
+                _print_progress(done, total, finished_variable)
+
+        running = {}
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_use_agg_backend) as executor:
+                for variable in self.variables:
+                    data = plot_data(variable)
+                    if data is None:
+                        done += 1
+                        _print_progress(done, total, variable)
+                        continue
+                    variable_name, reference_data, target_data, values = data
+                    blocks = []
+                    try:
+                        reference_info = _to_shared_memory(reference_data, blocks)
+                        target_info = _to_shared_memory(target_data, blocks)
+                        future = executor.submit(_render_shared_summary_plot, variable_name, reference_info,
+                                                 target_info, values, output_folder)
+                    except BaseException:
+                        _release_blocks(blocks)
+                        raise
+                    running[future] = (variable, blocks)
+                    while len(running) >= 2 * workers:
+                        collect(running)
+                while running:
+                    collect(running)
+        finally:
+            # If a plot failed, the blocks of the other ones are released too (the executor has waited for them)
+            for _, blocks in running.values():
+                _release_blocks(blocks)
+        print("\rPlots done!" + 70 * " ")
+
+    @staticmethod
+    def _collect_plots(running: dict) -> List[str]:
+        """
+        Wait for some of the running plots to finish and release their shared memory.
+        Returns the variables whose plots finished.
+        """
+        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+        variables = []
+        for future in finished:
+            variable, blocks = running.pop(future)
+            _release_blocks(blocks)
+            future.result()
+            variables.append(variable)
+        return variables
 
     def create_gradients(self):
         """
@@ -322,27 +844,146 @@ def make_radar_chart(name, attribute_labels, stats, axis):
     axis.grid(True)
 
 
+def render_summary_plot(variable_name: str, reference_data: np.ndarray, target_data: np.ndarray,
+                        metric_values: np.ndarray, output_folder: str = "report") -> None:
+    # pylint: disable=import-outside-toplevel
+    """
+    Render the summary plot of a variable (see DataArrayMetrics.summary_plot_data) and save it in the output folder.
+    """
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
+
+    var_range = np.max(reference_data) - np.min(reference_data)
+
+    # Prepare a plot of an intermediate level
+    plt.figure(figsize=(9, 9))
+
+    # Plot reference
+    plt.subplot(int("411"))
+    plt.imshow(reference_data)
+    plt.colorbar()
+    # Plot comparison target
+    plt.subplot(int("412"))
+    plt.imshow(target_data)
+    plt.colorbar()
+
+    # Plot differences
+    plt.subplot(int("413"))
+    color_levels = 7
+    cmap = plt.cm.seismic  # define the colormap
+    # extract all colors from the colormap
+    cmaplist = [cmap(i) for i in range(cmap.N)]
+    # Generate new colormap with only few levels
+    cmap = mpl.colors.LinearSegmentedColormap.from_list('Custom cmap', cmaplist, color_levels)
+    difference = target_data - reference_data
+    max_abs_diff = max(abs(np.min(difference)), np.max(difference))
+    factor = var_range / max_abs_diff
+    vmin = -max_abs_diff
+    vmax = max_abs_diff
+    plt.imshow(difference, vmin=vmin, vmax=vmax, cmap=cmap)
+    plt.title(f"The difference range is {factor:.1f} smaller than the InterQuartileRange")
+    cbar = plt.colorbar()
+    cbar.set_ticks(np.linspace(vmin, vmax, color_levels + 1))
+
+    # Put something related with the metrics
+    fig = plt.gcf()
+    axis = fig.add_subplot(414, polar=True)
+
+    make_radar_chart(variable_name, SUMMARY_PLOT_METRICS, metric_values, axis)
+    if not isdir(output_folder):
+        makedirs(output_folder, exist_ok=True)
+    plt.tight_layout()
+    plt.savefig(join(output_folder, f"report_{variable_name}.png"))
+    plt.close("all")
+
+
+def _use_agg_backend() -> None:
+    # pylint: disable=import-outside-toplevel
+    """
+    Initializer of the plotting processes, which don't have a display.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def _to_shared_memory(array: np.ndarray, blocks: List[shared_memory.SharedMemory]) -> Tuple[str, tuple, str]:
+    """
+    Copy an array to a new shared memory block, which is appended to blocks as soon as it exists so it can always be
+    released. Returns what is needed to access it from another process.
+    """
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    blocks.append(block)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block.name, array.shape, array.dtype.str
+
+
+def _release_blocks(blocks: List[shared_memory.SharedMemory]) -> None:
+    """
+    Close and unlink shared memory blocks created with _to_shared_memory.
+    """
+    for block in blocks:
+        block.close()
+        block.unlink()
+    blocks.clear()
+
+
+def _render_shared_summary_plot(variable_name: str, reference_block: Tuple[str, tuple, str],
+                                target_block: Tuple[str, tuple, str], metric_values: np.ndarray,
+                                output_folder: str) -> str:
+    """
+    Render a summary plot in a worker process, getting the 2D slices from shared memory blocks.
+    """
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in (reference_block, target_block)]
+    try:
+        reference_data, target_data = [np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+                                       for block, (_, shape, dtype) in zip(blocks, (reference_block, target_block))]
+        render_summary_plot(variable_name, reference_data, target_data, metric_values, output_folder=output_folder)
+        del reference_data, target_data
+    finally:
+        for block in blocks:
+            block.close()
+    return variable_name
+
+
+def _print_progress(done: int, total: int, label: str = "", width: int = 30) -> None:
+    """
+    Print a progress bar that overwrites the current line.
+    """
+    filled = width * done // max(total, 1)
+    print(f"\r[{'#' * filled}{'.' * (width - filled)}] {done}/{total} {label:30}", end="", flush=True)
+
+
+def dataset_with_gradients(dataset: xarray.Dataset) -> xarray.Dataset:
+    """
+    Return a copy of a dataset with the first and second order gradients of its variables, with the same names
+    as DatasetMetrics.create_gradients and DatasetMetrics.create_second_order_gradients.
+    """
+    dataset = dataset.copy()
+    for variable in list(dataset.data_vars):
+        gradient = array_gradient(dataset[variable])
+        if gradient is not None:
+            dataset[gradient.name] = gradient
+            second_order_gradient = array_gradient(gradient)
+            dataset[f"{variable}_gradient_O2"] = second_order_gradient
+    return dataset
+
+
 def array_gradient(data_array: xarray.DataArray) -> Union[None, xarray.DataArray]:
     """
-    Calculate the gradient of a DataArray. For multidimensional data, return the magnitude of the gradient.
+    Calculate the gradient of a DataArray over all the dimensions except the first one. For multidimensional data,
+    return the magnitude of the gradient. It is computed one slice of the first dimension at a time, in single
+    precision for single precision data.
     """
     dimensions = len(data_array.shape)
     if dimensions == 1:
         return None
 
-    gradient_axis = tuple(range(1, dimensions))
-
-    new_array = data_array.copy()
-    data_values = data_array.values
     try:
-        gradient_vect = np.gradient(data_values, axis=gradient_axis)
+        gradient_norm = leading_slice_gradient_magnitude(data_array.values)
     except Exception as err:
         print(err)
         return None
 
-    gradient_norm = np.linalg.norm(gradient_vect, axis=0)
-
-    new_array.values = gradient_norm
-
-    new_array.name = f"{new_array.name}_gradient"
+    new_array = data_array.copy(data=gradient_norm)
+    new_array.name = f"{data_array.name}_gradient"
     return new_array
@@ -0,0 +1,122 @@
+"""
+This module provides functions to estimate compressed sizes by compressing only a random sample of the chunks.
+
+The total compressed size is predicted with a ratio estimator: the compressed size of the sampled chunks is
+scaled by the uncompressed size of the whole population, and the spread of the chunks around that ratio gives
+the standard error of the prediction.
+"""
+
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from scipy.stats import norm
+
+from .slicing import MultiDimensionalSlice, MultiDimensionalSliceCollection
+
+
+@dataclass
+class SizeEstimate:
+    """
+    Estimated size in bytes together with its standard error.
+    A standard error of 0 means that the size is exact.
+    """
+    size: float
+    standard_error: float = 0.
+
+    def interval(self, confidence: float = 0.95) -> Tuple[float, float]:
+        """
+        Get the confidence interval of the estimate.
+
+        Args:
+            confidence: The confidence level.
+
+        Returns:
+            The lower and upper bounds of the interval.
+        """
+        margin = norm.ppf((1 + confidence) / 2) * self.standard_error
+        return max(self.size - margin, 0.), self.size + margin
+
+    def __add__(self, other: "SizeEstimate") -> "SizeEstimate":
+        # The estimates of different variables are independent, the variances add up.
+        return SizeEstimate(size=self.size + other.size,
+                            standard_error=float(np.hypot(self.standard_error, other.standard_error)))
+
+    def __radd__(self, other) -> "SizeEstimate":
+        # Allows using sum()
+        if other == 0:
+            return self
+        return self.__add__(other)
+
+
+def number_of_chunks(shape: Tuple[int, ...], chunk_sizes: Tuple[int, ...]) -> int:
+    """
+    Get the number of chunks of an array.
+
+    Args:
+        shape: The shape of the array.
+        chunk_sizes: The size of the chunks in each dimension.
+
+    Returns:
+        The number of chunks.
+    """
+    return int(np.prod([-(-size // chunk) for size, chunk in zip(shape, chunk_sizes)]))
+
+
+def sample_chunk_slices(shape: Tuple[int, ...], chunk_sizes: Tuple[int, ...], max_chunks: int = 16,
+                        seed: int = 0) -> Tuple[List[MultiDimensionalSlice], int]:
+    """
+    Select a stratified random sample of the chunks of an array.
+
+    The chunks, in C order, are split in max_chunks groups of consecutive chunks and one chunk is randomly selected
+    from each group. Since the leading dimension (usually time) varies slowest, that spreads the sample along it.
+
+    Args:
+        shape: The shape of the array.
+        chunk_sizes: The size of the chunks in each dimension.
+        max_chunks: The maximum number of chunks in the sample. If the array has fewer chunks, all of them are used.
+        seed: The seed of the random generator, so the same chunks are selected every time.
+
+    Returns:
+        The slices of the selected chunks and the total number of chunks.
+    """
+    chunk_slices = MultiDimensionalSliceCollection(shape=shape, chunk_sizes=tuple(chunk_sizes)).objects.ravel()
+    if len(chunk_slices) <= max_chunks:
+        return list(chunk_slices), len(chunk_slices)
+    random_generator = np.random.default_rng(seed)
+    groups = np.array_split(np.arange(len(chunk_slices)), max_chunks)
+    selected = [random_generator.choice(group) for group in groups]
+    return [chunk_slices[index] for index in selected], len(chunk_slices)
+
+
+def ratio_estimate(compressed_sizes: Sequence[float], uncompressed_sizes: Sequence[float],
+                   total_uncompressed_size: float, population_size: int) -> SizeEstimate:
+    """
+    Estimate the total compressed size from the compressed sizes of a random sample of chunks.
+    The standard error is the one of a simple random sample, which is conservative for a stratified sample.
+
+    Args:
+        compressed_sizes: The compressed sizes of the sampled chunks.
+        uncompressed_sizes: The uncompressed sizes of the sampled chunks.
+        total_uncompressed_size: The uncompressed size of all the chunks.
+        population_size: The total number of chunks.
+
+    Returns:
+        The estimated total compressed size.
+    """
+    compressed_sizes = np.asarray(compressed_sizes, dtype=np.float64)
+    uncompressed_sizes = np.asarray(uncompressed_sizes, dtype=np.float64)
+    sample_size = compressed_sizes.size
+
+    ratio = compressed_sizes.sum() / uncompressed_sizes.sum()
+    size = ratio * total_uncompressed_size
+    if sample_size >= population_size:
+        return SizeEstimate(size=float(size))
+    if sample_size < 2:
+        return SizeEstimate(size=float(size), standard_error=np.inf)
+
+    residuals = compressed_sizes - ratio * uncompressed_sizes
+    residual_variance = np.sum(residuals ** 2) / (sample_size - 1)
+    finite_population_correction = 1 - sample_size / population_size
+    standard_error = population_size * np.sqrt(finite_population_correction * residual_variance / sample_size)
+    return SizeEstimate(size=float(size), standard_error=float(standard_error))
@@ -5,6 +5,8 @@ using the approach described in Klöwer et al. 2021
 
 """
 
+import sys
+
 import numpy as np
 import xarray
 from scipy.stats import binom
@@ -268,6 +270,9 @@ def array_mutual_information(array: np.array) -> list:
     Calculates the mutual information for each bit position in the given array.
     Returns a list of the mutual information values for each bit position.
 
+    The counts of the bit patterns of all the bit positions are obtained at once (see bit_pair_counts),
+    which gives the same values as applying calculate_bit_mutual_information to each bit position.
+
     Args:
         array (np.array): The input array.
 
@@ -275,20 +280,27 @@ def array_mutual_information(array: np.array) -> list:
         list: The mutual information values for each bit position.
 
     """
+    # Count the bit patterns of each bit position, shape (bits, 2, 2)
+    counts = bit_pair_counts(array)
 
-    # Calculate the number of bits in each element of the array
-    bit_length = array.itemsize * 8
+    # Calculate the probabilities of each bit pattern and of having a bit value of 0 and 1
+    probabilities = counts / array.size
+    bit_1_probabilities = probabilities[:, 1, :].sum(axis=1)
+    bit_0_probabilities = 1.0 - bit_1_probabilities
+    bit_probabilities = np.stack([bit_0_probabilities, bit_1_probabilities], axis=1)
 
-    # Initialize an array to store the mutual information for each bit position
-    mutual_information = np.zeros(shape=bit_length, dtype=np.float32)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Calculate the conditional probabilities based on the bit value probabilities
+        conditional_probabilities = np.where(bit_probabilities[:, :, np.newaxis] > 0.0,
+                                             probabilities / bit_probabilities[:, :, np.newaxis], 0.0)
 
-    # Iterate over each bit position
-    for position in range(bit_length):
-        # Extract the bit at the current position from the array
-        bits = extract_bit_at_position(array, position=position)
+        # Calculate the entropies conditioned to each bit value and the overall entropy
+        conditional_entropies = -np.sum(_entropy_terms(conditional_probabilities, np.log2), axis=2)
+        overall_entropy = -np.sum(_entropy_terms(bit_probabilities, np.log), axis=1) / np.log(2)
 
-        # Calculate the mutual information for the extracted bits
-        mutual_information[position] = calculate_bit_mutual_information(bits)
+    # Calculate the mutual information, if it is negative set it to 0
+    mutual_information = overall_entropy - np.sum(bit_probabilities * conditional_entropies, axis=1)
+    mutual_information = np.maximum(mutual_information, 0.).astype(np.float32)
 
     # Filter out insignificant mutual information values based on the size of the original array
     filtered_mutual_information = filter_insignificant_values(mutual_information, array.size)
@@ -296,6 +308,79 @@ def array_mutual_information(array: np.array) -> list:
     return filtered_mutual_information
 
 
+def _entropy_terms(probabilities: np.array, logarithm) -> np.array:
+    """
+    Returns p * log(p) for each probability, 0 for the probabilities that are 0.
+    """
+    return np.where(probabilities > 0.0, probabilities * logarithm(np.where(probabilities > 0.0, probabilities, 1.0)),
+                    0.0)
+
+
+def bit_pair_counts(array: np.array) -> np.array:
+    """
+    Calculates the conditional count of bit patterns of all the bit positions at once,
+    the equivalent of bit_conditional_count(extract_bit_at_position(array, position)) for each position.
+
+    The count of ones of each bit position is computed from the histogram of each byte of the values,
+    for the values themselves and for the bitwise AND of each value with the previous one (circularly).
+    The other patterns follow from these counts.
+
+    Args:
+        array (np.array): The input array (1D).
+
+    Returns:
+        np.array: The count matrices of bit patterns, with shape (bits, 2, 2).
+
+    """
+    assert array.ndim == 1
+
+    # Get a view of the array as the corresponding uint type.
+    words = array.view(dtype=get_uint_type_by_bit_length(array.itemsize * 8))
+
+    # Count the ones in each bit position, for the values and for the pairs of consecutive values.
+    ones = bit_position_counts(words)
+    one_one = bit_position_counts(np.bitwise_and(words, np.roll(words, 1)))
+    # The rolled array has the same number of ones
+    one_zero = ones - one_one
+    zero_one = ones - one_one
+    zero_zero = words.size - one_one - one_zero - zero_one
+
+    return np.stack([np.stack([zero_zero, zero_one], axis=1), np.stack([one_zero, one_one], axis=1)],
+                    axis=1).astype(np.float64)
+
+
+def bit_position_counts(words: np.array) -> np.array:
+    """
+    Counts the number of ones in each bit position of an array of unsigned integers.
+    The position 0 is the most significant bit, as in single_bit_mask.
+
+    Args:
+        words (np.array): The input array (1D) of unsigned integers.
+
+    Returns:
+        np.array: The number of ones in each bit position.
+
+    """
+    # The values are split in 16 bit blocks (8 bit for single byte values), the histogram of each block gives
+    # the histograms of its two bytes, and the counts of each bit come from the histograms of the bytes.
+    block_type = np.uint16 if words.itemsize > 1 else np.uint8
+    blocks = np.ascontiguousarray(words).view(block_type).reshape(words.size, -1)
+    # Get the blocks of each value with the most significant one first
+    if sys.byteorder == "little":
+        blocks = blocks[:, ::-1]
+
+    # Bits of each possible byte value, the most significant one first.
+    byte_bits = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1).astype(np.int64)
+
+    counts = []
+    for index in range(blocks.shape[1]):
+        # Histogram with the most significant byte of the block in the first axis
+        histogram = np.bincount(blocks[:, index], minlength=2 ** (8 * blocks.itemsize)).reshape(-1, 256)
+        byte_histograms = [histogram.sum(axis=1), histogram.sum(axis=0)] if histogram.shape[0] > 1 else histogram
+        counts.extend(byte_histogram @ byte_bits for byte_histogram in byte_histograms)
+    return np.concatenate(counts)
+
+
 def filter_insignificant_values(mutual_information_list: list, number_of_elements: int) -> list:
     """
     Filters out insignificant mutual information values from the given list.
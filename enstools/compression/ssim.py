@@ -0,0 +1,212 @@
+"""
+Fast implementation of the structural similarity index (SSIM).
+
+The SSIM is a default constraint of the analysis and is evaluated at every step of the bisection, so it is worth
+having a faster implementation than the one of scikit-image used by enstools.scores. It computes the same quantity
+(uniform 7x7 windows, sample covariance, mean over the windows that fit inside the field) with these differences:
+
+- The local sums are computed with cumulative sums along each axis (a separable box filter) over the windows that
+  fit inside the field only, instead of filtering the whole field and cropping the borders afterwards.
+- The field is processed in tiles, which keeps the temporaries in cache, and the tiles are computed in a thread pool.
+- Single precision data is processed in single precision, as scikit-image does. The values of each tile are shifted
+  by their mean before accumulating the moments, which makes the variances more accurate than with the direct
+  formula for fields with a large offset.
+
+Tolerance with respect to the ssim_I of enstools.scores: for double precision data the SSIM matches to 1e-9, so the
+ssim_I matches to 1e-3 up to ssim_I ~ 8. For single precision data the ssim_I stays within 1e-2 of the one computed in
+double precision up to ssim_I ~ 5. The single precision result of scikit-image is less accurate: its variances suffer
+from cancellation, which already gives differences of ~0.2 at ssim_I ~ 2.5 for fields with an offset, and NaN above
+ssim_I ~ 5.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Union
+
+import numpy as np
+import xarray
+
+from enstools.core.errors import EnstoolsError
+
+# Parameters of the SSIM, the same defaults as in skimage.metrics.structural_similarity
+WINDOW_SIZE = 7
+K1 = 0.01
+K2 = 0.03
+
+# Number of rows and columns of the SSIM map that are computed at once.
+TILE_SIZE = 128
+
+
+def structural_similarity(reference: np.ndarray, target: np.ndarray, data_range: float,
+                          window_size: int = WINDOW_SIZE, tile_size: int = TILE_SIZE,
+                          workers: Union[int, None] = None, valid: Union[np.ndarray, None] = None) -> float:
+    """
+    Compute the mean structural similarity index between two 2D fields.
+
+    Parameters
+    ----------
+    reference : numpy.ndarray
+    target : numpy.ndarray
+    data_range : float
+        Range of the values, used to define the stabilization constants.
+    window_size : int, optional, default=7
+        Side of the square windows, it needs to be odd.
+    tile_size : int, optional
+        Number of rows and columns of the SSIM map computed at once.
+    workers : int, optional
+        Number of threads. Defaults to the number of available cores.
+    valid : numpy.ndarray, optional
+        Boolean mask of the valid points. The windows that contain invalid points are left out.
+
+    Returns
+    -------
+    float
+        The mean of the SSIM over all the windows that fit inside the field.
+    """
+    if reference.ndim != 2 or reference.shape != target.shape:
+        raise EnstoolsError("The structural similarity needs two 2D fields with the same shape.")
+    if window_size % 2 != 1:
+        raise EnstoolsError("The window size needs to be odd.")
+    if min(reference.shape) < window_size:
+        raise EnstoolsError(f"The structural similarity needs fields of at least {window_size}x{window_size}.")
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # Same precision rules as scikit-image: float32 stays in single precision, anything else goes to double.
+    dtype = np.float32 if reference.dtype == np.float32 and target.dtype == np.float32 else np.float64
+    reference = np.asarray(reference, dtype=dtype)
+    target = np.asarray(target, dtype=dtype)
+    constants = dtype((K1 * data_range) ** 2), dtype((K2 * data_range) ** 2)
+
+    output_shape = tuple(size - window_size + 1 for size in reference.shape)
+    tiles = [(row, column) for row in range(0, output_shape[0], tile_size)
+             for column in range(0, output_shape[1], tile_size)]
+
+    def tile_sum(corner: Tuple[int, int]) -> Tuple[float, int]:
+        row, column = corner
+        rows = slice(row, min(row + tile_size, output_shape[0]) + window_size - 1)
+        columns = slice(column, min(column + tile_size, output_shape[1]) + window_size - 1)
+        reference_tile, target_tile = reference[rows, columns], target[rows, columns]
+        if valid is None:
+            ssim_map = _ssim_map(reference_tile, target_tile, window_size, *constants)
+            return ssim_map.sum(dtype=np.float64), ssim_map.size
+
+        # The invalid points are replaced by a typical value in temporary copies of the tile, the windows that
+        # contain any of them are discarded afterwards.
+        valid_tile = valid[rows, columns]
+        if not valid_tile.any():
+            return 0., 0
+        typical_value = reference_tile[valid_tile].mean(dtype=np.float64)
+        reference_tile = np.where(valid_tile, reference_tile, dtype(typical_value))
+        target_tile = np.where(valid_tile, target_tile, dtype(typical_value))
+        valid_windows = _window_sums(valid_tile.astype(dtype), window_size) == window_size ** 2
+        ssim_map = _ssim_map(reference_tile, target_tile, window_size, *constants)
+        return ssim_map.sum(dtype=np.float64, where=valid_windows), int(valid_windows.sum())
+
+    if workers == 1 or len(tiles) == 1:
+        results = list(map(tile_sum, tiles))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(tile_sum, tiles))
+    windows = sum(count for _, count in results)
+    if not windows:
+        return np.nan
+    return float(sum(total for total, _ in results) / windows)
+
+
+def _ssim_map(reference: np.ndarray, target: np.ndarray, window_size: int, c1: float, c2: float) -> np.ndarray:
+    """
+    SSIM of each window that fits inside a tile.
+    """
+    dtype = reference.dtype
+    # The moments are invariant to a common shift, which avoids cancellation in the variances.
+    shift = dtype.type(reference.mean(dtype=np.float64))
+    reference = reference - shift
+    target = target - shift
+
+    # Only the sum of the variances is needed, so the squares are added before filtering them.
+    size = window_size ** 2
+    mean_reference = _window_sums(reference, window_size) / size
+    mean_target = _window_sums(target, window_size) / size
+    variances = _window_sums(reference * reference + target * target, window_size) / size
+    covariance = _window_sums(reference * target, window_size) / size
+
+    # Sample covariance, as scikit-image does by default
+    covariance_norm = dtype.type(size / (size - 1))
+    covariance -= mean_reference * mean_target
+    covariance *= 2 * covariance_norm
+    covariance += c2
+    variances -= mean_reference * mean_reference
+    variances -= mean_target * mean_target
+    variances *= covariance_norm
+    variances += c2
+
+    mean_reference += shift
+    mean_target += shift
+    luminance = 2 * mean_reference * mean_target
+    luminance += c1
+    luminance_norm = mean_reference * mean_reference
+    luminance_norm += mean_target * mean_target
+    luminance_norm += c1
+
+    luminance *= covariance
+    luminance_norm *= variances
+    luminance /= luminance_norm
+    return luminance
+
+
+def _window_sums(values: np.ndarray, window_size: int) -> np.ndarray:
+    """
+    Sum of the values in each window that fits inside a 2D array, using cumulative sums along each axis.
+    """
+    for axis in (0, 1):
+        shape = list(values.shape)
+        shape[axis] += 1
+        cumulative = np.zeros(shape, dtype=values.dtype)
+        np.cumsum(values, axis=axis, out=cumulative[(slice(None),) * axis + (slice(1, None),)])
+        upper = (slice(None),) * axis + (slice(window_size, None),)
+        lower = (slice(None),) * axis + (slice(None, -window_size),)
+        values = cumulative[upper] - cumulative[lower]
+    return values
+
+
+def structural_similarity_index(reference: xarray.DataArray, target: xarray.DataArray,
+                                valid: Union[xarray.DataArray, None] = None) -> xarray.DataArray:
+    """
+    Drop-in replacement of enstools.scores.structural_similarity_index.
+
+    As the original, it computes the SSIM over the two largest dimensions other than time, on the first element of
+    the remaining dimensions (including time), and it returns that value for every time step. The data range is
+    also defined in the same way. As the original, it loads the data of the inputs.
+
+    The points where valid (a boolean DataArray with the same dimensions) is False are left out.
+    """
+    reference.load()
+    target.load()
+
+    non_time_dimensions = sorted([dim for dim in reference.dims if dim != "time"],
+                                 key=lambda dim: reference[dim].size, reverse=True)
+    if len(non_time_dimensions) < 2:
+        raise EnstoolsError("Data must have at least two dimensions other than 'time'.")
+    largest_dimensions = non_time_dimensions[:2]
+
+    selection = {dim: 0 for dim in reference.dims if dim not in largest_dimensions}
+    reference_slice = reference.isel(selection).transpose(*largest_dimensions).values
+    target_slice = target.isel(selection).transpose(*largest_dimensions).values
+    valid_slice = valid.isel(selection).transpose(*largest_dimensions).values if valid is not None else None
+
+    reference_values, target_values = reference_slice, target_slice
+    if valid_slice is not None:
+        reference_values, target_values = reference_slice[valid_slice], target_slice[valid_slice]
+
+    if reference_values.size:
+        # Same definition of the range as in enstools.scores
+        data_range = min(np.max(reference_values), np.max(target_values)) - \
+            min(np.min(reference_values), np.min(target_values))
+        ssim_value = structural_similarity(reference_slice, target_slice, data_range=data_range, valid=valid_slice)
+    else:
+        ssim_value = np.nan
+
+    if "time" in reference.dims:
+        return xarray.DataArray(np.full(reference["time"].size, ssim_value), coords={"time": reference["time"]},
+                                dims=["time"])
+    return xarray.DataArray(ssim_value)
@@ -0,0 +1,141 @@
+"""
+Metrics between a reference and a target computed in a single reading pass.
+
+DataArrayMetrics computes each metric with its own operations over the full arrays, which needs them in memory
+together with their temporaries. Here the variables are read once, chunk by chunk, and each pair of chunks updates
+a mergeable ErrorAccumulator (see enstools.compression.accumulators). The accumulators of the chunks are merged into
+one accumulator per time step, so the memory needed only depends on the chunk size and the number of workers.
+
+The results follow the definitions of enstools.scores: the metrics are time-series computed over all the dimensions
+except time, and the range used to normalize the root mean square error is the inter quartile range of the whole
+reference. The quantiles and the Kolmogorov-Smirnov test are computed from histograms, so they are an approximation.
+
+The metrics of the magnitude of the gradients (the variables that DatasetMetrics.create_gradients adds) can be
+streamed as well. The gradients need complete slices of the leading dimension, so those are read one at a time.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple, Union
+
+import numpy as np
+import xarray
+
+from .accumulators import ErrorAccumulator, MergeableHistogram
+from .chunking import write_chunk_sizes
+from .gradients import leading_slice_gradient_magnitude
+from .slicing import MultiDimensionalSliceCollection
+
+# Metrics provided by stream_metrics.
+STREAMING_METRICS = [
+    "mean_square_error",
+    "root_mean_square_error",
+    "normalized_root_mean_square_error",
+    "nrmse_I",
+    "max_abs_error",
+    "max_error",
+    "min_error",
+    "pearson_correlation",
+    "correlation_I",
+    "peak_signal_to_noise_ratio",
+    "ks_statistic",
+    "kolmogorov_smirnov",
+    "ks_I",
+]
+
+
+def stream_metrics(reference: xarray.DataArray, target: xarray.DataArray, chunk_size: Union[str, None] = None,
+                   workers: Union[int, None] = None, bins: int = 1000, gradient_order: int = 0) -> xarray.Dataset:
+    """
+    Compute the metrics between a reference and a target reading each chunk of them only once.
+
+    Parameters
+    ----------
+    reference : xarray.DataArray
+        The reference variable. It can be backed by a file, only one chunk per worker is read at a time.
+    target : xarray.DataArray
+        The target variable, with the same dimensions as the reference.
+    chunk_size : str, optional
+        Size of the chunks that are read (i.e. "10MB"), each time step is split in chunks following the layout of
+        the writer. Defaults to the enstools.encoding.chunk_size.chunk_size module variable.
+    workers : int, optional
+        Number of threads. Defaults to the number of available cores.
+    bins : int, optional, default=1000
+        Number of bins of the histograms used for the quantiles and the Kolmogorov-Smirnov test.
+    gradient_order : int, optional, default=0
+        With 1, the metrics are computed on the magnitude of the gradient over all the dimensions except the first
+        one, as with enstools.compression.metrics.array_gradient. With 2, on the magnitude of the gradient of that.
+        The variable is read one slice of the first dimension at a time, which needs to be time if there is time.
+
+    Returns
+    -------
+    xarray.Dataset
+        A dataset with the time-series of each metric of STREAMING_METRICS.
+    """
+    target = target.transpose(*reference.dims)
+    assert reference.shape == target.shape, "The reference and the target need to have the same shape."
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    time_axis = reference.dims.index("time") if "time" in reference.dims else None
+    if gradient_order:
+        assert reference.ndim > 1, "The gradients need at least two dimensions."
+        assert time_axis in (0, None), "The gradients need time to be the first dimension."
+        chunk_slices = [(slice(index, index + 1),) for index in range(reference.shape[0])]
+    else:
+        chunk_slices = _time_step_chunk_slices(reference, chunk_size=chunk_size)
+
+    def accumulate_chunk(slices: Tuple[slice, ...]) -> Tuple[int, ErrorAccumulator]:
+        reference_chunk = reference[slices].values
+        target_chunk = target[slices].values
+        if gradient_order:
+            reference_chunk = leading_slice_gradient_magnitude(reference_chunk, order=gradient_order)
+            target_chunk = leading_slice_gradient_magnitude(target_chunk, order=gradient_order)
+        # As in DataArrayMetrics, the points where the reference or the target are NaN are left out.
+        valid = ~(np.isnan(reference_chunk) | np.isnan(target_chunk))
+        if not valid.all():
+            reference_chunk, target_chunk = reference_chunk[valid], target_chunk[valid]
+        time_index = slices[time_axis].start if time_axis is not None else 0
+        return time_index, ErrorAccumulator(bins=bins).update(reference_chunk, target_chunk)
+
+    accumulators: Dict[int, ErrorAccumulator] = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for time_index, accumulator in executor.map(accumulate_chunk, chunk_slices):
+            accumulators.setdefault(time_index, ErrorAccumulator(bins=bins)).merge(accumulator)
+
+    # The normalization of the root mean square error uses the inter quartile range of the whole reference
+    reference_histogram = MergeableHistogram(bins=bins)
+    for accumulator in accumulators.values():
+        reference_histogram.merge(accumulator.reference_histogram)
+    inter_quartile_range = reference_histogram.quantile(0.75) - reference_histogram.quantile(0.25)
+
+    time_steps = [_time_step_metrics(accumulators[index], inter_quartile_range) for index in sorted(accumulators)]
+    if time_axis is None:
+        return xarray.Dataset({metric: ((), value) for metric, value in time_steps[0].items()})
+    return xarray.Dataset({metric: (("time",), [values[metric] for values in time_steps])
+                           for metric in STREAMING_METRICS},
+                          coords={"time": reference["time"]})
+
+
+def _time_step_chunk_slices(data_array: xarray.DataArray, chunk_size: Union[str, None] = None) -> list:
+    """
+    Split a variable in chunks that don't span more than one time step.
+    """
+    if not data_array.shape:
+        return [()]
+    chunk_sizes = list(write_chunk_sizes(data_array, chunk_size=chunk_size))
+    if "time" in data_array.dims:
+        chunk_sizes[data_array.dims.index("time")] = 1
+    collection = MultiDimensionalSliceCollection(shape=data_array.shape, chunk_sizes=tuple(chunk_sizes))
+    return [chunk_slice.slices for chunk_slice in collection.objects.ravel()]
+
+
+def _time_step_metrics(accumulator: ErrorAccumulator, inter_quartile_range: float) -> dict:
+    """
+    Get the metrics of a time step from its accumulator.
+    """
+    metrics = accumulator.results()
+    rmse = metrics["root_mean_square_error"]
+    nrmse = rmse / inter_quartile_range if inter_quartile_range != 0. else rmse
+    metrics["normalized_root_mean_square_error"] = nrmse
+    metrics["nrmse_I"] = float(-np.log10(nrmse)) if nrmse > 0 else np.inf
+    return metrics
@@ -11,14 +11,14 @@ from os import PathLike
 from typing import Union
 
 from dask import delayed
+from dask.delayed import Delayed
 import xarray
 
 from enstools.encoding.api import VariableEncoding, DatasetEncoding
 from enstools.compression.emulation import emulate_compression_on_data_array, emulate_compression_on_dataset
 from enstools.compression.analyzer.analysis_options import AnalysisOptions
 from enstools.compression.analyzer.analyzer import analyze_data_array, analyze_dataset
-from enstools.encoding.dataset_encoding import convert_to_bytes, find_chunk_sizes
-from enstools.encoding.chunk_size import chunk_size as default_chunk_size
+from enstools.compression.chunking import write_chunk_sizes
 
 
 @xarray.register_dataarray_accessor("compression")
@@ -37,7 +37,8 @@ class EnstoolsCompressionDataArrayAccessor:
         """
         self._obj = xarray_obj
 
-    def emulate(self, compression: str, in_place=False, chunk_size=None) -> xarray.DataArray:
+    def emulate(self, compression: str, in_place=False, chunk_size=None, parallel=False,
+                workers: int = None, lazy=False) -> xarray.DataArray:
         """
         Emulate compression on a data array.
 
@@ -47,6 +48,10 @@ class EnstoolsCompressionDataArrayAccessor:
         in_place: bool
         chunk_size: str If not used, the default chunk size will be used (10MB). It can also be modified by changing
         the enstools.encoding.chunk_sizes.chunk_size module variable.
+        parallel: bool If True, the chunks are compressed and decompressed concurrently.
+        workers: int Number of threads used in parallel mode. Defaults to the number of available cores.
+        lazy: bool If True and the data array is backed by dask, the emulation is only done when computing the result.
+        In that case the compression_ratio attribute is not set.
 
         Returns
         -------
@@ -54,27 +59,22 @@ class EnstoolsCompressionDataArrayAccessor:
         """
         compression_specification = VariableEncoding(compression)
 
-        # Chunking!
+        # Chunking! Same chunks as the ones used to write the files.
         #############################
-        data_array = self._obj
-        type_size = data_array.dtype.itemsize
-
-        if chunk_size is None:
-            chunk_size = default_chunk_size
-
-        chunk_memory_size = convert_to_bytes(chunk_size)
-        optimal_chunk_size = chunk_memory_size / type_size
-        chunk_sizes = find_chunk_sizes(data_array=data_array, chunk_size=optimal_chunk_size)
-        chunk_sizes = tuple(chunk_sizes[d] for d in data_array.dims)
-        compression_specification.set_chunk_sizes(chunk_sizes)
+        compression_specification.set_chunk_sizes(write_chunk_sizes(self._obj, chunk_size=chunk_size))
 
         data_array, metrics = emulate_compression_on_data_array(data_array=self._obj,
                                                                 compression_specification=compression_specification,
-                                                                in_place=in_place)
+                                                                in_place=in_place,
+                                                                parallel=parallel,
+                                                                workers=workers,
+                                                                lazy=lazy,
+                                                                )
         #############################
 
         data_array.attrs["compression_specification"] = compression
-        data_array.attrs["compression_ratio"] = f"{metrics['compression_ratio']:.2f}"
+        if not isinstance(metrics["compression_ratio"], Delayed):
+            data_array.attrs["compression_ratio"] = f"{metrics['compression_ratio']:.2f}"
         return data_array
 
     def __call__(self, compression: str, in_place=False, chunk_size=None) -> xarray.DataArray:
@@ -149,7 +149,7 @@ class EnstoolsCompressionDatasetAccessor:
         """
         self._obj = xarray_obj
 
-    def emulate(self, compression: str, in_place=False) -> xarray.Dataset:
+    def emulate(self, compression: str, in_place=False, lazy=False, workers=1, processes=False) -> xarray.Dataset:
         """
         Emulate compression on a dataset.
 
@@ -157,17 +157,22 @@ class EnstoolsCompressionDatasetAccessor:
         ----------
         compression: str
         in_place: bool
+        lazy: bool If True, dask-backed variables are only emulated when computing the result.
+        workers: int Number of variables emulated concurrently. If None, the number of available cores is used.
+        processes: bool If True, the variables are emulated in a pool of processes instead of threads.
 
         Returns
         -------
         xarray.Dataset
         """
         # compression_specification = FilterEncodingForH5py.from_string(compression)
-        dataset, metrics = emulate_compression_on_dataset(compression=compression, dataset=self._obj, in_place=in_place)
+        dataset, metrics = emulate_compression_on_dataset(compression=compression, dataset=self._obj, in_place=in_place,
+                                                          lazy=lazy, workers=workers, processes=processes)
         # Set attributes for each variable
         for var, _metrics in metrics.items():
             dataset[var].attrs["compression_specification"] = compression
-            dataset[var].attrs["compression_ratio"] = f"{_metrics['compression_ratio']:.2f}"
+            if not isinstance(_metrics["compression_ratio"], Delayed):
+                dataset[var].attrs["compression_ratio"] = f"{_metrics['compression_ratio']:.2f}"
         return dataset
 
     def analyze(self,
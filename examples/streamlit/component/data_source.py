@@ -5,6 +5,8 @@ import pandas as pd
 import streamlit as st
 import xarray as xr
 
+from enstools.compression.emulation_cache import enable_emulation_cache
+
 
 class DataContainer:
     def __init__(self, dataset: Optional[xr.Dataset] = None):
@@ -43,6 +45,8 @@ class DataContainer:
 
 @st.cache_resource
 def create_data():
+    # Each rerun emulates the same data with the same specification, so we reuse the results.
+    enable_emulation_cache(max_memory="1GB")
     return DataContainer.from_tutorial_data()
 
 
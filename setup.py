@@ -47,6 +47,7 @@ setup(name="enstools-compression",
       ],
       extras_require={
           'examples': ['pooch'],
+          'parquet': ['pyarrow'],
           'test': [
               "pytest",
               "pytest-mock",
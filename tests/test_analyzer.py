@@ -90,6 +90,30 @@ class TestAnalyzer(TestClass):
                         f"Case:{input_path.name}.The resulting compression ratio of {metrics[var][cr_label]:.2f}"
                         f"x is not close enough to the target of {thresholds[cr_label]:.2f}")
 
+    def test_throughput_constrains(self):
+        """
+        Check that the throughput can be used as a constrain and as an objective.
+        """
+        from enstools.compression.api import analyze_files
+        from enstools.compression.errors import ConditionsNotFulfilledError
+        input_path = self.input_directory_path / "dataset_3D.nc"
+        encodings, metrics = analyze_files(file_paths=[input_path],
+                                           constrains="correlation_I:3,decompression_speed:1",
+                                           compressor="zfp",
+                                           objective="decompression_speed:1",
+                                           )
+        for var in ["temperature", "precipitation"]:
+            assert metrics[var]["decompression_speed"] >= 1
+            assert metrics[var]["compression_speed"] > 0
+
+        # An impossible throughput
+        with pytest.raises(ConditionsNotFulfilledError):
+            analyze_files(file_paths=[input_path],
+                          constrains="correlation_I:3,decompression_speed:1e12",
+                          compressor="zfp",
+                          mode="rate",
+                          )
+
     def test_sz_analyzer(self):
         from enstools.compression.api import analyze_files
         input_tempdir = self.input_directory_path
@@ -165,9 +165,12 @@ class TestCommandLineInterface(TestClass):
         import enstools.compression.cli
         file_name = "dataset_%iD.nc" % 3
         file_path = self.input_directory_path / file_name
-        commands = ["_", "evaluate", "-r", str(file_path), "-t", str(file_path), "--plot"]
+        plot_folder = self.output_directory_path / "report"
+        commands = ["_", "evaluate", "-r", str(file_path), "-t", str(file_path), "--plot",
+                    "--plot-folder", str(plot_folder)]
         mocker.patch("sys.argv", commands)
         enstools.compression.cli.main()
+        assert (plot_folder / "report_temperature.png").exists()
 
     def test_evaluator_with_warnings(self, mocker):
         """
@@ -184,6 +187,90 @@ class TestCommandLineInterface(TestClass):
         mocker.patch("sys.argv", commands)
         enstools.compression.cli.main()
 
+    def test_evaluator_exit_code(self, mocker):
+        """
+        Test that enstools-compressor evaluate exits with 1 when some metric is below its threshold
+        """
+        import enstools.compression.cli
+        from enstools.compression.compressor import compress
+        file_name = "dataset_%iD.nc" % 3
+        file_path = self.input_directory_path / file_name
+        compressed_path = self.output_directory_path / file_name
+        compress(file_path, output=compressed_path, compression="lossy,zfp,accuracy,1")
+        commands = ["_", "evaluate", "-r", str(file_path), "-t", str(compressed_path)]
+        mocker.patch("sys.argv", commands)
+        with pytest.raises(SystemExit) as exit_info:
+            enstools.compression.cli.main()
+        assert exit_info.value.code == 1
+
+    def test_evaluator_batch(self, mocker):
+        """
+        Test enstools-compressor evaluate with several pairs of files and a table as output
+        """
+        import pandas
+        import enstools.compression.cli
+        from enstools.compression.compressor import compress
+        references, targets = [], []
+        for dimension in [2, 3]:
+            file_name = "dataset_%iD.nc" % dimension
+            references.append(str(self.input_directory_path / file_name))
+            targets.append(str(self.output_directory_path / file_name))
+            compress(references[-1], output=targets[-1], compression="lossless")
+        output_path = self.output_directory_path / "metrics.csv"
+        commands = ["_", "evaluate", "-r", *references, "-t", *targets, "--streaming", "-o", str(output_path)]
+        mocker.patch("sys.argv", commands)
+        enstools.compression.cli.main()
+
+        table = pandas.read_csv(output_path)
+        assert set(table["target"]) == set(targets)
+        assert table["passed"].all()
+        assert {"variable", "metric", "time", "value", "threshold"} <= set(table.columns)
+
+    def test_evaluator_sweep(self, mocker):
+        """
+        Test enstools-compressor evaluate with one reference and several targets
+        """
+        import numpy as np
+        import pandas
+        import enstools.compression.cli
+        from enstools.compression.compressor import compress
+        from enstools.compression.evaluator import evaluate
+        file_path = self.input_directory_path / "dataset_3D.nc"
+        targets = []
+        for rate in [2.0, 4.0, 8.0]:
+            targets.append(str(self.output_directory_path / f"dataset_3D_rate_{rate}.nc"))
+            compress(file_path, output=targets[-1], compression=f"lossy,zfp,rate,{rate}")
+        output_path = self.output_directory_path / "sweep.csv"
+        commands = ["_", "evaluate", "-r", str(file_path), "-t", *targets, "-g", "-o", str(output_path)]
+        mocker.patch("sys.argv", commands)
+        enstools.compression.cli.main()
+
+        table = pandas.read_csv(output_path)
+        assert list(table["target"].unique()) == targets
+        assert "temperature_gradient_O2" in set(table["variable"])
+        # The same values as evaluating each pair on its own
+        single = evaluate(file_path, targets[-1], create_gradients=True, verbose=False)
+        single["time"] = single["time"].astype(str)
+        table["time"] = table["time"].astype(str)
+        swept = table[table["target"] == targets[-1]].merge(single, on=["variable", "metric", "time"])
+        assert len(swept) == len(single)
+        assert np.allclose(swept["value_x"], swept["value_y"], equal_nan=True)
+
+    def test_evaluator_streaming(self, mocker):
+        """
+        Test enstools-compressor evaluate --streaming -g
+        """
+        import enstools.compression.cli
+        from enstools.compression.compressor import compress
+        file_name = "dataset_%iD.nc" % 3
+        file_path = self.input_directory_path / file_name
+        compressed_path = self.output_directory_path / file_name
+        compress(file_path, output=compressed_path, compression="lossy,zfp,rate,2.0")
+        commands = ["_", "evaluate", "-r", str(file_path), "-t", str(compressed_path), "--streaming", "-g",
+                    "--workers", "2"]
+        mocker.patch("sys.argv", commands)
+        enstools.compression.cli.main()
+
     def test_evaluator_with_gradients(self, mocker):
         """
         Test enstools-compressor evaluate
@@ -221,3 +308,34 @@ class TestCommandLineInterface(TestClass):
         commands = ["_", "prune", str(file_path), "-o", str(self.output_directory_path)]
         mocker.patch("sys.argv", commands)
         enstools.compression.cli.main()
+
+    def test_emulators(self, mocker, tmp_path, monkeypatch):
+        """
+        Test enstools-compression emulators
+        """
+        import enstools.compression.cli
+        import enstools.compression.emulators.registry as registry
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+        monkeypatch.setattr(registry, "_selection", None)
+        commands = ["_", "emulators"]
+        mocker.patch("sys.argv", commands)
+        enstools.compression.cli.main()
+        assert registry.selection_file_path().exists()
+
+    def test_estimate(self, mocker):
+        """
+        Test enstools-compression estimate
+        """
+        import enstools.compression.cli
+        file_name = "dataset_%iD.nc" % 3
+        file_path = self.input_directory_path / file_name
+
+        commands = ["_", "estimate", str(file_path), "--compression", "lossy,sz,rel,1e-3", "--fraction", "0.5"]
+        mocker.patch("sys.argv", commands)
+        enstools.compression.cli.main()
+
+        # A quota smaller than the compressed size
+        commands = ["_", "estimate", str(file_path), "--quota", "1KB"]
+        mocker.patch("sys.argv", commands)
+        with pytest.raises(SystemExit):
+            enstools.compression.cli.main()
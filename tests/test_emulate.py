@@ -40,6 +40,56 @@ class TestEmulators:
         _ = analysis_compressor.compress_and_decompress(data)
         print(f"Compression Ratio:{analysis_compressor.compression_ratio():.2f}")
 
+    def test_LibpressioEmulator_shared_compressor(self, mocker):
+        """
+        Check that emulators sharing a compressor of the session keep their own error bound and compression ratio.
+        libpressio is replaced by a fake module whose compressed size depends on the error bound.
+        """
+        import sys
+        import types
+        from enstools.compression.emulators import LibpressioEmulator
+        from enstools.compression.emulators.libpressio_emulator import clear_session
+
+        class FakePressioCompressor:
+            instances = 0
+
+            def __init__(self, config):
+                FakePressioCompressor.instances += 1
+                self.options = dict(config["compressor_config"])
+
+            @classmethod
+            def from_config(cls, config):
+                return cls(config)
+
+            def set_options(self, options):
+                self.options.update(options)
+
+            def encode(self, data):
+                # The rate is the number of bits per value
+                return np.zeros(int(data.size * self.options["zfp:rate"] / 8), dtype=np.uint8)
+
+            def decode(self, compressed, template):
+                assert compressed.size == int(template.size * self.options["zfp:rate"] / 8)
+                return np.zeros_like(template)
+
+            def get_metrics(self):
+                raise AssertionError("The metrics of a shared compressor can belong to another emulator.")
+
+        mocker.patch.dict(sys.modules, {"libpressio": types.SimpleNamespace(PressioCompressor=FakePressioCompressor)})
+        clear_session()
+        data = np.random.random((10, 20, 30)).astype(np.float32)
+        first = LibpressioEmulator(VariableEncoding("lossy,zfp,rate,4"), data)
+        second = LibpressioEmulator(VariableEncoding("lossy,zfp,rate,8"), data)
+        assert FakePressioCompressor.instances == 1
+
+        for _ in range(2):
+            first.compress_and_decompress(data)
+            assert first.compression_ratio() == 8
+            second.compress_and_decompress(data)
+            assert second.compression_ratio() == 4
+            assert first.compression_ratio() == 8
+        clear_session()
+
     def test_FilterEmulator(self):
         from enstools.compression.emulators import FilterEmulator
         settings = {
@@ -84,6 +134,39 @@ class TestEmulators:
         _ = analysis_compressor.compress_and_decompress(data)
         print(f"Compression Ratio:{analysis_compressor.compression_ratio():.2f}")
 
+    def test_compressed_size(self):
+        """
+        Check that compressed_size matches the compression ratio obtained when also decompressing.
+        """
+        from enstools.compression.emulators import FilterEmulator, ZFPEmulator
+        data = np.random.random((100, 100))
+        encoding = VariableEncoding("lossy,zfp,rate,3.2")
+        for emulator_class in [FilterEmulator, ZFPEmulator]:
+            emulator = emulator_class(encoding, uncompressed_data=data)
+            compressed_size = emulator.compressed_size(data)
+            emulator.compress_and_decompress(data)
+            assert compressed_size == round(data.nbytes / emulator.compression_ratio())
+
+    def test_output_buffer(self):
+        """
+        Check that the emulators accept read-only inputs and write into preallocated buffers, including views.
+        """
+        from enstools.compression.emulators import FilterEmulator, ZFPEmulator
+        data = np.random.random((100, 100))
+        data.setflags(write=False)
+        encoding = VariableEncoding("lossy,zfp,rate,3.2")
+        for emulator_class in [FilterEmulator, ZFPEmulator]:
+            expected = emulator_class(encoding, uncompressed_data=data).compress_and_decompress(data)
+            out = np.empty_like(data)
+            result = emulator_class(encoding, uncompressed_data=data).compress_and_decompress(data, out=out)
+            assert result is out
+            assert np.array_equal(out, expected)
+
+            buffer = np.zeros((100, 200))
+            emulator_class(encoding, uncompressed_data=data).compress_and_decompress(data, out=buffer[:, ::2])
+            assert np.array_equal(buffer[:, ::2], expected)
+            assert not buffer[:, 1::2].any()
+
 
 class TestEmulate(TestClass):
     def test_emulation(self):
@@ -161,3 +244,273 @@ class TestEmulate(TestClass):
                             if not np.allclose(compressed_ds[variable], emulated_ds[variable]):
                                 raise AssertionError(f"{ds_name=} {variable=} {compression_specification=}")
 
+
+    def test_parallel_emulation(self):
+        """
+        Test that the chunk-parallel emulation gives the same results that the emulation of the full array
+        when the chunks evenly divide the array.
+        """
+        from enstools.compression.emulation import emulate_compression_on_numpy_array, \
+            emulate_compression_on_numpy_array_by_chunks
+
+        data = np.random.random((8, 60, 40))
+        for compression_specification in ["lossy,zfp,rate,3.2", "lossy,sz,abs,0.01", "lossless"]:
+            encoding = VariableEncoding(compression_specification)
+            encoding.set_chunk_sizes((2, 30, 40))
+            serial, serial_metrics = emulate_compression_on_numpy_array(data, encoding)
+            parallel, parallel_metrics = emulate_compression_on_numpy_array_by_chunks(data, encoding, workers=4)
+            assert np.array_equal(serial, parallel)
+            assert parallel_metrics["compression_ratio"] > 0
+
+    def test_parallel_emulation_uneven_chunks(self):
+        from enstools.io import read
+        from enstools.compression.emulation import emulate_compression_on_data_array
+        input_path = self.input_directory_path / "dataset_3D.nc"
+        with read(input_path) as ds:
+            # The edge chunks are padded with the fill value, zfp needs it to be finite
+            ds["temperature"].encoding["_FillValue"] = None
+            encoding = VariableEncoding("lossy,zfp,rate,4")
+            encoding.set_chunk_sizes((1, 7, 50, 50))
+            emulated, metrics = emulate_compression_on_data_array(ds["temperature"], encoding, in_place=False,
+                                                                  parallel=True, workers=2)
+            assert emulated.shape == ds["temperature"].shape
+            assert np.allclose(emulated, ds["temperature"], atol=1.)
+            assert metrics["compression_ratio"] > 1
+
+    def test_emulation_matches_written_file(self):
+        """
+        Test that the emulation uses the same chunks as the writer, so the decompressed values and the compressed
+        size of each variable are the ones of the compressed file.
+        """
+        import h5py
+        import enstools.encoding.chunk_size
+        from enstools.compression.api import compress
+        from enstools.compression.emulation import emulate_compression_on_dataset
+        from enstools.io import read
+
+        input_path = self.input_directory_path / "dataset_3D.nc"
+        output_path = self.output_directory_path / "dataset_3D_chunks.nc"
+        compression = "temperature:lossy,zfp,rate,4 precipitation:lossy,sz,rel,0.01"
+        default_chunk_size = enstools.encoding.chunk_size.chunk_size
+        # Small chunks that don't divide the array evenly
+        enstools.encoding.chunk_size.chunk_size = "300KB"
+        try:
+            compress(input_path, output_path, compression=compression, nodes=0)
+            with read(input_path) as ds:
+                emulated, metrics = emulate_compression_on_dataset(ds.load(), compression, in_place=False)
+        finally:
+            enstools.encoding.chunk_size.chunk_size = default_chunk_size
+
+        with h5py.File(output_path, "r") as written:
+            for variable in ["temperature", "precipitation"]:
+                assert np.array_equal(written[variable][()], emulated[variable].values)
+                chunk_compressed_sizes = metrics[variable]["chunk_compressed_sizes"]
+                assert chunk_compressed_sizes.size > 1
+                assert chunk_compressed_sizes.sum() == written[variable].id.get_storage_size()
+
+    def test_parallel_dataset_emulation(self):
+        """
+        Test that emulating the variables of a dataset concurrently gives the same results as doing it sequentially.
+        """
+        from enstools.io import read
+        from enstools.compression.emulation import emulate_compression_on_dataset
+
+        input_path = self.input_directory_path / "dataset_3D.nc"
+        with read(input_path) as ds:
+            ds.load()
+            compression = "temperature:lossy,zfp,rate,4 precipitation:lossy,sz,rel,0.01"
+            sequential, sequential_metrics = emulate_compression_on_dataset(ds, compression, in_place=False)
+            for processes in [False, True]:
+                parallel, parallel_metrics = emulate_compression_on_dataset(ds, compression, in_place=False,
+                                                                            workers=2, processes=processes)
+                for variable in ["temperature", "precipitation"]:
+                    assert np.array_equal(sequential[variable].values, parallel[variable].values)
+                    assert not np.array_equal(ds[variable].values, parallel[variable].values)
+                assert sequential_metrics == parallel_metrics
+
+    def test_lossless_estimation(self):
+        """
+        Test that the compressed size of the lossless variables is estimated and included in the predicted size.
+        """
+        from enstools.io import read
+        from enstools.compression.emulation import emulate_compression_on_dataset, estimate_compressed_size, \
+            predicted_file_size
+
+        input_path = self.input_directory_path / "dataset_3D.nc"
+        with read(input_path) as ds:
+            ds.load()
+            compression = "temperature:lossy,zfp,rate,4 precipitation:lossless,blosclz,5"
+            # By default, only the lossy variables are emulated
+            _, metrics = emulate_compression_on_dataset(ds, compression, in_place=False)
+            assert set(metrics) == {"temperature"}
+
+            _, metrics = emulate_compression_on_dataset(ds, compression, in_place=False, estimate_lossless=True)
+            assert metrics["temperature"]["compressed_size_error"] == 0.
+            assert metrics["precipitation"]["compression_ratio"] > 1
+            size, (lower, upper) = predicted_file_size(metrics)
+            assert size == metrics["temperature"]["compressed_size"] + metrics["precipitation"]["compressed_size"]
+            assert lower <= size <= upper
+
+            # Sampling only some of the chunks
+            data = ds["precipitation"].values
+            encoding = VariableEncoding("lossless,blosclz,5")
+            chunk_sizes = (1, 1, *data.shape[2:])
+            exact = estimate_compressed_size(data, encoding, chunk_sizes=chunk_sizes, max_chunks=data.size)
+            sampled = estimate_compressed_size(data, encoding, chunk_sizes=chunk_sizes, max_chunks=8)
+            assert exact.standard_error == 0.
+            assert sampled.standard_error > 0.
+            assert abs(sampled.size - exact.size) / exact.size < 0.1
+
+    def test_lazy_emulation(self):
+        """
+        Test that the lazy emulation of a dask-backed data array gives the same results as the eager one.
+        """
+        import dask
+        import xarray
+        from enstools.compression.emulation import emulate_compression_on_data_array
+
+        input_path = self.input_directory_path / "dataset_3D.nc"
+        with xarray.open_dataset(input_path, chunks={"time": 1}) as ds:
+            encoding = VariableEncoding("lossy,zfp,rate,4")
+            # Both emulations follow the chunks of the encoding
+            encoding.set_chunk_sizes((1, *ds["temperature"].shape[1:]))
+            lazy, lazy_metrics = emulate_compression_on_data_array(ds["temperature"], encoding, in_place=False,
+                                                                   lazy=True)
+            assert lazy.chunks is not None
+            lazy, lazy_metrics = dask.compute(lazy, lazy_metrics)
+
+            eager, eager_metrics = emulate_compression_on_data_array(ds["temperature"].load(), encoding,
+                                                                     in_place=False, parallel=True)
+            assert np.array_equal(lazy.values, eager.values)
+            assert lazy_metrics["compression_ratio"] > 1
+
+        # In place, the emulated blocks replace the data of the input data array
+        with xarray.open_dataset(input_path, chunks={"time": 1}) as ds:
+            data_array = ds["temperature"]
+            emulated, _ = emulate_compression_on_data_array(data_array, encoding, in_place=True, lazy=True)
+            assert emulated is data_array
+            assert data_array.chunks is not None
+            assert np.array_equal(data_array.values, lazy.values)
+
+    def test_emulation_with_metrics(self):
+        """
+        Test that the fused emulation gives the same compression ratio and metrics as emulating and then computing
+        the metrics.
+        """
+        from scipy.stats import pearsonr
+        from enstools.compression.emulation import emulate_compression_on_numpy_array_by_chunks, \
+            emulate_compression_with_metrics
+
+        data = np.random.random((8, 60, 40))
+        encoding = VariableEncoding("lossy,sz,abs,0.01")
+        encoding.set_chunk_sizes((2, 30, 40))
+        decompressed, metrics = emulate_compression_on_numpy_array_by_chunks(data, encoding)
+        fused_decompressed, fused_metrics = emulate_compression_with_metrics(data, encoding, keep_decompressed=True)
+        assert np.array_equal(decompressed, fused_decompressed)
+        assert np.isclose(metrics["compression_ratio"], fused_metrics["compression_ratio"])
+        assert np.isclose(fused_metrics["mean_square_error"], np.mean((data - decompressed) ** 2))
+        assert np.isclose(fused_metrics["max_abs_error"], np.max(np.abs(data - decompressed)))
+        assert np.isclose(fused_metrics["pearson_correlation"], pearsonr(data.ravel(), decompressed.ravel())[0])
+
+        discarded, _ = emulate_compression_with_metrics(data, encoding)
+        assert discarded is None
+
+        # The NaNs are left out of the metrics
+        data_with_nan = data.copy()
+        data_with_nan[3, 10, 10] = np.nan
+        nan_decompressed, nan_metrics = emulate_compression_with_metrics(data_with_nan, encoding,
+                                                                         keep_decompressed=True)
+        valid = ~(np.isnan(data_with_nan) | np.isnan(nan_decompressed))
+        assert np.isclose(nan_metrics["mean_square_error"],
+                          np.mean((data_with_nan[valid] - nan_decompressed[valid]) ** 2))
+        assert np.isfinite(nan_metrics["ks_I"])
+
+        # Each chunk is read only once
+        class CountingArray:
+            def __init__(self, array):
+                self.array, self.shape, self.dtype, self.reads = array, array.shape, array.dtype, 0
+
+            def __getitem__(self, slices):
+                self.reads += 1
+                return self.array[slices]
+
+        counting = CountingArray(data)
+        _, counted_metrics = emulate_compression_with_metrics(counting, encoding)
+        assert counting.reads == 8
+        assert np.isclose(counted_metrics["mean_square_error"], fused_metrics["mean_square_error"])
+
+
+class TestEmulationCache:
+    def test_cache_hits(self):
+        import xarray
+        from enstools.compression import emulation_cache
+        from enstools.compression.emulation import emulate_compression_on_data_array
+
+        cache = emulation_cache.enable_emulation_cache(max_memory="10MB")
+        try:
+            data_array = xarray.DataArray(np.random.random((50, 50)))
+            encoding = VariableEncoding("lossy,zfp,rate,3.2")
+            first, first_metrics = emulate_compression_on_data_array(data_array, encoding, in_place=False)
+            second, second_metrics = emulate_compression_on_data_array(data_array, encoding, in_place=False)
+            assert np.array_equal(first, second)
+            assert first_metrics == second_metrics
+            assert cache.statistics["hits"] == 1
+            assert cache.statistics["misses"] == 1
+            # Modifying the results can't modify the cache
+            second.values[:] = 0
+            third, _ = emulate_compression_on_data_array(data_array, encoding, in_place=False)
+            assert np.array_equal(first, third)
+        finally:
+            emulation_cache.disable_emulation_cache()
+
+    def test_cache_hits_with_processes(self):
+        import xarray
+        from enstools.compression import emulation_cache
+        from enstools.compression.emulation import emulate_compression_on_dataset
+
+        cache = emulation_cache.enable_emulation_cache(max_memory="10MB")
+        try:
+            dataset = xarray.Dataset({name: (("x", "y"), np.random.random((50, 50))) for name in ("a", "b", "c")})
+            compression = "lossy,zfp,rate,3.2"
+            first, _ = emulate_compression_on_dataset(dataset, compression, in_place=False, workers=2, processes=True)
+            second, _ = emulate_compression_on_dataset(dataset, compression, in_place=False, workers=2,
+                                                       processes=True)
+            for name in dataset.data_vars:
+                assert np.array_equal(first[name], second[name])
+                assert not np.array_equal(first[name], dataset[name])
+            assert cache.statistics["misses"] == 3
+            assert cache.statistics["hits"] == 3
+        finally:
+            emulation_cache.disable_emulation_cache()
+
+    def test_cache_eviction(self):
+        from enstools.compression.emulation_cache import EmulationCache
+        encoding = VariableEncoding("lossy,zfp,rate,3.2")
+        cache = EmulationCache(max_memory=3 * 8 * 100)
+        arrays = [np.random.random(100) for _ in range(4)]
+        keys = [cache.key(array, encoding) for array in arrays]
+        for key, array in zip(keys, arrays):
+            cache.put(key, array, {"compression_ratio": 1})
+        assert len(cache) == 3
+        assert cache.get(keys[0]) is None
+        assert cache.statistics["evictions"] == 1
+        assert cache.statistics["memory"] <= cache.max_memory
+
+
+class TestEmulatorRegistry:
+    def test_auto_selection(self, tmp_path, monkeypatch):
+        import enstools.compression.emulators.registry as registry
+        from enstools.compression.emulators import FilterEmulator
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+        monkeypatch.setattr(registry, "_selection", None)
+
+        encoding = VariableEncoding("lossy,zfp,rate,8")
+        assert registry.get_emulator(encoding) is FilterEmulator
+
+        monkeypatch.setattr(registry, "auto_selection", True)
+        emulator_class = registry.get_emulator(encoding, np.float32)
+        assert emulator_class in registry.EMULATOR_BACKENDS.values()
+        assert registry.selection_file_path().exists()
+        # Compressors with a single backend don't need a benchmark
+        assert registry.get_emulator(VariableEncoding("lossy,sz3,abs,0.1")) is FilterEmulator
+        assert registry.get_emulator(VariableEncoding("lossless")) is FilterEmulator
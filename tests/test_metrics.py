@@ -91,7 +91,356 @@ class TestMetrics(TestClass):
             test_metrics=test_metrics,
         )
 
+    def test_fast_ssim(self):
+        """
+        Check that the tiled SSIM matches the one of enstools.scores within the documented tolerance.
+        The single precision results are compared with the double precision ssim_I of enstools.scores.
+        """
+        import numpy as np
+        import enstools.scores
+        from enstools.compression.metrics import DataArrayMetrics
+        from enstools.io import read
+
+        for dimension in [2, 3, 4]:
+            with read(self.input_directory_path / f"dataset_{dimension}D.nc") as dataset:
+                for variable in dataset.data_vars:
+                    for dtype, tolerance in [(np.float64, 1e-3), (np.float32, 1e-2)]:
+                        reference = dataset[variable].astype(dtype)
+                        noise = np.random.normal(scale=3e-2 * float(reference.std()), size=reference.shape)
+                        target = (reference + noise).astype(dtype)
+                        expected = enstools.scores.ssim_I(reference.astype(np.float64), target.astype(np.float64))
+                        assert np.allclose(DataArrayMetrics(reference, target)["ssim_I"], expected, atol=tolerance)
+
+    def test_dataset_metrics_compute(self):
+        """
+        Check that the metrics computed on the pool of workers match the ones of each variable.
+        """
+        import numpy as np
+        from enstools.compression.metrics import DatasetMetrics
+
+        file_path = self.input_directory_path / "dataset_3D.nc"
+        dataset_metrics = DatasetMetrics(str(file_path), str(file_path))
+        assert not dataset_metrics.metrics
+
+        metric_names = ["correlation_I", "nrmse_I", "ssim_I"]
+        results = dict(dataset_metrics.compute(metric_names, workers=2))
+        assert set(results) == set(dataset_metrics.variables)
+        for variable, metrics in results.items():
+            for metric in metric_names:
+                assert np.array_equal(metrics[metric], dataset_metrics[variable][metric]), metric
+
+        streamed = dict(dataset_metrics.compute(metric_names, workers=2, streaming=True))
+        assert set(streamed) == set(dataset_metrics.variables)
+        assert all(set(metrics) == {"correlation_I", "nrmse_I"} for metrics in streamed.values())
+
+    def test_parallel_plots(self):
+        """
+        Check that the plots rendered on a pool of processes are produced for all the variables.
+        """
+        from enstools.compression.metrics import DatasetMetrics
+
+        file_path = self.input_directory_path / "dataset_3D.nc"
+        output_folder = self.output_directory_path / "report"
+        dataset_metrics = DatasetMetrics(str(file_path), str(file_path))
+        dataset_metrics.make_plots(workers=2, output_folder=str(output_folder))
+        for variable in dataset_metrics.variables:
+            assert (output_folder / f"report_{variable}.png").exists()
+
+    def test_parallel_plots_failure(self, mocker):
+        """
+        Check that the shared memory of all the plots is released when one of them fails.
+        """
+        from multiprocessing import shared_memory
+        import pytest
+        import enstools.compression.metrics as metrics_module
+        from enstools.compression.metrics import DatasetMetrics
+
+        to_shared_memory = metrics_module._to_shared_memory
+        names = []
+
+        def recording_to_shared_memory(array, blocks):
+            info = to_shared_memory(array, blocks)
+            names.append(info[0])
+            return info
+
+        def failing_render_summary_plot(variable_name, *args, **kwargs):
+            raise RuntimeError(f"Can't plot {variable_name}")
+
+        mocker.patch.object(metrics_module, "_to_shared_memory", recording_to_shared_memory)
+        # The workers are forked, so they get the patched function too
+        mocker.patch.object(metrics_module, "render_summary_plot", failing_render_summary_plot)
+        file_path = self.input_directory_path / "dataset_3D.nc"
+        dataset_metrics = DatasetMetrics(str(file_path), str(file_path))
+        with pytest.raises(RuntimeError):
+            dataset_metrics.make_plots(workers=2, output_folder=str(self.output_directory_path / "report"))
+        assert len(names) == 2 * len(dataset_metrics.variables)
+        for name in names:
+            with pytest.raises(FileNotFoundError):
+                shared_memory.SharedMemory(name=name)
+
+    def test_metrics_table(self):
+        """
+        Check the tidy table returned by evaluate and that it can be written as CSV and NetCDF.
+        """
+        import pandas
+        from enstools.compression.evaluator import evaluate, write_table, TABLE_COLUMNS
+
+        file_path = self.input_directory_path / "dataset_3D.nc"
+        table = evaluate(file_path, file_path, verbose=False)
+        assert list(table.columns) == TABLE_COLUMNS
+        assert set(table["variable"]) == {"temperature", "precipitation"}
+        # Two time steps for each variable and metric
+        assert len(table) == 2 * table.groupby(["variable", "metric"]).ngroups
+        assert table["passed"].all()
+
+        write_table(table, self.output_directory_path / "metrics.csv")
+        assert len(pandas.read_csv(self.output_directory_path / "metrics.csv")) == len(table)
+        write_table(table, self.output_directory_path / "metrics.nc")
+        assert xarray.open_dataset(self.output_directory_path / "metrics.nc")["value"].size == len(table)
+
     def test_convert_size(self):
         from enstools.compression.size_metrics import readable_size
         file_path = self.input_directory_path / "dataset_2D.nc"
         readable_size(file_path)
+
+
+class TestAccumulators:
+    def test_merge(self):
+        """
+        Check that merging the accumulators of different chunks gives the same result as a single accumulator.
+        """
+        import numpy as np
+        from scipy.stats import ks_2samp
+        from enstools.compression.accumulators import ErrorAccumulator, histogram_bin_edges
+
+        reference = np.random.random(10000)
+        target = reference + np.random.normal(scale=0.01, size=reference.shape)
+        bin_edges = histogram_bin_edges(0., 1., bins=1000)
+
+        full = ErrorAccumulator(bin_edges=bin_edges).update(reference, target)
+        merged = ErrorAccumulator(bin_edges=bin_edges)
+        for chunk in range(0, reference.size, 3000):
+            merged.merge(ErrorAccumulator(bin_edges=bin_edges).update(reference[chunk:chunk + 3000],
+                                                                      target[chunk:chunk + 3000]))
+        for metric, value in full.results().items():
+            assert np.isclose(value, merged.results()[metric]), metric
+
+        assert np.isclose(full.results()["mean_square_error"], np.mean((reference - target) ** 2))
+        assert np.isclose(full.results()["pearson_correlation"], np.corrcoef(reference, target)[0, 1])
+        assert abs(full.results()["ks_statistic"] - ks_2samp(reference, target).statistic) < 0.01
+
+
+    def test_mergeable_histogram(self):
+        """
+        Check that merging adaptive histograms of chunks with different value ranges keeps all the values.
+        """
+        import numpy as np
+        from enstools.compression.accumulators import MergeableHistogram
+
+        values = np.random.normal(size=100000)
+        chunks = [values[:10] * 1e-3, values[10:50000], values[50000:] * 100 + 50]
+        histogram = MergeableHistogram(bins=1000)
+        for chunk in chunks:
+            histogram.merge(MergeableHistogram(bins=1000).update(chunk))
+        all_values = np.concatenate(chunks)
+
+        assert histogram.count == all_values.size
+        assert np.array_equal(histogram.counts, np.histogram(all_values, bins=histogram.bin_edges)[0])
+        width = histogram.bin_edges[1] - histogram.bin_edges[0]
+        assert abs(histogram.quantile(0.75) - np.quantile(all_values, 0.75)) < width
+
+    def test_streaming_metrics(self):
+        """
+        Check that the metrics computed in a single pass match the ones of DataArrayMetrics.
+        """
+        import numpy as np
+        from enstools.compression.metrics import DataArrayMetrics
+        from enstools.compression.streaming_metrics import stream_metrics
+
+        reference = xarray.DataArray(np.random.random((3, 20, 30, 40)), dims=("time", "level", "lat", "lon"),
+                                     coords={"time": [0, 1, 2]})
+        target = reference + np.random.normal(scale=0.01, size=reference.shape)
+        streamed = stream_metrics(reference, target, chunk_size="10KB", workers=2)
+        exact = DataArrayMetrics(reference, target)
+
+        for metric in ["mean_square_error", "pearson_correlation", "correlation_I", "peak_signal_to_noise_ratio"]:
+            assert np.allclose(streamed[metric], exact[metric]), metric
+        assert np.allclose(streamed["nrmse_I"], exact["nrmse_I"], atol=1e-3)
+        assert np.allclose(streamed["max_abs_error"], np.abs(target - reference).max(dim=["level", "lat", "lon"]))
+        assert np.all(streamed["min_error"] < 0) and np.all(streamed["max_error"] > 0)
+
+        # A constant reference or target gives an undefined correlation in both cases
+        constant = xarray.zeros_like(reference)
+        for pair in [(constant, target), (reference, constant)]:
+            streamed = stream_metrics(*pair, chunk_size="10KB", workers=2)
+            exact = DataArrayMetrics(*pair)
+            assert np.isnan(streamed["pearson_correlation"]).all() and np.isnan(exact["pearson_correlation"]).all()
+            assert np.array_equal(streamed["correlation_I"], exact["correlation_I"])
+
+    def test_streaming_gradients(self):
+        """
+        Check that the streamed metrics of the gradients match the ones of the gradient variables.
+        """
+        import numpy as np
+        from enstools.compression.metrics import DataArrayMetrics, array_gradient
+        from enstools.compression.streaming_metrics import stream_metrics
+
+        reference = xarray.DataArray(np.random.random((3, 20, 30)).astype(np.float32), dims=("time", "lat", "lon"),
+                                     coords={"time": [0, 1, 2]}, name="variable")
+        target = reference + np.random.normal(scale=0.01, size=reference.shape).astype(np.float32)
+        reference_gradient, target_gradient = array_gradient(reference), array_gradient(target)
+        assert reference_gradient.dtype == np.float32 and reference_gradient.name == "variable_gradient"
+
+        streamed = stream_metrics(reference, target, workers=2, gradient_order=1)
+        exact = DataArrayMetrics(reference_gradient, target_gradient)
+        for metric in ["mean_square_error", "pearson_correlation", "correlation_I"]:
+            assert np.allclose(streamed[metric], exact[metric], rtol=1e-4), metric
+
+        streamed = stream_metrics(reference, target, workers=2, gradient_order=2)
+        exact = DataArrayMetrics(array_gradient(reference_gradient), array_gradient(target_gradient))
+        assert np.allclose(streamed["mean_square_error"], exact["mean_square_error"], rtol=1e-4)
+
+
+class TestMetricRegistry:
+    def test_registry(self):
+        """
+        Check that the registry is only rebuilt when new scores are registered.
+        """
+        import numpy as np
+        from enstools.scores import register_score, mean_square_error
+        from enstools.compression.metrics import DataArrayMetrics, metric_registry
+
+        assert set(metrics) <= set(metric_registry.pairwise())
+        assert metric_registry["ssim_I"].higher_is_better
+        assert metric_registry["mean_square_error"].cost == "cheap"
+        assert not metric_registry["mean_square_error"].reference_only
+
+        builds = metric_registry.builds
+        reference = np.random.random((10, 10))
+        for _ in range(10):
+            _ = DataArrayMetrics(reference, reference)["correlation_I"]
+        assert metric_registry.builds == builds
+
+        def registry_test_metric(reference, target):
+            return mean_square_error(reference, target)
+
+        register_score(registry_test_metric, "registry_test_metric")
+        assert "registry_test_metric" in metric_registry
+        assert metric_registry["registry_test_metric"].higher_is_better is None
+        assert metric_registry.builds == builds + 1
+
+    def test_shared_intermediates(self):
+        """
+        Check that the metrics computed from the shared intermediates match the ones of enstools.scores.
+        """
+        import numpy as np
+        import enstools.scores
+        from enstools.compression.metrics import DataArrayMetrics
+
+        reference = xarray.DataArray(np.random.random((3, 20, 30)), dims=["time", "lat", "lon"])
+        target = reference + np.random.normal(scale=1e-3, size=reference.shape)
+        data_array_metrics = DataArrayMetrics(reference.copy(), target.copy())
+
+        for metric in ["mean_square_error", "root_mean_square_error", "nrmse_I", "psnr"]:
+            expected = getattr(enstools.scores, metric)(reference, target)
+            assert np.array_equal(data_array_metrics[metric].values, expected.values), metric
+        for metric in ["pearson_correlation", "correlation_I"]:
+            expected = getattr(enstools.scores, metric)(reference, target)
+            assert np.allclose(data_array_metrics[metric].values, expected.values, rtol=1e-8), metric
+
+        # The mean square error is computed once and reused
+        mean_square_error = data_array_metrics.intermediate_values["mean_square_error"]
+        assert data_array_metrics.intermediate("mean_square_error") is mean_square_error
+
+    def test_reference_statistics(self):
+        """
+        Check that the statistics of the reference are shared by several targets only when the NaNs match.
+        """
+        import numpy as np
+        from enstools.compression.metrics import DataArrayMetrics, ReferenceStatistics
+
+        reference = xarray.DataArray(np.random.random((2, 20, 30)), dims=("time", "lat", "lon"))
+        targets = [reference + np.random.normal(scale=scale, size=reference.shape) for scale in (1e-3, 1e-2)]
+        reference_statistics = ReferenceStatistics()
+        shared = [DataArrayMetrics(reference, target, reference_statistics=reference_statistics) for target in targets]
+        for target, metrics in zip(targets, shared):
+            for metric in ["nrmse_I", "correlation_I", "peak_signal_to_noise_ratio"]:
+                assert np.array_equal(metrics[metric], DataArrayMetrics(reference, target)[metric]), metric
+        assert shared[0].intermediate("reference_anomaly") is shared[1].intermediate("reference_anomaly")
+
+        # A target with NaNs at other points doesn't use the shared statistics
+        target = targets[0].copy()
+        target[0, 0, 0] = np.nan
+        metrics = DataArrayMetrics(reference, target, reference_statistics=reference_statistics)
+        assert not metrics.shares_reference_statistics()
+        assert np.array_equal(metrics["correlation_I"], DataArrayMetrics(reference, target)["correlation_I"])
+
+    def test_reference_statistics_threads(self, mocker):
+        """
+        Check that the statistics of the reference are computed once when several threads need them at the same time,
+        and that they are released when all the targets are done.
+        """
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        import numpy as np
+        import enstools.compression.metrics as metrics_module
+        from enstools.compression.metrics import DatasetMetrics, ReferenceStatistics
+
+        inter_quartile_range = metrics_module._inter_quartile_range
+        calls = []
+
+        def slow_inter_quartile_range(*args, **kwargs):
+            calls.append(1)
+            time.sleep(0.1)
+            return inter_quartile_range(*args, **kwargs)
+
+        mocker.patch.object(metrics_module, "_inter_quartile_range", slow_inter_quartile_range)
+        reference = xarray.Dataset({"temperature": (("time", "lat", "lon"), np.random.random((2, 20, 30)))})
+        targets = [reference + np.random.normal(scale=scale, size=(2, 20, 30)) for scale in (1e-4, 1e-3, 1e-2, 1e-1)]
+        reference_statistics = {"temperature": ReferenceStatistics(targets=len(targets))}
+
+        def evaluate(target):
+            comparison = DatasetMetrics(reference, target, reference_statistics=reference_statistics)
+            return dict(comparison.compute(["nrmse_I"], workers=1))
+
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            results = list(executor.map(evaluate, targets))
+        assert len(calls) == 1
+        assert reference_statistics["temperature"].done == len(targets)
+        assert "reference_anomaly" not in reference_statistics["temperature"]
+        assert "valid" not in reference_statistics["temperature"]
+        for target, result in zip(targets, results):
+            expected = DatasetMetrics(reference, target)["temperature"]["nrmse_I"]
+            assert np.allclose(result["temperature"]["nrmse_I"], expected)
+
+    def test_nan_mask(self):
+        """
+        Check that the NaNs are left out of the metrics without modifying the inputs.
+        """
+        import numpy as np
+        from scipy.stats import ks_2samp
+        from enstools.compression.metrics import DataArrayMetrics
+
+        reference = xarray.DataArray(np.random.random((2, 30, 40)), dims=["time", "lat", "lon"])
+        target = reference + np.random.normal(scale=1e-3, size=reference.shape)
+        reference[0, :5, :7] = np.nan
+        target[1, 10:12, 20] = np.nan
+        reference_values, target_values = reference.values.copy(), target.values.copy()
+        data_array_metrics = DataArrayMetrics(reference, target)
+
+        valid = ~(np.isnan(reference_values) | np.isnan(target_values))
+        for time_step in range(2):
+            step_reference = reference_values[time_step][valid[time_step]]
+            step_target = target_values[time_step][valid[time_step]]
+            assert np.isclose(data_array_metrics["mean_square_error"][time_step],
+                              np.mean((step_target - step_reference) ** 2))
+            assert np.isclose(data_array_metrics["pearson_correlation"][time_step],
+                              np.corrcoef(step_reference, step_target)[0, 1])
+            assert np.isclose(data_array_metrics["kolmogorov_smirnov"][time_step],
+                              ks_2samp(step_target, step_reference).pvalue)
+        assert np.all(np.isfinite(data_array_metrics["ssim_I"]))
+
+        # The inputs are not modified
+        assert np.array_equal(reference.values, reference_values, equal_nan=True)
+        assert np.array_equal(target.values, target_values, equal_nan=True)
+
@@ -32,3 +32,22 @@ class TestPrune(TestClass):
         datasets = ["dataset_%iD.nc" % dimension for dimension in range(2, 4)]
         data_paths = [self.input_directory_path / ds for ds in datasets]
         pruner(data_paths, self.output_directory_path, variables_to_keep=["temperature"])
+
+    def test_vectorized_mutual_information(self):
+        """
+        Check that the mutual information of all the bit positions at once matches the one of each bit position.
+        """
+        import numpy as np
+        from enstools.compression.significant_bits import array_mutual_information, bit_conditional_count, \
+            bit_pair_counts, calculate_bit_mutual_information, extract_bit_at_position, filter_insignificant_values
+        from enstools.io import read
+
+        with read(self.input_directory_path / "dataset_3D.nc") as dataset:
+            for dtype in [np.float32, np.float64]:
+                array = dataset["temperature"][0].values.astype(dtype).ravel()
+                bits = [extract_bit_at_position(array, position) for position in range(array.itemsize * 8)]
+                assert np.array_equal(bit_pair_counts(array), [bit_conditional_count(b) for b in bits])
+
+                expected = np.array([calculate_bit_mutual_information(b) for b in bits], dtype=np.float32)
+                expected = filter_insignificant_values(expected, array.size)
+                assert np.array_equal(array_mutual_information(array), expected)